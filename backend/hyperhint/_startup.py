@@ -0,0 +1,102 @@
+# Build the global singletons on first use instead of at import time
+# The app lifespan builds them up front so the first request does not pay for it
+# Time imports, singleton construction and lifespan steps for a startup report
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Generic, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class StartupTimer:
+    """Wall-clock timings of the phases of one process start"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Dict[str, Any]] = []
+        self.ready_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, kind: str, seconds: float):
+        with self._lock:
+            self.phases.append({"name": name, "kind": kind, "ms": round(seconds * 1000, 1)})
+
+    @contextmanager
+    def phase(self, name: str, kind: str = "startup") -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, kind, time.perf_counter() - started)
+
+    def ready(self):
+        """Mark the app as ready to serve and log the report"""
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        steps = ", ".join(f"{phase['name']} {phase['ms']:g}ms" for phase in self.phases)
+        print(f"Startup ready in {self.ready_ms:g}ms ({steps})")
+
+    def report(self) -> Dict[str, Any]:
+        totals: Dict[str, float] = {}
+        for phase in self.phases:
+            totals[phase["kind"]] = round(totals.get(phase["kind"], 0.0) + phase["ms"], 1)
+        return {"ready_ms": self.ready_ms, "totals_ms": totals, "phases": list(self.phases)}
+
+
+startup_timer = StartupTimer()
+
+
+class Lazy(Generic[T]):
+    """Stand-in for a singleton that builds it on first attribute access"""
+
+    def __init__(self, name: str, factory: Callable[[], T]):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    @property
+    def created(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> T:
+        """Return the instance, building it if needed; safe to call from worker threads"""
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    with startup_timer.phase(self._name, "singleton"):
+                        instance = self._factory()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self.get(), name, value)
+
+    def __len__(self) -> int:
+        return len(self.get())
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.get()[key]
+
+    def __setitem__(self, key: Any, value: Any):
+        self.get()[key] = value
+
+    def __delitem__(self, key: Any):
+        del self.get()[key]
+
+    def __contains__(self, item: Any) -> bool:
+        return item in self.get()
+
+    def __repr__(self) -> str:
+        if self._instance is None:
+            return f"<Lazy {self._name} (not built)>"
+        return repr(self._instance)
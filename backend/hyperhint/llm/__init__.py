@@ -1,45 +1,60 @@
+import asyncio
 import os
 import json
-from typing import Any, AsyncGenerator, Dict, List, Optional
-from pathlib import Path
+import time
+from datetime import datetime
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
+from hyperhint._startup import Lazy
+
+from ._admission import AdmissionController, AdmissionRejected
+from ._balancer import LoadBalancer
+from ._breaker import CircuitBreaker, is_connect_error
+from ._cache import ResponseCache
+from ._config_store import ConfigFile
+from ._deadline import Deadline
+from ._health import HealthProber
+from ._metrics import LLMMetrics
+from ._prompt import PromptBuilder, PromptSection, estimate_tokens, first_answer_line
+from ._singleflight import SingleFlight
+from ._transport import transport_registry
+from ._warmup import WarmupManager
 from ._ollama import OllamaService
 from ._openai import OpenAIService
 
 # Load environment variables
 load_dotenv()
 
+# Workloads that can be routed to their own models
+TASK_TYPES = ("filename", "analysis", "summary", "confirmation", "chat")
+
 
 class ServiceConfig:
     """Configuration for LLM services"""
-    def __init__(self, config_file: str = "llm_config.json"):
-        self.config_file = Path(config_file)
-        self.config = self._load_config()
-    
-    def _load_config(self) -> Dict[str, Any]:
-        """Load configuration from file"""
-        if self.config_file.exists():
-            try:
-                with open(self.config_file, 'r') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading config: {e}")
-        
-        # Return clean slate - no defaults
-        return {
-            "services": {},
-            "default_model": None
-        }
-    
+    def __init__(self, config_file: Optional[str] = None):
+        # Clean slate when there is no file yet - no defaults
+        self.store = ConfigFile(config_file, default=lambda: {"services": {}, "default_model": None})
+        self.config_file = self.store.path
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        return self.store.data
+
     def save_config(self):
-        """Save configuration to file"""
-        try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=2)
-        except Exception as e:
-            print(f"Error saving config: {e}")
+        """Save configuration to file; rapid successive saves are written once, off the event loop"""
+        self.store.save()
+
+    def on_change(self, callback):
+        """Call `callback(previous_config)` when another process changed the file"""
+        self.store.on_change(callback)
+
+    async def start(self):
+        await self.store.start()
+
+    async def stop(self):
+        await self.store.stop()
     
     def add_service(self, service_id: str, service_type: str, config: Dict[str, Any]):
         """Add or update a service configuration"""
@@ -72,86 +87,422 @@ class ServiceConfig:
         """Get the default model"""
         return self.config.get("default_model")
 
+    def get_embedding_model(self) -> Optional[str]:
+        """Get the model used to embed knowledge files, falling back to EMBEDDING_MODEL"""
+        return self.config.get("embedding_model") or os.getenv("EMBEDDING_MODEL") or None
+
+    def set_embedding_model(self, model: Optional[str]):
+        """Set the embedding model; None falls back to EMBEDDING_MODEL"""
+        if model:
+            self.config["embedding_model"] = model
+        else:
+            self.config.pop("embedding_model", None)
+        self.save_config()
+
+    def get_task_routes(self) -> Dict[str, List[str]]:
+        """Get the task routing table: task type -> models in order of preference"""
+        return {
+            task: [models] if isinstance(models, str) else list(models)
+            for task, models in self.config.get("task_routes", {}).items()
+        }
+
+    def set_task_route(self, task: str, models: List[str]):
+        """Route a task type to models in order of preference; an empty list removes the route"""
+        routes = self.config.setdefault("task_routes", {})
+        if models:
+            routes[task] = list(models)
+        else:
+            routes.pop(task, None)
+        self.save_config()
+
 
 class LLMManager:
     def __init__(self):
         self.service_config = ServiceConfig()
         self.services = {}
         self.model_mapping = {}
+        self.embedding_mapping = {}  # embedding model -> services that serve it (config "embedding_models")
+        self.health = HealthProber()
+        self.cache = ResponseCache()
+        self.single_flight = SingleFlight()
+        self.balancer = LoadBalancer()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.admission = AdmissionController()
+        self.metrics = LLMMetrics()
+        self.warmup = WarmupManager()
+        self.first_token_timeout = float(os.getenv("LLM_FIRST_TOKEN_TIMEOUT", "60"))
+        self.idle_timeout = float(os.getenv("LLM_IDLE_TIMEOUT", "30"))
+        self.default_context_length = int(os.getenv("LLM_DEFAULT_CONTEXT_LENGTH", "4096"))
+        self.context_lookup_timeout = float(os.getenv("LLM_CONTEXT_LOOKUP_TIMEOUT", "3"))
+        self._context_lengths: Dict[Tuple[str, str], Optional[int]] = {}  # (service, model) -> discovered window
+        self.complete_timeout = float(os.getenv("LLM_COMPLETE_TIMEOUT", "10"))
+        self.filename_max_tokens = int(os.getenv("LLM_FILENAME_MAX_TOKENS", "16"))
+        self.filename_timeout = float(os.getenv("LLM_FILENAME_TIMEOUT", "5"))
+        self.coalesce_requests = os.getenv("LLM_SINGLEFLIGHT_ENABLED", "True").lower() == "true"
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+        self.embedding_concurrency = int(os.getenv("EMBEDDING_CONCURRENCY", "2"))
+        self.embedding_timeout = float(os.getenv("EMBEDDING_TIMEOUT", "60"))
+
+        # Bookkeeping for incremental reconfiguration
+        self._service_infos: Dict[str, str] = {}  # service_id -> JSON of its last applied config
+        self._instance_streams: Dict[int, int] = {}  # id(service instance) -> streams in flight
+        self._draining: Dict[int, Any] = {}  # replaced instances waiting for their streams to end
         
         # Initialize services from configuration
         self._initialize_services()
         
         # Update mapping with actual available models
         self._update_model_mapping()
+
+        # Follow changes other workers write to the config file
+        self.service_config.on_change(self._apply_reloaded_config)
+
+    def _apply_reloaded_config(self, previous: Dict[str, Any]):
+        """Bring services, routing and warm-up in line with a config reloaded from disk"""
+        self._initialize_services()
+        self._update_model_mapping()
+        if previous.get("default_model") != self.service_config.get_default_model():
+            # The default model is the one preloaded unless a service says otherwise
+            for service_id, service_info in self.service_config.get_services().items():
+                if service_id in self.services:
+                    self._configure_warmup(service_id, service_info)
     
-    def _initialize_services(self):
-        """Initialize services from configuration"""
-        self.services = {}
-        
-        configured_services = self.service_config.get_services()
-        
+    @staticmethod
+    def _connection_settings(service_info: Dict[str, Any]) -> Dict[str, Any]:
+        """The part of a service config that requires a new client when it changes"""
+        config = service_info.get("config", {})
+        return {
+            "type": service_info.get("type"),
+            "host": config.get("host"),
+            "api_key": config.get("api_key"),
+            "base_url": config.get("base_url"),
+            "fast_stream": config.get("fast_stream"),
+        }
+
+    @staticmethod
+    def _create_service(service_type: str, config: Dict[str, Any]) -> Any:
+        if service_type == "ollama":
+            return OllamaService(host=config["host"], fast_stream=config.get("fast_stream"))
+        if service_type == "openai":
+            return OpenAIService(
+                api_key=config.get("api_key"),
+                base_url=config.get("base_url"),
+                fast_stream=config.get("fast_stream")
+            )
+        raise ValueError(f"Unknown service type: {service_type}")
+
+    def _initialize_services(self, prebuilt: Optional[Dict[str, Any]] = None):
+        """Bring self.services in line with the configuration, touching only what changed
+
+        Unchanged services keep their instance. Changed or removed ones are
+        swapped out and closed once the streams still using them finish.
+        `prebuilt` can hand over instances that were already created, e.g.
+        while testing a new service.
+        """
+        prebuilt = dict(prebuilt or {})
+        configured_services = {
+            service_id: service_info
+            for service_id, service_info in self.service_config.get_services().items()
+            if service_info.get("enabled", True)
+        }
+
+        for service_id in list(self.services):
+            if service_id not in configured_services:
+                self._retire_service(self.services.pop(service_id))
+                self._service_infos.pop(service_id, None)
+                self.health.unregister(service_id)
+                self.warmup.remove(service_id)
+
         # No default services - clean slate
         for service_id, service_info in configured_services.items():
-            if not service_info.get("enabled", True):
+            applied = self._service_infos.get(service_id)
+            current = json.dumps(service_info, sort_keys=True)
+            if service_id in self.services and applied == current:
                 continue
-                
-            service_type = service_info["type"]
-            config = service_info["config"]
-            
-            try:
-                if service_type == "ollama":
-                    self.services[service_id] = OllamaService(host=config["host"])
-                elif service_type == "openai":
-                    self.services[service_id] = OpenAIService(
-                        api_key=config.get("api_key"),
-                        base_url=config.get("base_url")
+
+            previous = self.services.get(service_id)
+            needs_client = (
+                previous is None
+                or applied is None
+                or self._connection_settings(json.loads(applied)) != self._connection_settings(service_info)
+            )
+
+            if needs_client:
+                try:
+                    service = prebuilt.pop(service_id, None) or self._create_service(
+                        service_info["type"], service_info["config"]
                     )
-            except Exception as e:
-                print(f"Error initializing service {service_id}: {e}")
+                except Exception as e:
+                    print(f"Error initializing service {service_id}: {e}")
+                    continue
+
+                self.services[service_id] = service
+                self.breakers.pop(service_id, None)  # A new endpoint starts with a clean record
+                if previous is not None:
+                    self._retire_service(previous)
+
+            self._service_infos[service_id] = current
+            self._register_health_probe(service_id, service_info)
+            self._configure_warmup(service_id, service_info)
+
+        # Hand-overs that were not needed still hold transports
+        for service in prebuilt.values():
+            service.close()
+
+    def _retire_service(self, service: Any):
+        """Close a replaced instance now, or once its in-flight streams end"""
+        if self._instance_streams.get(id(service), 0) == 0:
+            service.close()
+        else:
+            self._draining[id(service)] = service
+
+    def _track_stream(self, service: Any, delta: int):
+        key = id(service)
+        remaining = self._instance_streams.get(key, 0) + delta
+        if remaining > 0:
+            self._instance_streams[key] = remaining
+            return
+
+        self._instance_streams.pop(key, None)
+        drained = self._draining.pop(key, None)
+        if drained is not None:
+            drained.close()
+
+    def get_draining_count(self) -> int:
+        """Number of replaced service instances still waiting for their streams to end"""
+        return len(self._draining)
+
+    def _register_health_probe(self, service_id: str, service_info: Dict[str, Any]):
+        """Point the background prober at the current instance of a service"""
+        service = self.services[service_id]
+        if service_info.get("type") == "ollama":
+            configured_models = service_info.get("config", {}).get("models", [])
+            test_model = configured_models[0] if configured_models else None
+
+            def probe(service=service, test_model=test_model):
+                return asyncio.to_thread(service.is_available, test_model)
+
+            self.health.register(service_id, probe)
+        else:
+            level = self._probe_level(service_info.get("config", {}))
+            if level == "none":
+                self.health.register(service_id, None, static_status="configured")
+                return
+
+            def probe(service=service, level=level):
+                return service.probe(level)
+
+            # Each rung has its own timeout, so the whole ladder may need longer than LLM_HEALTH_TIMEOUT
+            self.health.register(service_id, probe, timeout=service.probe_timeout(level))
+
+    @staticmethod
+    def _probe_level(config: Dict[str, Any]) -> str:
+        """Probe level for an OpenAI-compatible service; token-free by default, "completion" must be asked for"""
+        return config.get("probe", os.getenv("OPENAI_HEALTH_PROBE", "models"))
     
+    def _configure_warmup(self, service_id: str, service_info: Dict[str, Any]):
+        """Hand Ollama services to the warm-up scheduler, which preloads once it is running"""
+        if service_info.get("type") != "ollama":
+            self.warmup.remove(service_id)
+            return
+        self.warmup.configure(
+            service_id,
+            self.services[service_id],
+            service_info.get("config", {}),
+            self.service_config.get_default_model(),
+        )
+
     def _update_model_mapping(self):
-        """Update model mapping based on configured models"""
+        """Map every configured model to the pool of services that serve it"""
         self.model_mapping = {}
+        self.embedding_mapping = {}
+        self._context_lengths = {}  # Services or their models may have changed
         
         configured_services = self.service_config.get_services()
         
         for service_id, service_info in configured_services.items():
             if not service_info.get("enabled", True):
+                self.balancer.remove(service_id)
+                self.admission.remove(service_id)
                 continue
+
+            service_config = service_info.get("config", {})
+            self.balancer.set_weight(service_id, service_config.get("weight", 1.0))
+            self.admission.configure(
+                service_id, service_config.get("max_concurrency"), service_config.get("max_queue")
+            )
                 
-            # Map all configured models to their service
+            # Map all configured models to the services that serve them
             configured_models = service_info.get("config", {}).get("models", [])
             for model in configured_models:
                 # Handle model names with tags (e.g., "llama3.2:latest" -> "llama3.2")
                 clean_name = model.split(':')[0]
-                self.model_mapping[model] = service_id
-                self.model_mapping[clean_name] = service_id
+                for name in (model, clean_name):
+                    pool = self.model_mapping.setdefault(name, [])
+                    if service_id not in pool:
+                        pool.append(service_id)
+
+            for model in service_config.get("embedding_models", []):
+                for name in (model, model.split(':')[0]):
+                    pool = self.embedding_mapping.setdefault(name, [])
+                    if service_id not in pool:
+                        pool.append(service_id)
+
+        for service_id in list(self.balancer.backends):
+            if service_id not in configured_services:
+                self.balancer.remove(service_id)
+                self.breakers.pop(service_id, None)
+                self.admission.remove(service_id)
+
+    def _breaker(self, service_id: str) -> CircuitBreaker:
+        if service_id not in self.breakers:
+            self.breakers[service_id] = CircuitBreaker(service_id)
+        return self.breakers[service_id]
+
+    def _configured_context_length(self, service_id: str, model: str) -> Optional[int]:
+        """Context length from a service's config: an int, or a dict keyed by model"""
+        service_info = self.service_config.get_services().get(service_id, {})
+        context_length = service_info.get("config", {}).get("context_length")
+        if isinstance(context_length, dict):
+            context_length = context_length.get(model, context_length.get(model.split(":")[0]))
+        return int(context_length) if context_length else None
+
+    async def _discovered_context_length(self, service_id: str, model: str) -> Optional[int]:
+        """Context window a service reports for a model, looked up once per service and model"""
+        key = (service_id, model)
+        if key not in self._context_lengths:
+            service = self.services.get(service_id)
+            length = None
+            try:
+                if service is not None:
+                    length = await asyncio.wait_for(service.context_length(model), self.context_lookup_timeout)
+            except Exception as e:
+                print(f"Could not look up the context window of {model} on {service_id}: {e}")
+            self._context_lengths[key] = length
+        return self._context_lengths[key]
+
+    async def get_context_length(self, model: Optional[str] = None) -> int:
+        """Smallest context window among the services that may serve the model
+
+        A window set in the service config wins over the one the service
+        reports; LLM_DEFAULT_CONTEXT_LENGTH stands in when neither is known.
+        """
+        model = model or self.service_config.get_default_model()
+        lengths = []
+        for service_id in self.model_mapping.get(model, []):
+            length = self._configured_context_length(service_id, model)
+            if not length:
+                length = await self._discovered_context_length(service_id, model)
+            lengths.append(length or self.default_context_length)
+        return min(lengths) if lengths else self.default_context_length
+
+    async def prompt_builder(self, model: Optional[str] = None) -> PromptBuilder:
+        """Prompt builder sized for the model's context window"""
+        return PromptBuilder(await self.get_context_length(model))
+
+    def _service_options(self, service_id: str, model: str, options: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Ollama only uses a larger window when asked for it through num_ctx"""
+        service_info = self.service_config.get_services().get(service_id, {})
+        if service_info.get("type") != "ollama" or (options and "num_ctx" in options):
+            return options
+        context_length = self._configured_context_length(service_id, model)
+        if not context_length:
+            return options
+        return {**(options or {}), "num_ctx": context_length}
+
+    def task_models(self, task: str, model: Optional[str] = None) -> List[str]:
+        """Candidate models for a task, most preferred first
+
+        A chat keeps the model the user picked and uses the route only as a
+        fallback. Internal tasks prefer their route over the caller's model.
+        Both end with the default model.
+        """
+        routed = self.service_config.get_task_routes().get(task, [])
+        default_model = self.service_config.get_default_model()
+        ordered = [model, *routed, default_model] if task == "chat" else [*routed, model, default_model]
+
+        candidates = []
+        for candidate in ordered:
+            if candidate and candidate not in candidates:
+                candidates.append(candidate)
+        return candidates
+
+    def _model_usable(self, model: str) -> bool:
+        """Whether some service in the model's pool can take a request right now"""
+        return any(
+            service_id in self.services
+            and self._breaker(service_id).allow_request()
+            and self.health.get_status(service_id).status != "offline"
+            for service_id in self.model_mapping.get(model, [])
+        )
+
+    def route_task(self, task: str, model: Optional[str] = None) -> Optional[str]:
+        """Pick the first candidate model for a task that has a usable service"""
+        candidates = self.task_models(task, model)
+        for candidate in candidates:
+            if self._model_usable(candidate):
+                return candidate
+        # Nothing is healthy; let the normal error path report the preferred model
+        return candidates[0] if candidates else None
+
+    def _pick_service(
+        self, model: str, exclude: Optional[List[str]] = None, mapping: Optional[Dict[str, List[str]]] = None
+    ) -> Optional[str]:
+        """Pick a service for the model, skipping open breakers and preferring healthy services"""
+        mapping = self.model_mapping if mapping is None else mapping
+        pool = [
+            service_id for service_id in mapping.get(model, [])
+            if service_id in self.services
+            and service_id not in (exclude or [])
+            and self._breaker(service_id).allow_request()
+        ]
+        healthy = [service_id for service_id in pool if self.health.get_status(service_id).available]
+        return self.balancer.pick(healthy or pool)
+
+    def _select_service(
+        self, model: str, exclude: Optional[List[str]] = None, mapping: Optional[Dict[str, List[str]]] = None
+    ) -> Optional[str]:
+        """Pick a service and claim its breaker (a half-open service's single trial)
+
+        The caller must settle the claim: record a verdict or release it.
+        """
+        service_id = self._pick_service(model, exclude, mapping)
+        # Nothing is awaited between the pick and the claim, so no other request can take the trial
+        if service_id is not None and not self._breaker(service_id).try_acquire():
+            return None
+        return service_id
     
-    def add_service(self, service_id: str, service_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    async def add_service(self, service_id: str, service_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
         """Add a new service configuration"""
         try:
-            # Test the service configuration
-            if service_type == "ollama":
-                test_service = OllamaService(host=config["host"])
-                available = test_service.is_available()
-                models = test_service.list_models() if available else []
-            elif service_type == "openai":
-                test_service = OpenAIService(
-                    api_key=config.get("api_key"),
-                    base_url=config.get("base_url")
-                )
-                available = test_service.is_available()
-                models = config.get("models", [])  # For OpenAI, models are manually configured
-            else:
+            if service_type not in ("ollama", "openai"):
                 return {"success": False, "error": f"Unknown service type: {service_type}"}
+
+            # Test the service configuration
+            error = None
+            # With probing off there is nothing to test; the prober keeps the "configured" status
+            probed = service_type == "ollama" or self._probe_level(config) != "none"
+            test_service = self._create_service(service_type, config)
+            try:
+                if service_type == "ollama":
+                    available = await asyncio.to_thread(test_service.is_available)
+                    models = await asyncio.to_thread(test_service.list_models) if available else []
+                else:
+                    probe = await test_service.probe(self._probe_level(config))
+                    available, error = probe["available"], probe["error"]
+                    models = config.get("models", [])  # For OpenAI, models are manually configured
+            except Exception:
+                test_service.close()
+                raise
             
             # Save configuration
             self.service_config.add_service(service_id, service_type, config)
             
-            # Re-initialize services
-            self._initialize_services()
+            # Apply only this change; the tested instance becomes the live one
+            self._initialize_services(prebuilt={service_id: test_service})
             self._update_model_mapping()
+            if probed:
+                self.health.record(service_id, available, error)
             
             return {
                 "success": True,
@@ -173,13 +524,16 @@ class LLMManager:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    def test_service(self, service_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    async def test_service(self, service_type: str, config: Dict[str, Any]) -> Dict[str, Any]:
         """Test a service configuration without saving it"""
         try:
             if service_type == "ollama":
                 test_service = OllamaService(host=config["host"])
-                available = test_service.is_available()
-                models = test_service.list_models() if available else []
+                try:
+                    available = await asyncio.to_thread(test_service.is_available)
+                    models = await asyncio.to_thread(test_service.list_models) if available else []
+                finally:
+                    test_service.close()
                 return {
                     "success": True,
                     "available": available,
@@ -195,32 +549,23 @@ class LLMManager:
                 # Get user-provided models for testing
                 user_models = config.get("models", [])
                 
-                # Test availability with user-provided models
-                available = False
-                tested_models = []
-                
-                if user_models:
-                    # Test with the first user-provided model
-                    available = test_service.is_available(user_models[0])
-                    tested_models = user_models
-                else:
-                    # No user models provided, try to discover models from endpoint
-                    discovered_models = test_service.get_available_models()
-                    if discovered_models:
-                        available = test_service.is_available(discovered_models[0])
-                        tested_models = discovered_models
-                    else:
-                        # Can't test without models, but service might still be reachable
-                        available = False
-                        tested_models = []
+                # Walk the probe ladder; a real completion only runs if config asks for it
+                try:
+                    probe = await test_service.probe(
+                        self._probe_level(config),
+                        test_model=user_models[0] if user_models else None
+                    )
+                finally:
+                    test_service.close()
                 
                 return {
                     "success": True,
-                    "available": available,
-                    "models": tested_models,
+                    "available": probe["available"],
+                    "models": user_models or probe["models"],
                     "base_url": config.get("base_url"),
-                    "endpoint_supports_model_list": len(test_service.get_available_models()) > 0,
-                    "tested_with_user_models": len(user_models) > 0
+                    "endpoint_supports_model_list": len(probe["models"]) > 0,
+                    "tested_with_user_models": len(user_models) > 0,
+                    "probe": probe
                 }
             else:
                 return {"success": False, "error": f"Unknown service type: {service_type}"}
@@ -232,10 +577,27 @@ class LLMManager:
         self, 
         messages: List[Dict[str, str]], 
         model: str = None,
-        stream_id: Optional[str] = None
+        stream_id: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        cache: bool = False,
+        priority: str = "interactive",
+        task: Optional[str] = None,
+        deadline: Optional[Deadline] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Route chat request to appropriate LLM service"""
+        """Route chat request to appropriate LLM service
+
+        Pass cache=True for deterministic internal prompts; a cached response
+        is replayed as a stream so callers do not need to change. `priority`
+        is one of "interactive", "filename" or "background" and decides the
+        order in which queued requests get a slot on a busy service. `task`
+        picks the model from the task routing table (see route_task). When
+        the `deadline` passes the stream ends with an error event (code 504)
+        and the upstream request is closed.
+        """
         
+        if task is not None:
+            model = self.route_task(task, model)
+
         if model is None:
             default_model = self.service_config.get_default_model()
             if default_model is None:
@@ -247,23 +609,514 @@ class LLMManager:
                 return
             model = default_model
             
-        service_id = self.model_mapping.get(model)
-        
-        if service_id and service_id in self.services:
-            service = self.services[service_id]
-            async for chunk in service.stream_chat(messages, model, stream_id):
-                yield chunk
-        else:
+        if not any(service_id in self.services for service_id in self.model_mapping.get(model, [])):
             yield {
                 "type": "error",
                 "message": f"Model '{model}' not available in any configured service",
                 "timestamp": "unknown"
             }
+            return
+
+        request_key = ResponseCache.make_key(model, messages, options)
+        use_cache = cache and self.cache.enabled
+        if use_cache:
+            try:
+                cached_chunks = await self.cache.aget(request_key)
+            except Exception as e:
+                print(f"Error reading response cache: {e}")
+                cached_chunks = None
+
+            if cached_chunks is not None:
+                async for chunk in self._replay_cached(cached_chunks, model):
+                    yield chunk
+                return
+
+        def upstream():
+            # The backend is picked when the upstream starts, not per subscriber
+            return self._stream_upstream(
+                messages, model, stream_id, options, request_key if use_cache else None, priority
+            )
+
+        # Identical concurrent requests share one upstream generation. Callers only join a flight
+        # with the same priority (it decides admission) and cache setting (the flight writes the cache).
+        flight_key = f"{request_key}:{priority}:{'cached' if use_cache else 'uncached'}"
+        source = self.single_flight.stream(flight_key, upstream) if self.coalesce_requests else upstream()
+        if deadline is None or deadline.expires_at is None:
+            async for chunk in source:
+                yield chunk
+            return
+
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(source.__anext__(), deadline.remaining())
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    yield {
+                        "type": "error",
+                        "message": deadline.message(),
+                        "code": 504,
+                        "timestamp": datetime.now().isoformat()
+                    }
+                    return
+                yield chunk
+        finally:
+            await source.aclose()
+
+    async def _stream_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        stream_id: Optional[str],
+        options: Optional[Dict[str, Any]],
+        cache_key: Optional[str],
+        priority: str = "interactive"
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Stream from a pool member, failing over to another one before the first content chunk"""
+        tried: List[str] = []
+        last_error = None
+        last_error_code = None
+
+        while True:
+            service_id = self._select_service(model, exclude=tried)
+            if service_id is None:
+                error_event = {
+                    "type": "error",
+                    "message": last_error or f"Model '{model}' not available in any configured service",
+                    "timestamp": datetime.now().isoformat()
+                }
+                if last_error_code:
+                    error_event["code"] = last_error_code
+                yield error_event
+                return
+            tried.append(service_id)
+
+            breaker = self._breaker(service_id)
+            queued_at = time.perf_counter()
+            try:
+                gate = await self.admission.acquire(service_id, priority)
+            except AdmissionRejected as e:
+                # Over the limit here; another pool member may still have room
+                breaker.release()
+                last_error, last_error_code = str(e), 429
+                self.metrics.observe_request(service_id, model, 0.0, None, 0, None, "error", last_error)
+                continue
+            except BaseException:
+                breaker.release()  # Cancelled while queued; nothing was sent
+                raise
+            self.metrics.observe_queue_wait(service_id, model, time.perf_counter() - queued_at)
+
+            service = self.services[service_id]
+
+            extra = {}
+            keep_alive = self.warmup.keep_alive_for(service_id, model)
+            if keep_alive is not None:
+                extra["keep_alive"] = keep_alive
+            stream = service.stream_chat(
+                messages, model, stream_id, options=self._service_options(service_id, model, options), **extra
+            )
+            self._track_stream(service, 1)  # Keeps this instance open if it is swapped out meanwhile
+            held = []  # Events held back until the first content chunk commits to this backend
+            committed = False
+            completed = False
+            error = None
+            unreachable = False  # Only connect errors and first-token timeouts count against the breaker
+            content_chunks = []
+            ttft = None
+            last_token_at = None
+            usage = None
+            started = self.balancer.begin(service_id)
+            try:
+                while True:
+                    if not committed:
+                        timeout = max(self.first_token_timeout - (time.perf_counter() - started), 0)
+                    else:
+                        timeout = self.idle_timeout or None
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        if not committed:
+                            error = f"No first token from service '{service_id}' within {self.first_token_timeout}s"
+                            unreachable = True
+                            break
+                        # Mid-stream stall: the caller already has output, so end it here
+                        error = f"No output from service '{service_id}' for {self.idle_timeout}s"
+                        yield {
+                            "type": "error",
+                            "message": error,
+                            "code": 504,
+                            "timestamp": datetime.now().isoformat()
+                        }
+                        break
+
+                    chunk_type = chunk.get("type")
+                    if chunk_type == "error":
+                        error = chunk.get("message", "Unknown error")
+                        unreachable = bool(chunk.get("connect_error")) and not committed
+                        if not committed:
+                            break
+                    elif chunk_type == "content":
+                        now = time.perf_counter()
+                        if ttft is None:
+                            ttft = now - started
+                        else:
+                            self.metrics.observe_inter_token(service_id, model, now - last_token_at)
+                        last_token_at = now
+                        content_chunks.append(chunk.get("content", ""))
+                    elif chunk_type == "complete":
+                        completed = True
+                        usage = chunk.get("usage")
+
+                    if not committed:
+                        if chunk_type not in ("content", "complete"):
+                            held.append(chunk)
+                            continue
+                        committed = True
+                        for held_chunk in held:
+                            yield held_chunk
+                    yield chunk
+
+                if not committed and error is None:
+                    # The stream ended without content; pass through whatever it sent
+                    committed = True
+                    for held_chunk in held:
+                        yield held_chunk
+            finally:
+                await stream.aclose()
+                self._track_stream(service, -1)
+                gate.release()
+                self.balancer.end(service_id, started, ttft, error=error is not None, completed=completed)
+                self.metrics.observe_request(
+                    service_id,
+                    model,
+                    time.perf_counter() - started,
+                    ttft,
+                    len(content_chunks),
+                    (usage or {}).get("completion_tokens"),
+                    "error" if error is not None else "success" if completed else "cancelled",
+                    error,
+                )
+                if unreachable:
+                    breaker.record_failure(error)
+                elif completed:
+                    breaker.record_success()
+                    self.warmup.touch(service_id, model)
+                else:
+                    breaker.release()
+
+            if committed:
+                break
+
+            # Nothing reached the caller yet, so another backend can take over
+            last_error, last_error_code = error, None
+            print(f"Failing over from service '{service_id}' for model '{model}': {error}")
+
+        if cache_key and completed:
+            try:
+                await self.cache.aput(cache_key, content_chunks)
+            except Exception as e:
+                print(f"Error writing response cache: {e}")
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        options: Optional[Dict[str, Any]] = None,
+        cache: bool = False,
+        priority: str = "filename",
+        task: Optional[str] = None,
+        deadline: Optional[Deadline] = None
+    ) -> Dict[str, Any]:
+        """Single non-streaming request for short internal answers
+
+        `max_tokens` caps the output (num_predict on Ollama), `stop` ends it
+        early and `timeout` is a deadline for the whole call, queueing and
+        failover included. Returns {"success": False, "timed_out": True}
+        when the deadline passes so callers can fall back to a heuristic.
+        With a `task`, the routed models are tried in order. A request
+        `deadline` caps the timeout further.
+        """
+        if task is not None:
+            candidates = self.task_models(task, model)
+            candidates.sort(key=lambda candidate: not self._model_usable(candidate))
+        else:
+            candidates = [model or self.service_config.get_default_model()]
+            candidates = [candidate for candidate in candidates if candidate]
+        if not candidates:
+            return {"success": False, "error": "No model specified and no default model configured"}
+
+        timeout = self.complete_timeout if timeout is None else timeout
+        if deadline is not None:
+            timeout = deadline.cap(timeout)
+        expires_at = time.perf_counter() + timeout
+        result = None
+        for candidate in candidates:
+            result = await self._complete_model(
+                messages, candidate, max_tokens, stop, max(expires_at - time.perf_counter(), 0),
+                options, cache, priority
+            )
+            if result.get("success") or result.get("timed_out"):
+                return result
+        return result
+
+    async def _complete_model(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int],
+        stop: Optional[List[str]],
+        timeout: float,
+        options: Optional[Dict[str, Any]],
+        cache: bool,
+        priority: str
+    ) -> Dict[str, Any]:
+        """complete() against one model, with the response cache in front"""
+        if model not in self.model_mapping:
+            return {"success": False, "error": f"Model '{model}' not available in any configured service"}
+
+        params = {**(options or {}), "max_tokens": max_tokens, "stop": stop}
+        request_key = ResponseCache.make_key(model, messages, params)
+        use_cache = cache and self.cache.enabled
+        if use_cache:
+            try:
+                cached_chunks = await self.cache.aget(request_key)
+            except Exception as e:
+                print(f"Error reading response cache: {e}")
+                cached_chunks = None
+            if cached_chunks is not None:
+                return {"success": True, "content": "".join(cached_chunks), "model": model, "cached": True}
+
+        try:
+            result = await asyncio.wait_for(
+                self._complete_upstream(messages, model, max_tokens, stop, options, priority), timeout
+            )
+        except asyncio.TimeoutError:
+            return {"success": False, "error": f"No answer from model '{model}' within {timeout:.1f}s", "timed_out": True}
+
+        if use_cache and result.get("success"):
+            try:
+                await self.cache.aput(request_key, [result["content"]])
+            except Exception as e:
+                print(f"Error writing response cache: {e}")
+        return result
+
+    async def _complete_upstream(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int],
+        stop: Optional[List[str]],
+        options: Optional[Dict[str, Any]],
+        priority: str
+    ) -> Dict[str, Any]:
+        """Try pool members in turn until one answers"""
+        tried: List[str] = []
+        last_error = None
+
+        while True:
+            service_id = self._select_service(model, exclude=tried)
+            if service_id is None:
+                return {"success": False, "error": last_error or f"Model '{model}' not available in any configured service"}
+            tried.append(service_id)
+
+            breaker = self._breaker(service_id)
+            try:
+                gate = await self.admission.acquire(service_id, priority)
+            except AdmissionRejected as e:
+                breaker.release()
+                last_error = str(e)
+                self.metrics.observe_request(service_id, model, 0.0, None, 0, None, "error", last_error)
+                continue
+            except BaseException:
+                breaker.release()  # Cancelled while queued; nothing was sent
+                raise
+
+            service = self.services[service_id]
+            extra = {}
+            keep_alive = self.warmup.keep_alive_for(service_id, model)
+            if keep_alive is not None:
+                extra["keep_alive"] = keep_alive
+
+            self._track_stream(service, 1)
+            started = self.balancer.begin(service_id)
+            error = None
+            result = None
+            unreachable = False
+            try:
+                result = await service.complete(
+                    messages, model, max_tokens, stop,
+                    options=self._service_options(service_id, model, options), **extra
+                )
+            except asyncio.CancelledError:
+                error = "timed out"
+                raise
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                unreachable = is_connect_error(e)
+            finally:
+                self._track_stream(service, -1)
+                gate.release()
+                duration = time.perf_counter() - started
+                cancelled = result is None and error == "timed out"
+                self.balancer.end(
+                    service_id, started, duration, error=error is not None and not cancelled, completed=result is not None
+                )
+                if result is not None:
+                    breaker.record_success()
+                    self.warmup.touch(service_id, model)
+                elif unreachable:
+                    breaker.record_failure(error)
+                else:
+                    breaker.release()
+                self.metrics.observe_request(
+                    service_id,
+                    model,
+                    duration,
+                    duration if result is not None else None,
+                    1 if result is not None else 0,
+                    ((result or {}).get("usage") or {}).get("completion_tokens"),
+                    "success" if result is not None else "error",
+                    error,
+                )
+
+            if result is not None:
+                return {"success": True, "content": result["content"], "model": model, "service": service_id}
+
+            last_error = error
+            print(f"Failing over from service '{service_id}' for model '{model}': {error}")
+
+    def get_embedding_model(self) -> Optional[str]:
+        """The configured embedding model, if some enabled service serves it"""
+        model = self.service_config.get_embedding_model()
+        return model if model and self.embedding_mapping.get(model) else None
+
+    async def embed(
+        self,
+        texts: List[str],
+        model: Optional[str] = None,
+        priority: str = "background",
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Embed texts in batches of `embedding_batch_size`, a few batches at a time
+
+        Vectors come back in input order. Each batch fails over across the
+        services that list the model under "embedding_models"; the whole
+        call fails if any batch does, or when `timeout` passes.
+        """
+        model = model or self.get_embedding_model()
+        if not model:
+            return {"success": False, "error": "No embedding model configured"}
+        if model not in self.embedding_mapping:
+            return {"success": False, "error": f"Embedding model '{model}' not available in any configured service"}
+        if not texts:
+            return {"success": True, "embeddings": [], "model": model}
+
+        size = max(self.embedding_batch_size, 1)
+        batches = [texts[start:start + size] for start in range(0, len(texts), size)]
+        limit = asyncio.Semaphore(max(self.embedding_concurrency, 1))
+
+        async def run(batch: List[str]) -> Dict[str, Any]:
+            async with limit:
+                return await self._embed_upstream(batch, model, priority)
+
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*(run(batch) for batch in batches)),
+                self.embedding_timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            return {"success": False, "error": f"No embeddings from model '{model}' in time", "timed_out": True}
+
+        embeddings = []
+        for result in results:
+            if not result.get("success"):
+                return result
+            embeddings.extend(result["embeddings"])
+        return {"success": True, "embeddings": embeddings, "model": model}
+
+    async def _embed_upstream(self, texts: List[str], model: str, priority: str) -> Dict[str, Any]:
+        """Embed one batch, trying pool members in turn until one answers"""
+        tried: List[str] = []
+        last_error = None
+
+        while True:
+            service_id = self._select_service(model, exclude=tried, mapping=self.embedding_mapping)
+            if service_id is None:
+                return {"success": False, "error": last_error or f"Embedding model '{model}' not available in any configured service"}
+            tried.append(service_id)
+
+            breaker = self._breaker(service_id)
+            try:
+                gate = await self.admission.acquire(service_id, priority)
+            except AdmissionRejected as e:
+                breaker.release()
+                last_error = str(e)
+                continue
+            except BaseException:
+                breaker.release()  # Cancelled while queued; nothing was sent
+                raise
+
+            service = self.services[service_id]
+            self._track_stream(service, 1)
+            started = self.balancer.begin(service_id)
+            error = None
+            result = None
+            unreachable = False
+            try:
+                result = await service.embed(texts, model)
+                if len(result["embeddings"]) != len(texts):
+                    raise ValueError(f"expected {len(texts)} vectors, got {len(result['embeddings'])}")
+            except asyncio.CancelledError:
+                error = "timed out"
+                raise
+            except Exception as e:
+                result = None
+                error = f"{type(e).__name__}: {e}"
+                unreachable = is_connect_error(e)
+            finally:
+                self._track_stream(service, -1)
+                gate.release()
+                duration = time.perf_counter() - started
+                cancelled = result is None and error == "timed out"
+                self.balancer.end(
+                    service_id, started, duration, error=error is not None and not cancelled, completed=result is not None
+                )
+                if result is not None:
+                    breaker.record_success()
+                elif unreachable:
+                    breaker.record_failure(error)
+                else:
+                    breaker.release()
+                self.metrics.observe_request(
+                    service_id, model, duration, None, 1 if result is not None else 0, None,
+                    "success" if result is not None else "error",
+                    error,
+                )
+
+            if result is not None:
+                return {"success": True, "embeddings": result["embeddings"], "model": model, "service": service_id}
+
+            last_error = error
+            print(f"Failing over from service '{service_id}' for embedding model '{model}': {error}")
+
+    async def _replay_cached(self, chunks: List[str], model: str) -> AsyncGenerator[Dict[str, Any], None]:
+        """Replay a cached response in the same event shape as a live stream"""
+        yield {"type": "start", "timestamp": datetime.now().isoformat(), "model": model, "cached": True}
+        for content in chunks:
+            yield {"type": "content", "content": content}
+        yield {"type": "complete", "timestamp": datetime.now().isoformat(), "cached": True}
     
     def get_available_models(self) -> Dict[str, Any]:
         """Get available models from all configured services with health status"""
         result = {
             "default_model": self.service_config.get_default_model(),
+            "embedding_model": self.service_config.get_embedding_model(),
             "services": {},
             "all_models": []
         }
@@ -287,86 +1140,33 @@ class LLMManager:
             }
             
             if enabled and service_id in self.services:
-                service = self.services[service_id]
-                try:
-                    configured_models = config.get("models", [])
-                    
-                    # Only test Ollama services automatically to avoid token consumption
-                    # OpenAI services are assumed to be available if configured
-                    if service_type == "ollama":
-                        # Test with the first configured model if available
-                        test_model = configured_models[0] if configured_models else None
-                        
-                        if service.is_available(test_model):
-                            service_result["available"] = True
-                            service_result["status"] = "online"
-                            
-                            # Use only the configured models, not all available models
-                            service_result["models"] = configured_models
-                            
-                            # Add to all_models - only the configured models
-                            for model in configured_models:
-                                result["all_models"].append({
-                                    "id": model,
-                                    "name": model,
-                                    "provider": config.get("name", service_type.title()),
-                                    "service": service_id,
-                                    "service_type": service_type,
-                                    "available": True,
-                                    "is_default": model == result["default_model"]
-                                })
-                        else:
-                            service_result["status"] = "offline"
-                            # Still show configured models even if service is offline
-                            service_result["models"] = configured_models
-                            
-                            # Add to all_models but mark as unavailable
-                            for model in configured_models:
-                                result["all_models"].append({
-                                    "id": model,
-                                    "name": model,
-                                    "provider": config.get("name", service_type.title()),
-                                    "service": service_id,
-                                    "service_type": service_type,
-                                    "available": False,
-                                    "is_default": model == result["default_model"]
-                                })
-                    else:
-                        # For OpenAI services, assume they're available if configured
-                        # User can test them manually to verify
-                        service_result["available"] = True
-                        service_result["status"] = "configured"  # Different status to indicate not tested
-                        service_result["models"] = configured_models
-                        
-                        # Add to all_models and mark as available (assumed)
-                        for model in configured_models:
-                            result["all_models"].append({
-                                "id": model,
-                                "name": model,
-                                "provider": config.get("name", service_type.title()),
-                                "service": service_id,
-                                "service_type": service_type,
-                                "available": True,  # Assumed available
-                                "is_default": model == result["default_model"]
-                            })
-                        
-                except Exception as e:
-                    service_result["status"] = f"error: {str(e)}"
-                    # Still show configured models even if there's an error
-                    configured_models = config.get("models", [])
-                    service_result["models"] = configured_models
-                    
-                    # Add to all_models but mark as unavailable
-                    for model in configured_models:
-                        result["all_models"].append({
-                            "id": model,
-                            "name": model,
-                            "provider": config.get("name", service_type.title()),
-                            "service": service_id,
-                            "service_type": service_type,
-                            "available": False,
-                            "is_default": model == result["default_model"]
-                        })
+                # Read the cached probe result - never probe inline
+                health = self.health.get_status(service_id)
+                configured_models = config.get("models", [])
+
+                service_result["available"] = health.available
+                service_result["status"] = health.status
+                service_result["checked_at"] = health.checked_at
+                service_result["models"] = configured_models
+                if health.error:
+                    service_result["error"] = health.error
+                warm_states = self.warmup.snapshot(service_id)
+                if warm_states:
+                    service_result["warm"] = warm_states
+
+                for model in configured_models:
+                    model_info = {
+                        "id": model,
+                        "name": model,
+                        "provider": config.get("name", service_type.title()),
+                        "service": service_id,
+                        "service_type": service_type,
+                        "available": health.available,
+                        "is_default": model == result["default_model"]
+                    }
+                    if model in warm_states:
+                        model_info["warm"] = warm_states[model]["state"]
+                    result["all_models"].append(model_info)
             
             result["services"][service_id] = service_result
         
@@ -382,19 +1182,37 @@ class LLMManager:
     
     def get_model_health(self, model: str) -> Dict[str, Any]:
         """Get health status for a specific model"""
-        service_id = self.model_mapping.get(model)
+        pool = [service_id for service_id in self.model_mapping.get(model, []) if service_id in self.services]
         
-        if service_id and service_id in self.services:
-            service = self.services[service_id]
+        if pool:
             configured_services = self.service_config.get_services()
-            service_info = configured_services.get(service_id, {})
+            backends = []
+            for service_id in pool:
+                service_info = configured_services.get(service_id, {})
+                health = self.health.get_status(service_id)
+                backends.append({
+                    "service": service_id,
+                    "service_type": service_info.get("type", "unknown"),
+                    "available": health.available,
+                    "status": health.status,
+                    "checked_at": health.checked_at,
+                    "load": self.balancer.backends[service_id].to_dict() if service_id in self.balancer.backends else None,
+                    "config": {k: v for k, v in service_info.get("config", {}).items() if k != "api_key"}
+                })
+
+            # Report the backend the next request would be routed to first
+            primary_id = self._pick_service(model) or pool[0]
+            primary = next(backend for backend in backends if backend["service"] == primary_id)
             
             return {
                 "model": model,
-                "service": service_id,
-                "service_type": service_info.get("type", "unknown"),
-                "available": service.is_available(model),
-                "config": {k: v for k, v in service_info.get("config", {}).items() if k != "api_key"}
+                "service": primary["service"],
+                "service_type": primary["service_type"],
+                "available": any(backend["available"] for backend in backends),
+                "status": primary["status"],
+                "checked_at": primary["checked_at"],
+                "config": primary["config"],
+                "backends": backends
             }
         
         return {
@@ -408,12 +1226,41 @@ class LLMManager:
         try:
             if self.is_model_available(model):
                 self.service_config.set_default_model(model)
+                # The default model is the one preloaded unless a service says otherwise
+                for service_id, service_info in self.service_config.get_services().items():
+                    if service_id in self.services:
+                        self._configure_warmup(service_id, service_info)
                 return {"success": True, "default_model": model}
             else:
                 return {"success": False, "error": f"Model '{model}' is not available"}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+    def set_embedding_model(self, model: Optional[str]) -> Dict[str, Any]:
+        """Set the model used to embed knowledge files; None clears it"""
+        try:
+            if model and model not in self.embedding_mapping:
+                return {"success": False, "error": f"Embedding model '{model}' is not listed by any service"}
+            self.service_config.set_embedding_model(model)
+            return {"success": True, "embedding_model": model}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+
+# Global LLM manager instance, built by the app lifespan or on first use
+llm_manager: LLMManager = Lazy("llm_manager", LLMManager)
 
-# Global LLM manager instance
-llm_manager = LLMManager()
+__all__ = [
+    "TASK_TYPES",
+    "ServiceConfig",
+    "LLMManager",
+    "OllamaService",
+    "OpenAIService",
+    "Deadline",
+    "PromptBuilder",
+    "PromptSection",
+    "estimate_tokens",
+    "first_answer_line",
+    "transport_registry",
+    "llm_manager",
+]
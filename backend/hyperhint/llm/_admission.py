@@ -0,0 +1,187 @@
+# Cap concurrent requests per service and queue the rest by priority
+# interactive chat goes first, then filename generation, then background analysis
+# A full queue or an expired wait rejects the request straight away
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+PRIORITIES = {"interactive": 0, "filename": 1, "background": 2}
+
+
+class AdmissionRejected(Exception):
+    """Raised when a service is at capacity and its queue cannot take the request"""
+
+    def __init__(self, service_id: str, reason: str):
+        super().__init__(f"Service '{service_id}' is busy: {reason}")
+        self.service_id = service_id
+        self.reason = reason
+
+
+class _PriorityStats:
+    def __init__(self):
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_avg": round(self.wait_ms_total / self.admitted, 1) if self.admitted else 0.0,
+            "wait_ms_max": round(self.wait_ms_max, 1),
+        }
+
+
+class ServiceGate:
+    """Concurrency limit and priority queue for a single service"""
+
+    def __init__(self, service_id: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.service_id = service_id
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.active = 0
+        self.queued = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.stats = {name: _PriorityStats() for name in PRIORITIES}
+
+    def _has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self.active < self.max_concurrency
+
+    async def acquire(self, priority: str):
+        stats = self.stats[priority]
+        if self._has_capacity() and self.queued == 0:
+            self.active += 1
+            stats.admitted += 1
+            return
+
+        if self.queued >= self.max_queue and not self._evict_lower_than(PRIORITIES[priority]):
+            stats.rejected += 1
+            raise AdmissionRejected(self.service_id, f"queue is full ({self.max_queue} waiting)")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._sequence), future))
+        self.queued += 1
+        stats.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.queue_timeout)
+        except AdmissionRejected:
+            stats.rejected += 1  # Pushed out of the queue by a higher-priority request
+            raise
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                future.cancel()
+                self.queued -= 1
+                stats.queued -= 1
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            stats.rejected += 1
+            raise AdmissionRejected(self.service_id, f"waited more than {self.queue_timeout}s in queue")
+
+        wait_ms = (time.perf_counter() - started) * 1000
+        stats.admitted += 1
+        stats.wait_ms_total += wait_ms
+        stats.wait_ms_max = max(stats.wait_ms_max, wait_ms)
+
+    def _evict_lower_than(self, rank: int) -> bool:
+        """Reject the newest waiter of lower priority than `rank` to make room"""
+        live = [entry for entry in self._waiters if not entry[2].done()]
+        if not live:
+            return False
+
+        victim = max(live, key=lambda entry: (entry[0], entry[1]))
+        if victim[0] <= rank:
+            return False
+
+        self.queued -= 1
+        self.stats[_priority_name(victim[0])].queued -= 1
+        victim[2].set_exception(
+            AdmissionRejected(self.service_id, "displaced from the queue by higher-priority requests")
+        )
+        return True
+
+    def release(self):
+        self.active = max(self.active - 1, 0)
+        self.wake()
+
+    def wake(self):
+        """Hand free slots to the highest-priority waiters"""
+        while self._waiters and self._has_capacity():
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Gave up while waiting
+            self.queued -= 1
+            self.stats[_priority_name(priority)].queued -= 1
+            self.active += 1
+            future.set_result(None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "service_id": self.service_id,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": self.queued,
+            "priorities": {name: stats.to_dict() for name, stats in self.stats.items()},
+        }
+
+
+def _priority_name(rank: int) -> str:
+    for name, value in PRIORITIES.items():
+        if value == rank:
+            return name
+    return "background"
+
+
+class AdmissionController:
+    """Per-service admission gates"""
+
+    def __init__(self):
+        self.default_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.default_queue = int(os.getenv("LLM_MAX_QUEUE", "64"))
+        self.queue_timeout = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+        self.gates: Dict[str, ServiceGate] = {}
+
+    def configure(self, service_id: str, max_concurrency: Optional[int] = None, max_queue: Optional[int] = None):
+        """Create or update the gate for a service, keeping its counters"""
+        max_concurrency = self.default_concurrency if max_concurrency is None else int(max_concurrency)
+        max_queue = self.default_queue if max_queue is None else int(max_queue)
+
+        gate = self.gates.get(service_id)
+        if gate is None:
+            self.gates[service_id] = ServiceGate(service_id, max_concurrency, max_queue, self.queue_timeout)
+            return
+
+        gate.max_concurrency = max_concurrency
+        gate.max_queue = max_queue
+        gate.wake()  # The limit may have been raised
+
+    def remove(self, service_id: str):
+        self.gates.pop(service_id, None)
+
+    async def acquire(self, service_id: str, priority: str = "interactive") -> ServiceGate:
+        """Wait for a slot on a service; the caller must call release() on the returned gate"""
+        if priority not in PRIORITIES:
+            priority = "interactive"
+        if service_id not in self.gates:
+            self.configure(service_id)
+
+        gate = self.gates[service_id]
+        await gate.acquire(priority)
+        return gate
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {service_id: gate.to_dict() for service_id, gate in self.gates.items()}
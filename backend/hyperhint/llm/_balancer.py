@@ -0,0 +1,105 @@
+# Route each request to one service out of the pool serving a model
+# Pick the service with the fewest outstanding requests per unit of weight
+# Track in-flight counts and latency EWMAs per service for the API
+
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+
+class BackendStats:
+    """Load and latency counters for a single service"""
+
+    def __init__(self, service_id: str, weight: float = 1.0):
+        self.service_id = service_id
+        self.weight = weight
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.latency_ewma_ms: Optional[float] = None
+        self.ttft_ewma_ms: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "service_id": self.service_id,
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+            "latency_ewma_ms": round(self.latency_ewma_ms, 1) if self.latency_ewma_ms is not None else None,
+            "ttft_ewma_ms": round(self.ttft_ewma_ms, 1) if self.ttft_ewma_ms is not None else None,
+        }
+
+
+class LoadBalancer:
+    """Weighted least-outstanding-requests selection over service pools"""
+
+    def __init__(self, alpha: Optional[float] = None):
+        self.alpha = alpha or float(os.getenv("LLM_BALANCER_EWMA_ALPHA", "0.2"))
+        self.backends: Dict[str, BackendStats] = {}
+
+    def set_weight(self, service_id: str, weight: float):
+        """Register a service, keeping its counters if it already exists"""
+        backend = self.backends.setdefault(service_id, BackendStats(service_id))
+        backend.weight = max(float(weight), 0.0)
+
+    def remove(self, service_id: str):
+        self.backends.pop(service_id, None)
+
+    def pick(self, service_ids: List[str]) -> Optional[str]:
+        """Return the service with the lowest (in_flight + 1) / weight"""
+        best_id = None
+        best_key = None
+
+        for service_id in service_ids:
+            backend = self.backends.setdefault(service_id, BackendStats(service_id))
+            if backend.weight <= 0:
+                continue
+            # Break ties on latency so a faster backend wins at equal load
+            key = (
+                (backend.in_flight + 1) / backend.weight,
+                backend.latency_ewma_ms if backend.latency_ewma_ms is not None else 0.0,
+            )
+            if best_key is None or key < best_key:
+                best_id, best_key = service_id, key
+
+        return best_id
+
+    def begin(self, service_id: str) -> float:
+        """Mark a request as outstanding; returns its start time"""
+        backend = self.backends.setdefault(service_id, BackendStats(service_id))
+        backend.in_flight += 1
+        backend.total_requests += 1
+        return time.perf_counter()
+
+    def end(
+        self,
+        service_id: str,
+        started: float,
+        ttft: Optional[float] = None,
+        error: bool = False,
+        completed: bool = True,
+    ):
+        """Mark a request as finished and fold its latency into the EWMAs"""
+        backend = self.backends.get(service_id)
+        if backend is None:
+            return
+
+        backend.in_flight = max(backend.in_flight - 1, 0)
+        if error:
+            backend.total_errors += 1
+            return
+        if not completed:
+            return  # Cancelled by the caller; the duration says nothing about the backend
+
+        backend.latency_ewma_ms = self._ewma(backend.latency_ewma_ms, (time.perf_counter() - started) * 1000)
+        if ttft is not None:
+            backend.ttft_ewma_ms = self._ewma(backend.ttft_ewma_ms, ttft * 1000)
+
+    def _ewma(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * current
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {service_id: backend.to_dict() for service_id, backend in self.backends.items()}
@@ -0,0 +1,110 @@
+# Stop sending traffic to a backend after repeated connect or first-token failures
+# closed    -> requests flow, consecutive failures are counted
+# open      -> requests skip the backend until the reset timeout passes
+# half_open -> a single trial request decides between closed and open
+
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_connect_error(error: Optional[BaseException]) -> bool:
+    """Whether an error, or one it was raised from, means the service could not be reached
+
+    Other errors (a rejected request, an unknown model, a read timeout) say
+    nothing about the backend being down, so they do not count as failures.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, ConnectionError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+class CircuitBreaker:
+    """Per-service circuit breaker"""
+
+    def __init__(
+        self,
+        service_id: str,
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None,
+    ):
+        self.service_id = service_id
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+        self.reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+        self._state = CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow_request(self) -> bool:
+        """Whether a request may be sent to the service right now"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            return not self._trial_in_flight
+        return False
+
+    def try_acquire(self) -> bool:
+        """Check and claim in one step; when half open only the first caller gets the trial
+
+        A claimed request must end in record_success(), record_failure() or release().
+        """
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self._state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self, error: Optional[str] = None):
+        self.last_error = error
+        self.failures += 1
+        if self._state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._state = OPEN
+            self.opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+    def release(self):
+        """Call when a claimed request ended without a verdict, e.g. it was cancelled or turned away"""
+        self._trial_in_flight = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        state = self.state
+        return {
+            "service_id": self.service_id,
+            "state": state,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "retry_in": (
+                max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+                if state == OPEN
+                else None
+            ),
+        }
@@ -0,0 +1,141 @@
+# Cache complete LLM responses on disk
+# Key them by a hash of (model, messages, generation params)
+# Evict least recently used entries by total size and expire them by TTL
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+DEFAULT_CACHE_PATH = Path(__file__).parent.parent.parent / "data" / "cache" / "llm_responses.sqlite3"
+
+
+class ResponseCache:
+    """SQLite-backed response cache with size-based LRU eviction and TTL"""
+
+    def __init__(
+        self,
+        path: Optional[Path] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "True").lower() == "true"
+        self.path = Path(path or os.getenv("LLM_CACHE_PATH", "") or DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes or int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+        self.ttl = ttl or float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], params: Optional[Dict[str, Any]] = None) -> str:
+        """Hash the request into a stable cache key"""
+        payload = json.dumps(
+            {
+                "model": model,
+                "messages": [{"role": m.get("role", "user"), "content": m.get("content", "")} for m in messages],
+                "params": params or {},
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    chunks TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        return self._conn
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """Return the cached content chunks for a key, or None"""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT chunks, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, chunks: List[str]):
+        """Store content chunks and evict old entries past the size limit"""
+        data = json.dumps(chunks, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, chunks, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    async def aget(self, key: str) -> Optional[List[str]]:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, chunks: List[str]):
+        await asyncio.to_thread(self.put, key, chunks)
+
+    def clear(self):
+        """Drop all cached responses"""
+        with self._lock:
+            self._connect().execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            entries, size = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
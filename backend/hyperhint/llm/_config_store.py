@@ -0,0 +1,186 @@
+# Keep llm_config.json in memory and write it back with a temp file + rename, off the event loop
+# Mutations that land within a short window are coalesced into one write
+# Poll the file so every worker picks up changes another worker (or an editor) made
+
+import asyncio
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CONFIG_PATH = Path(__file__).parent.parent.parent / "llm_config.json"
+
+Signature = Optional[Tuple[int, int, int]]  # (inode, mtime_ns, size) of the file as last seen
+
+
+class ConfigFile:
+    """JSON document backed by a file that is saved atomically and watched for outside changes"""
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        default: Optional[Callable[[], Dict[str, Any]]] = None,
+        save_delay: Optional[float] = None,
+        watch_interval: Optional[float] = None,
+    ):
+        self.path = Path(path or os.getenv("LLM_CONFIG_PATH", "") or DEFAULT_CONFIG_PATH)
+        self.save_delay = float(os.getenv("LLM_CONFIG_SAVE_DELAY", "0.2")) if save_delay is None else save_delay
+        self.watch_interval = (
+            float(os.getenv("LLM_CONFIG_WATCH_INTERVAL", "2")) if watch_interval is None else watch_interval
+        )
+
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+
+        self._text: Optional[str] = None
+        self._signature: Signature = None
+        self.data = self._load() or (default() if default else {})
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            text, signature = self._read()
+        except Exception as e:
+            print(f"Error loading config: {e}")
+            return None
+        self._signature = signature
+        if text is None:
+            return None
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            print(f"Error loading config: {e}")
+            return None
+        self._text = text
+        return data
+
+    def _read(self) -> Tuple[Optional[str], Signature]:
+        """File contents and the signature of exactly the file that was read"""
+        try:
+            with open(self.path, "r") as f:
+                stat = os.fstat(f.fileno())
+                return f.read(), (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return None, None
+
+    def _stat(self) -> Signature:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _write(self, text: str):
+        """Write to a temp file next to the config and rename it over the old one"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if self.path.exists():
+                os.chmod(tmp_path, self.path.stat().st_mode & 0o777)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._text = text
+        self._signature = self._stat()
+
+    def save(self):
+        """Queue a write of the current data; saves within save_delay become one write"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Scripts and start-up code without a loop write straight away
+            self._dirty = False
+            try:
+                self._write(json.dumps(self.data, indent=2))
+            except Exception as e:
+                print(f"Error saving config: {e}")
+            return
+
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.save_delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write pending changes now"""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # Serialize on the loop so the snapshot cannot change halfway through
+            text = json.dumps(self.data, indent=2)
+            try:
+                await asyncio.to_thread(self._write, text)
+            except Exception as e:
+                print(f"Error saving config: {e}")
+
+    def on_change(self, callback: Callable[[Dict[str, Any]], None]):
+        """Call `callback(previous_data)` after the file was reloaded with outside changes"""
+        self._listeners.append(callback)
+
+    async def reload_if_changed(self) -> bool:
+        """Reload when the file differs from what this process last read or wrote"""
+        if self._dirty or (self._write_lock is not None and self._write_lock.locked()):
+            return False  # Our own write is about to replace the file anyway
+        if await asyncio.to_thread(self._stat) == self._signature:
+            return False
+
+        text, signature = await asyncio.to_thread(self._read)
+        self._signature = signature
+        if text is None or text == self._text:
+            return False
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            # Probably saved half-way by an editor; the next change will be picked up
+            print(f"Ignoring invalid config {self.path}: {e}")
+            return False
+
+        previous, self.data, self._text = self.data, data, text
+        for callback in self._listeners:
+            try:
+                callback(previous)
+            except Exception as e:
+                print(f"Error applying reloaded config: {e}")
+        return True
+
+    async def start(self):
+        """Start watching the file for changes made by other processes"""
+        if self._watch_task is None and self.watch_interval > 0:
+            self._watch_task = asyncio.get_running_loop().create_task(self._watch_loop())
+
+    async def stop(self):
+        """Stop watching and write anything still pending"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+
+    async def _watch_loop(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                if await self.reload_if_changed():
+                    print(f"Reloaded {self.path}")
+            except Exception as e:
+                print(f"Error watching config: {e}")
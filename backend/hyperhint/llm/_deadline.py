@@ -0,0 +1,42 @@
+# Give each chat or action request one absolute deadline
+# Every sub-call caps its own timeouts by the time that is left
+# so a hung backend cannot hold a connection past the request budget
+
+import os
+import time
+from typing import Optional
+
+
+class Deadline:
+    """Absolute point in time by which a request must be finished"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout and timeout > 0 else None
+
+    @classmethod
+    def from_env(cls, name: str, default: str, timeout: Optional[float] = None) -> "Deadline":
+        """Deadline from an explicit timeout, else from an env var; 0 disables it"""
+        return cls(float(os.getenv(name, default)) if timeout is None else float(timeout))
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when there is no deadline"""
+        if self.expires_at is None:
+            return None
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def cap(self, timeout: Optional[float]) -> Optional[float]:
+        """The shorter of `timeout` and the time left; None means wait forever"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if timeout is None:
+            return remaining
+        return min(timeout, remaining)
+
+    def message(self) -> str:
+        return f"Request deadline of {self.timeout:g}s exceeded"
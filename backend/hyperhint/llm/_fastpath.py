@@ -0,0 +1,95 @@
+# Minimal streaming parsers that read the raw httpx byte stream
+# Ollama sends NDJSON, OpenAI-compatible servers send SSE "data:" lines
+# Only the delta text and the final usage are extracted; no SDK models per token
+
+import json
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional, Tuple
+
+import httpx
+
+# (content, usage): content is None for lines without text, usage is set once at the end
+Delta = Tuple[Optional[str], Optional[Dict[str, Any]]]
+
+
+class StreamError(Exception):
+    """Raised when the backend rejects the request or reports an error mid-stream"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+async def iter_lines(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Split the byte stream on newlines without decoding it"""
+    pending = b""
+    async for chunk in response.aiter_bytes():
+        if pending:
+            chunk = pending + chunk
+        lines = chunk.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+
+async def _raise_for_status(response: httpx.Response):
+    if response.status_code >= 400:
+        body = (await response.aread())[:500].decode("utf-8", "replace")
+        raise StreamError(f"HTTP {response.status_code}: {body}", response.status_code)
+
+
+async def ollama_deltas(client: httpx.AsyncClient, payload: Dict[str, Any]) -> AsyncGenerator[Delta, None]:
+    """Stream /api/chat and yield (content, usage) pairs"""
+    async with client.stream("POST", "/api/chat", json=payload) as response:
+        await _raise_for_status(response)
+        async for line in iter_lines(response):
+            data = json.loads(line)
+            if "error" in data:
+                raise StreamError(data["error"])
+            message = data.get("message")
+            content = message.get("content") if message else None
+            if data.get("done"):
+                usage = None
+                if data.get("eval_count") is not None:
+                    usage = {
+                        "prompt_tokens": data.get("prompt_eval_count"),
+                        "completion_tokens": data.get("eval_count"),
+                    }
+                yield content or None, usage
+                return
+            if content:
+                yield content, None
+
+
+async def openai_deltas(
+    client: httpx.AsyncClient, url: str, headers: Dict[str, str], payload: Dict[str, Any]
+) -> AsyncGenerator[Delta, None]:
+    """Stream /chat/completions and yield (content, usage) pairs"""
+    async with client.stream("POST", url, json=payload, headers=headers) as response:
+        await _raise_for_status(response)
+        async for line in iter_lines(response):
+            if not line.startswith(b"data:"):
+                continue  # comments, event names and keep-alives
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                return
+            event = json.loads(data)
+            if "error" in event:
+                error = event["error"]
+                raise StreamError(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+
+            choices = event.get("choices")
+            content = None
+            if choices:
+                delta = choices[0].get("delta")
+                content = delta.get("content") if delta else None
+            usage = event.get("usage")
+            if usage:
+                usage = {
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "completion_tokens": usage.get("completion_tokens"),
+                }
+            if content or usage:
+                yield content or None, usage or None
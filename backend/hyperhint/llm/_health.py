@@ -0,0 +1,198 @@
+# Probe every configured service in the background
+# Keep the latest result per service in a TTL-bounded status table
+# Let request handlers read that table instead of probing inline
+
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# A probe returns either a bool or a dict with "available" and "error" keys
+ProbeFn = Callable[[], Awaitable[Any]]
+
+
+class ServiceStatus:
+    """Last known health of a single service"""
+
+    def __init__(self, service_id: str):
+        self.service_id = service_id
+        self.available = False
+        self.status = "unknown"
+        self.error: Optional[str] = None
+        self.latency_ms: Optional[float] = None
+        self.checked_at: Optional[float] = None  # time.time() of the last probe
+        self.consecutive_failures = 0
+        self.next_probe_in: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "service_id": self.service_id,
+            "available": self.available,
+            "status": self.status,
+            "error": self.error,
+            "latency_ms": self.latency_ms,
+            "checked_at": self.checked_at,
+            "consecutive_failures": self.consecutive_failures,
+            "next_probe_in": self.next_probe_in,
+        }
+
+
+class HealthProber:
+    """Background scheduler that probes services with jitter and backoff"""
+
+    def __init__(
+        self,
+        interval: Optional[float] = None,
+        ttl: Optional[float] = None,
+        timeout: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+        jitter: Optional[float] = None,
+    ):
+        self.interval = interval or float(os.getenv("LLM_HEALTH_INTERVAL", "30"))
+        self.ttl = ttl or float(os.getenv("LLM_HEALTH_TTL", str(self.interval * 3)))
+        self.timeout = timeout or float(os.getenv("LLM_HEALTH_TIMEOUT", "5"))
+        self.max_backoff = max_backoff or float(os.getenv("LLM_HEALTH_MAX_BACKOFF", "300"))
+        self.jitter = jitter if jitter is not None else float(os.getenv("LLM_HEALTH_JITTER", "0.1"))
+
+        self._probes: Dict[str, Optional[ProbeFn]] = {}
+        self._timeouts: Dict[str, float] = {}  # per-service probe timeouts overriding self.timeout
+        self._status: Dict[str, ServiceStatus] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._running = False
+
+    def register(
+        self,
+        service_id: str,
+        probe: Optional[ProbeFn],
+        static_status: str = "configured",
+        timeout: Optional[float] = None,
+    ):
+        """Register or replace a service; services without a probe get a fixed status
+
+        `timeout` replaces the prober-wide timeout for probes that are
+        known to take longer, e.g. a ladder of rungs with their own timeouts.
+        """
+        task = self._tasks.pop(service_id, None)
+        if task:
+            task.cancel()
+        self._probes[service_id] = probe
+        if timeout:
+            self._timeouts[service_id] = timeout
+        else:
+            self._timeouts.pop(service_id, None)
+        status = self._status.setdefault(service_id, ServiceStatus(service_id))
+
+        if probe is None:
+            status.available = True
+            status.status = static_status
+            status.checked_at = time.time()
+            return
+
+        if self._running:
+            self._spawn(service_id)
+
+    def unregister(self, service_id: str):
+        """Stop probing a service and drop its status entry"""
+        task = self._tasks.pop(service_id, None)
+        if task:
+            task.cancel()
+        self._probes.pop(service_id, None)
+        self._timeouts.pop(service_id, None)
+        self._status.pop(service_id, None)
+
+    def record(self, service_id: str, available: bool, error: Optional[str] = None, latency_ms: Optional[float] = None):
+        """Store a probe result, e.g. from an explicit test run by the user"""
+        status = self._status.setdefault(service_id, ServiceStatus(service_id))
+        status.available = available
+        status.status = "online" if available else "offline"
+        status.error = error
+        status.latency_ms = latency_ms
+        status.checked_at = time.time()
+        status.consecutive_failures = 0 if available else status.consecutive_failures + 1
+
+    def get_status(self, service_id: str) -> ServiceStatus:
+        """Return the cached status; entries older than the TTL read as unknown"""
+        status = self._status.get(service_id)
+        if status is None:
+            return ServiceStatus(service_id)
+
+        if self._probes.get(service_id) is None or status.checked_at is None:
+            return status
+
+        if time.time() - status.checked_at > self.ttl:
+            stale = ServiceStatus(service_id)
+            stale.error = status.error
+            stale.checked_at = status.checked_at
+            stale.consecutive_failures = status.consecutive_failures
+            return stale
+
+        return status
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Return the whole status table"""
+        return {service_id: self.get_status(service_id).to_dict() for service_id in self._status}
+
+    async def start(self):
+        """Start probing all registered services"""
+        if self._running:
+            return
+        self._running = True
+        for service_id in self._probes:
+            self._spawn(service_id)
+
+    async def stop(self):
+        """Cancel all probe loops"""
+        self._running = False
+        tasks = list(self._tasks.values())
+        self._tasks = {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, service_id: str):
+        if self._probes.get(service_id) is None or service_id in self._tasks:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Picked up by start() once the loop is running
+        self._tasks[service_id] = loop.create_task(self._probe_loop(service_id))
+
+    def _next_delay(self, failures: int) -> float:
+        base = self.interval if failures == 0 else min(self.interval * (2 ** failures), self.max_backoff)
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    async def _probe_loop(self, service_id: str):
+        # Spread the first round so services are not all probed at the same instant
+        await asyncio.sleep(random.uniform(0, self.jitter))
+
+        while True:
+            probe = self._probes.get(service_id)
+            if probe is None:
+                return
+
+            timeout = self._timeouts.get(service_id, self.timeout)
+            started = time.perf_counter()
+            try:
+                outcome = await asyncio.wait_for(probe(), timeout=timeout)
+                if isinstance(outcome, dict):
+                    available, error = bool(outcome.get("available")), outcome.get("error")
+                else:
+                    available, error = bool(outcome), None
+                if not available and not error:
+                    error = "probe failed"
+            except asyncio.CancelledError:
+                raise
+            except asyncio.TimeoutError:
+                available, error = False, f"probe timed out after {timeout:g}s"
+            except Exception as e:
+                available, error = False, str(e)
+
+            if service_id not in self._probes:
+                return
+            self.record(service_id, available, error, round((time.perf_counter() - started) * 1000, 1))
+
+            status = self._status[service_id]
+            status.next_probe_in = self._next_delay(status.consecutive_failures)
+            await asyncio.sleep(status.next_probe_in)
@@ -0,0 +1,165 @@
+# Record per-request LLM latency and throughput per (service, model)
+# Aggregate into counters and fixed-bucket histograms
+# Render everything in the Prometheus text exposition format
+
+import bisect
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (1, 4, 16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Fixed-bucket histogram"""
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Family:
+    def __init__(self, name: str, kind: str, help_text: str, buckets: Optional[Iterable[float]] = None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.buckets = buckets
+        self.values: Dict[Labels, object] = {}
+
+    def inc(self, labels: Labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def observe(self, labels: Labels, value: float):
+        histogram = self.values.get(labels)
+        if histogram is None:
+            histogram = self.values[labels] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.values.items()):
+            if self.kind == "counter":
+                lines.append(f"{self.name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+
+            cumulative = 0
+            for bound, count in zip(self.buckets, value.counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_number(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value.count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_number(value.sum)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {value.count}")
+        return lines
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def classify_error(message: Optional[str]) -> str:
+    """Map an error message to a small set of label values"""
+    text = (message or "").lower()
+    if "busy" in text or "queue" in text:
+        return "rejected"
+    if "deadline" in text:
+        return "deadline"
+    if "first token" in text or "timed out" in text or "timeout" in text:
+        return "timeout"
+    if "connect" in text or "connection" in text or "unreachable" in text:
+        return "connect"
+    if "not found" in text or "404" in text:
+        return "not_found"
+    return "upstream"
+
+
+class LLMMetrics:
+    """Latency and throughput metrics for LLM requests"""
+
+    def __init__(self):
+        self.requests = _Family("hyperhint_llm_requests_total", "counter", "LLM requests by outcome")
+        self.errors = _Family("hyperhint_llm_errors_total", "counter", "Failed LLM requests by error class")
+        self.output_chunks = _Family("hyperhint_llm_output_chunks_total", "counter", "Streamed content chunks")
+        self.output_tokens_total = _Family("hyperhint_llm_output_tokens_total", "counter", "Generated output tokens")
+        self.ttft = _Family(
+            "hyperhint_llm_time_to_first_token_seconds", "histogram",
+            "Time from dispatch to the first content chunk", LATENCY_BUCKETS,
+        )
+        self.inter_token = _Family(
+            "hyperhint_llm_inter_token_latency_seconds", "histogram",
+            "Gap between consecutive content chunks", LATENCY_BUCKETS,
+        )
+        self.duration = _Family(
+            "hyperhint_llm_request_duration_seconds", "histogram",
+            "Time from dispatch to the end of the stream", LATENCY_BUCKETS,
+        )
+        self.queue_wait = _Family(
+            "hyperhint_llm_queue_wait_seconds", "histogram",
+            "Time spent waiting for an admission slot", LATENCY_BUCKETS,
+        )
+        self.output_tokens = _Family(
+            "hyperhint_llm_output_tokens", "histogram", "Output tokens per request", TOKEN_BUCKETS,
+        )
+        self._families = [
+            self.requests, self.errors, self.output_chunks, self.output_tokens_total,
+            self.ttft, self.inter_token, self.duration, self.queue_wait, self.output_tokens,
+        ]
+
+    def observe_queue_wait(self, service_id: str, model: str, seconds: float):
+        self.queue_wait.observe((("model", model), ("service", service_id)), seconds)
+
+    def observe_inter_token(self, service_id: str, model: str, seconds: float):
+        self.inter_token.observe((("model", model), ("service", service_id)), seconds)
+
+    def observe_request(
+        self,
+        service_id: str,
+        model: str,
+        duration: float,
+        ttft: Optional[float],
+        chunks: int,
+        tokens: Optional[int],
+        outcome: str,
+        error: Optional[str] = None,
+    ):
+        """Record one finished attempt against a service"""
+        labels = (("model", model), ("service", service_id))
+        self.requests.inc(labels + (("outcome", outcome),))
+
+        if outcome == "error":
+            self.errors.inc(labels + (("error_class", classify_error(error)),))
+            return
+        if outcome != "success":
+            return
+
+        self.duration.observe(labels, duration)
+        if ttft is not None:
+            self.ttft.observe(labels, ttft)
+        self.output_chunks.inc(labels, chunks)
+        output_tokens = tokens if tokens is not None else chunks
+        self.output_tokens_total.inc(labels, output_tokens)
+        self.output_tokens.observe(labels, output_tokens)
+
+    def render(self) -> str:
+        """Return all metrics in Prometheus text format"""
+        lines: List[str] = []
+        for family in self._families:
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
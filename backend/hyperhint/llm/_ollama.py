@@ -4,32 +4,75 @@
 # Parse the response
 # Return the response
 
-import asyncio
 from datetime import datetime
-from typing import Any, AsyncGenerator, Dict, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional, Union
 import os
 
-try:
-    from ollama import AsyncClient, Client
-except ImportError:
-    AsyncClient = None
-    Client = None
+import httpx
+
+from ._breaker import is_connect_error
+from ._fastpath import ollama_deltas
+from ._transport import transport_registry
+
+
+def _sdk():
+    """Import the ollama SDK when the first service is built, not when this module loads"""
+    try:
+        import ollama
+    except ImportError:
+        return None
+    return ollama
 
 
 class OllamaService:
-    def __init__(self, host: str = "http://localhost:11434"):
+    def __init__(self, host: str = "http://localhost:11434", fast_stream: Optional[bool] = None):
         self.host = host
+        # Read NDJSON straight off the byte stream instead of building response objects per token
+        self.fast_stream = (
+            os.getenv("LLM_FAST_STREAM", "False").lower() == "true" if fast_stream is None else fast_stream
+        )
+        self._http = None
         # Ollama trust_env setting
         trust_env_setting = os.getenv("OLLAMA_TRUST_ENV", "False").lower() == "true"
         verify_ssl_setting = os.getenv("OLLAMA_VERIFY_SSL", "False").lower() == "true"
-        self.client = Client(host=host, trust_env=trust_env_setting,verify=verify_ssl_setting) if Client else None
-        self.async_client = AsyncClient(host=host, trust_env=trust_env_setting,verify=verify_ssl_setting) if AsyncClient else None
+        self._transport_keys = []
+        self.client = None
+        self.async_client = None
+
+        # Clients share pooled transports with every other service on the same host
+        ollama = _sdk()
+        if ollama:
+            sync_key = transport_registry.key("sync", host, verify_ssl_setting, trust_env_setting)
+            async_key = transport_registry.key("async", host, verify_ssl_setting, trust_env_setting)
+            self._transport_keys = [sync_key, async_key]
+            timeout = transport_registry.timeout
+            self.client = ollama.Client(
+                host=host, trust_env=trust_env_setting, timeout=timeout, transport=transport_registry.acquire(sync_key)
+            )
+            async_transport = transport_registry.acquire(async_key)
+            self.async_client = ollama.AsyncClient(
+                host=host, trust_env=trust_env_setting, timeout=timeout, transport=async_transport
+            )
+            self._http = httpx.AsyncClient(
+                base_url=host if "://" in host else f"http://{host}",
+                trust_env=trust_env_setting,
+                timeout=timeout,
+                transport=async_transport,
+            )
+
+    def close(self):
+        """Release the shared transports; the last user closes their connections"""
+        for key in self._transport_keys:
+            transport_registry.release(key)
+        self._transport_keys = []
         
     async def stream_chat(
         self, 
         messages: List[Dict[str, str]], 
         model: str = "llama3.2",
-        stream_id: Optional[str] = None
+        stream_id: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
+        keep_alive: Optional[Union[str, float]] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream chat response from Ollama"""
         
@@ -55,35 +98,134 @@ class OllamaService:
                 })
             
             # Stream response from Ollama
-            async for part in await self.async_client.chat(
-                model=model, 
-                messages=ollama_messages, 
-                stream=True
-            ):
-                content = part.get('message', {}).get('content', '')
-                if content:
-                    yield {
-                        "type": "content",
-                        "content": content,
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    
-                # Small delay to make streaming visible
-                await asyncio.sleep(0.01)
+            usage = None
+            if self.fast_stream:
+                payload = {"model": model, "messages": ollama_messages, "stream": True}
+                if options:
+                    payload["options"] = options
+                if keep_alive is not None:
+                    payload["keep_alive"] = keep_alive
+                async for content, final_usage in ollama_deltas(self._http, payload):
+                    if content:
+                        yield {"type": "content", "content": content}
+                    if final_usage:
+                        usage = final_usage
+            else:
+                async for part in await self.async_client.chat(
+                    model=model, 
+                    messages=ollama_messages, 
+                    stream=True,
+                    options=options,
+                    keep_alive=keep_alive
+                ):
+                    content = part.get('message', {}).get('content', '')
+                    if content:
+                        yield {"type": "content", "content": content}
+                    if part.get('done') and part.get('eval_count') is not None:
+                        usage = {
+                            "prompt_tokens": part.get('prompt_eval_count'),
+                            "completion_tokens": part.get('eval_count'),
+                        }
             
             # Send completion event
-            yield {
+            complete_event = {
                 "type": "complete", 
                 "timestamp": datetime.now().isoformat()
             }
+            if usage:
+                complete_event["usage"] = usage
+            yield complete_event
             
         except Exception as e:
             yield {
                 "type": "error",
                 "message": f"Ollama error: {str(e)}",
+                "connect_error": is_connect_error(e),
                 "timestamp": datetime.now().isoformat()
             }
     
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        options: Optional[Dict[str, Any]] = None,
+        keep_alive: Optional[Union[str, float]] = None
+    ) -> Dict[str, Any]:
+        """Single non-streaming chat request; raises on failure"""
+        if not self.async_client:
+            raise RuntimeError("Ollama library not installed. Run: pip install ollama")
+
+        options = dict(options or {})
+        if max_tokens is not None:
+            options["num_predict"] = max_tokens
+        if stop:
+            options["stop"] = stop
+        response = await self.async_client.chat(
+            model=model,
+            messages=[{"role": msg.get("role", "user"), "content": msg.get("content", "")} for msg in messages],
+            stream=False,
+            options=options,
+            keep_alive=keep_alive
+        )
+
+        usage = None
+        if response.get('eval_count') is not None:
+            usage = {
+                "prompt_tokens": response.get('prompt_eval_count'),
+                "completion_tokens": response.get('eval_count'),
+            }
+        return {"content": response.get('message', {}).get('content', '') or "", "usage": usage}
+
+    async def embed(
+        self, texts: List[str], model: str, keep_alive: Optional[Union[str, float]] = None
+    ) -> Dict[str, Any]:
+        """Embedding vectors for a batch of texts, in input order; raises on failure"""
+        if not self.async_client:
+            raise RuntimeError("Ollama library not installed. Run: pip install ollama")
+        response = await self.async_client.embed(model=model, input=texts, keep_alive=keep_alive)
+        usage = None
+        if response.get('prompt_eval_count') is not None:
+            usage = {"prompt_tokens": response.get('prompt_eval_count')}
+        return {"embeddings": [list(vector) for vector in response.get('embeddings') or []], "usage": usage}
+
+    async def warm(self, model: str, keep_alive: Optional[Union[str, float]] = None):
+        """Load a model into memory; an empty prompt makes Ollama load it without generating"""
+        if not self.async_client:
+            raise RuntimeError("Ollama library not installed. Run: pip install ollama")
+        await self.async_client.generate(model=model, prompt="", keep_alive=keep_alive)
+
+    async def context_length(self, model: str) -> Optional[int]:
+        """Window a request without num_ctx runs in: the Modelfile's num_ctx, else the server default
+
+        The server default (LLM_DEFAULT_CONTEXT_LENGTH, as Ollama's own) is
+        capped by the window model_info says the model was trained for.
+        """
+        if not self.async_client:
+            return None
+        response = await self.async_client.show(model)
+        for line in (response.parameters or "").splitlines():
+            name, _, value = line.strip().partition(" ")
+            if name == "num_ctx" and value.strip().isdigit():
+                return int(value.strip())
+        default = int(os.getenv("LLM_DEFAULT_CONTEXT_LENGTH", "4096"))
+        for key, value in (response.modelinfo or {}).items():
+            if key.endswith(".context_length") and value:
+                return min(int(value), default)
+        return default
+
+    async def loaded_models(self) -> Dict[str, Optional[float]]:
+        """Models currently in memory, mapped to when they will be unloaded (epoch seconds)"""
+        if not self.async_client:
+            return {}
+        response = await self.async_client.ps()
+        loaded = {}
+        for model in response.models:
+            expires_at = getattr(model, "expires_at", None)
+            loaded[model.model] = expires_at.timestamp() if expires_at else None
+        return loaded
+
     def list_models(self) -> List[str]:
         """List available Ollama models"""
         if not self.client:
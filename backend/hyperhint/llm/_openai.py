@@ -6,15 +6,64 @@
 
 import asyncio
 import os
+import ssl
+import time
 from datetime import datetime
-from typing import Any, AsyncGenerator, Dict, List, Optional
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
 import httpx
 
-try:
-    from openai import AsyncOpenAI, OpenAI
-except ImportError:
-    AsyncOpenAI = None
-    OpenAI = None
+from ._breaker import is_connect_error
+from ._fastpath import StreamError, openai_deltas
+from ._transport import transport_registry
+
+
+def _sdk():
+    """Import the OpenAI SDK when the first service is built; it is slow to import"""
+    try:
+        import openai
+    except ImportError:
+        return None
+    return openai
+
+
+def _route_missing(error: Exception) -> bool:
+    """Some compatible endpoints answer 404/405 for routes they do not implement"""
+    openai = _sdk()
+    return openai is not None and isinstance(error, openai.APIStatusError) and error.status_code in (404, 405)
+
+
+def _request_rejected(error: Exception) -> bool:
+    """The server refused the request itself (400/422), e.g. over a parameter it does not support"""
+    if isinstance(error, StreamError):
+        return error.status_code in (400, 422)
+    openai = _sdk()
+    return openai is not None and isinstance(error, openai.APIStatusError) and error.status_code in (400, 422)
+
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+# Context windows of OpenAI models by name prefix, for servers whose /models does not report them
+KNOWN_CONTEXT_LENGTHS = {
+    "gpt-5": 400000,
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1-mini": 128000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+
+# Fields compatible servers use for the window in their /models entries (vLLM, LM Studio, OpenRouter...)
+CONTEXT_LENGTH_FIELDS = ("context_length", "max_model_len", "max_context_length", "context_window")
+
+# Probe rungs, cheapest first. "completion" is the only one that spends tokens.
+# "none" runs no rung: the service is taken as available as configured.
+PROBE_LEVELS = ("connect", "models", "completion")
 
 
 class OpenAIService:
@@ -22,35 +71,74 @@ class OpenAIService:
     OpenAI service class for streaming chat responses
     """
 
-    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, fast_stream: Optional[bool] = None):
         self.api_key = api_key
         self.base_url = base_url
         self.client = None
         self.sync_client = None
+        # Parse SSE lines off the byte stream instead of building SDK chunk models per token
+        self.fast_stream = (
+            os.getenv("LLM_FAST_STREAM", "False").lower() == "true" if fast_stream is None else fast_stream
+        )
+        # Ask for token usage in the last chunk of a stream; turned off for servers that reject it
+        self.stream_usage = os.getenv("OPENAI_STREAM_USAGE", "True").lower() == "true"
 
         # Determine SSL verification setting for OpenAI
         trust_env_setting = os.getenv("OPENAI_TRUST_ENV", "False").lower() == "true"
         verify_ssl_setting = os.getenv("OPENAI_VERIFY_SSL", "True").lower() == "true"
+        self.trust_env = trust_env_setting
+        self.verify_ssl = verify_ssl_setting
+
+        # Per-rung probe timeouts (seconds) so a dead endpoint fails fast
+        self.probe_timeouts = {
+            "connect": float(os.getenv("OPENAI_PROBE_CONNECT_TIMEOUT", "1")),
+            "models": float(os.getenv("OPENAI_PROBE_MODELS_TIMEOUT", "3")),
+            "completion": float(os.getenv("OPENAI_PROBE_COMPLETION_TIMEOUT", "10")),
+        }
 
-        # Create httpx clients with configurable verify
-        http_client = httpx.Client(trust_env=trust_env_setting, verify=verify_ssl_setting)
-        async_http_client = httpx.AsyncClient(trust_env=trust_env_setting, verify=verify_ssl_setting)
+        # Create httpx clients on top of pooled transports shared per endpoint
+        endpoint = base_url or DEFAULT_BASE_URL
+        self._transport_keys = [
+            transport_registry.key("sync", endpoint, verify_ssl_setting, trust_env_setting),
+            transport_registry.key("async", endpoint, verify_ssl_setting, trust_env_setting),
+        ]
+        timeout = transport_registry.timeout
+        http_client = httpx.Client(
+            trust_env=trust_env_setting, timeout=timeout, transport=transport_registry.acquire(self._transport_keys[0])
+        )
+        async_http_client = httpx.AsyncClient(
+            trust_env=trust_env_setting, timeout=timeout, transport=transport_registry.acquire(self._transport_keys[1])
+        )
+        self._http = async_http_client
+        self._chat_url = endpoint.rstrip("/") + "/chat/completions"
 
-        if AsyncOpenAI and OpenAI:
+        openai = _sdk()
+        if openai:
             if base_url:
                 # For OpenAI-compatible endpoints (like local LLMs)
-                self.client = AsyncOpenAI(api_key=api_key or "dummy", base_url=base_url, http_client=async_http_client)
-                self.sync_client = OpenAI(api_key=api_key or "dummy", base_url=base_url, http_client=http_client)
+                self.client = openai.AsyncOpenAI(
+                    api_key=api_key or "dummy", base_url=base_url, timeout=timeout, http_client=async_http_client
+                )
+                self.sync_client = openai.OpenAI(
+                    api_key=api_key or "dummy", base_url=base_url, timeout=timeout, http_client=http_client
+                )
             elif api_key:
                 # For official OpenAI API
-                self.client = AsyncOpenAI(api_key=api_key, http_client=async_http_client)
-                self.sync_client = OpenAI(api_key=api_key, http_client=http_client)
+                self.client = openai.AsyncOpenAI(api_key=api_key, timeout=timeout, http_client=async_http_client)
+                self.sync_client = openai.OpenAI(api_key=api_key, timeout=timeout, http_client=http_client)
+
+    def close(self):
+        """Release the shared transports; the last user closes their connections"""
+        for key in self._transport_keys:
+            transport_registry.release(key)
+        self._transport_keys = []
 
     async def stream_chat(
         self,
         messages: List[Dict[str, str]],
         model: str = "gpt-3.5-turbo",
         stream_id: Optional[str] = None,
+        options: Optional[Dict[str, Any]] = None,
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """Stream chat response from OpenAI or compatible endpoint"""
 
@@ -77,59 +165,255 @@ class OpenAIService:
                 )
 
             # Stream response from OpenAI
-            stream = await self.client.chat.completions.create(
-                model=model, messages=openai_messages, stream=True
-            )
-
-            async for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    yield {
-                        "type": "content",
-                        "content": content,
-                        "timestamp": datetime.now().isoformat(),
-                    }
-
-                    # Small delay to make streaming visible
-                    await asyncio.sleep(0.01)
+            usage = None
+            request_options = dict(options or {})
+            ask_usage = self.stream_usage and "stream_options" not in request_options
+            if ask_usage:
+                request_options["stream_options"] = {"include_usage": True}
+            try:
+                async for content, chunk_usage in self._deltas(openai_messages, model, request_options):
+                    if content:
+                        yield {"type": "content", "content": content}
+                    if chunk_usage:
+                        usage = chunk_usage
+            except Exception as e:
+                # A server that rejects stream_options refuses the request before sending anything
+                if not (ask_usage and _request_rejected(e)):
+                    raise
+                del request_options["stream_options"]
+                async for content, chunk_usage in self._deltas(openai_messages, model, request_options):
+                    if content:
+                        yield {"type": "content", "content": content}
+                    if chunk_usage:
+                        usage = chunk_usage
+                self.stream_usage = False
+                print(f"{self.base_url or DEFAULT_BASE_URL} rejected stream_options ({e}), streaming without usage")
 
             # Send completion event
-            yield {"type": "complete", "timestamp": datetime.now().isoformat()}
+            complete_event = {"type": "complete", "timestamp": datetime.now().isoformat()}
+            if usage:
+                complete_event["usage"] = usage
+            yield complete_event
 
         except Exception as e:
             yield {
                 "type": "error",
                 "message": f"OpenAI error: {str(e)}",
+                "connect_error": is_connect_error(e),
                 "timestamp": datetime.now().isoformat(),
             }
 
+    async def _deltas(
+        self, messages: List[Dict[str, str]], model: str, options: Dict[str, Any]
+    ) -> AsyncGenerator[Tuple[Optional[str], Optional[Dict[str, Any]]], None]:
+        """(content, usage) pairs of a streamed completion, off the byte stream or through the SDK"""
+        if self.fast_stream:
+            payload = {"model": model, "messages": messages, "stream": True, **options}
+            headers = {"Authorization": f"Bearer {self.api_key or 'dummy'}"}
+            async for delta in openai_deltas(self._http, self._chat_url, headers, payload):
+                yield delta
+            return
+
+        stream = await self.client.chat.completions.create(model=model, messages=messages, stream=True, **options)
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            usage = None
+            if getattr(chunk, "usage", None):
+                # Only sent by servers that honour stream_options.include_usage
+                usage = {
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "completion_tokens": chunk.usage.completion_tokens,
+                }
+            if content or usage:
+                yield content, usage
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        max_tokens: Optional[int] = None,
+        stop: Optional[List[str]] = None,
+        options: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """Single non-streaming completion; raises on failure"""
+        if not self.client:
+            raise RuntimeError("OpenAI library not installed. Run: pip install openai")
+
+        params = dict(options or {})
+        if max_tokens is not None:
+            params["max_tokens"] = max_tokens
+        if stop:
+            params["stop"] = stop[:4]  # The API accepts at most four stop sequences
+        response = await self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": msg.get("role", "user"), "content": msg.get("content", "")} for msg in messages],
+            stream=False,
+            **params,
+        )
+
+        usage = None
+        if response.usage:
+            usage = {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+            }
+        content = response.choices[0].message.content if response.choices else ""
+        return {"content": content or "", "usage": usage}
+
+    async def embed(self, texts: List[str], model: str) -> Dict[str, Any]:
+        """Embedding vectors for a batch of texts, in input order; raises on failure"""
+        if not self.client:
+            raise RuntimeError("OpenAI library not installed. Run: pip install openai")
+
+        response = await self.client.embeddings.create(model=model, input=texts)
+        usage = {"prompt_tokens": response.usage.prompt_tokens} if response.usage else None
+        # The API may return the batch out of order; `index` ties each vector to its input
+        return {"embeddings": [item.embedding for item in sorted(response.data, key=lambda item: item.index)], "usage": usage}
+
     def list_models(self) -> List[str]:
         """List available models - returns empty list as models are configured per service"""
         # Models are configured per service instance, not globally
         return []
 
-    def is_available(self, test_model: Optional[str] = None) -> bool:
-        """Check if OpenAI service is available by testing connection with actual model"""
-        if not self.sync_client:
-            return False
-            
-        # If no test model provided, try to list models first
-        if not test_model:
+    async def context_length(self, model: str) -> Optional[int]:
+        """Context window the server reports for the model in /models, else a known OpenAI limit, else None"""
+        if self.client:
+            client = self.client.with_options(timeout=self.probe_timeouts["models"], max_retries=0)
             try:
-                models = self.sync_client.models.list()
-                if models.data:
-                    # Use the first available model for testing
-                    test_model = models.data[0].id
-                else:
-                    # No models available
-                    return False
+                models = (await client.models.list()).data
             except Exception:
-                # If models.list() fails, we can't test without a specific model
+                models = []
+            for entry in models:
+                if entry.id != model:
+                    continue
+                for field in CONTEXT_LENGTH_FIELDS:
+                    value = getattr(entry, field, None)
+                    if isinstance(value, (int, float)) and value > 0:
+                        return int(value)
+
+        name = model.rsplit("/", 1)[-1]
+        for prefix in sorted(KNOWN_CONTEXT_LENGTHS, key=len, reverse=True):
+            if name.startswith(prefix):
+                return KNOWN_CONTEXT_LENGTHS[prefix]
+        return None
+
+    def probe_timeout(self, level: str) -> float:
+        """Longest a probe up to `level` can take: the sum of its rung timeouts"""
+        if level not in PROBE_LEVELS:
+            return 0.0
+        return sum(self.probe_timeouts[rung] for rung in PROBE_LEVELS[: PROBE_LEVELS.index(level) + 1])
+
+    async def probe(self, level: str = "models", test_model: Optional[str] = None) -> Dict[str, Any]:
+        """Run the probe ladder up to `level` on the async client
+
+        connect    -> TCP (and TLS) handshake with the endpoint host
+        models     -> GET /models; a 404/405 still proves the server answers
+        completion -> a real 1-token completion, only when explicitly asked
+        """
+        result: Dict[str, Any] = {"available": False, "level": level, "rungs": {}, "models": [], "error": None}
+
+        if level == "none":
+            result["available"] = True
+            return result
+        if level not in PROBE_LEVELS:
+            result["error"] = f"Unknown probe level: {level}"
+            return result
+        if not self.client:
+            result["error"] = "OpenAI library not installed or not configured"
+            return result
+
+        for rung in PROBE_LEVELS[: PROBE_LEVELS.index(level) + 1]:
+            started = time.perf_counter()
+            try:
+                if rung == "connect":
+                    await self._probe_connect()
+                elif rung == "models":
+                    result["models"] = await self._probe_models()
+                else:
+                    await self._probe_completion(test_model or (result["models"] or [None])[0])
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = TimeoutError(f"{rung} probe timed out after {self.probe_timeouts[rung]}s")
+                result["rungs"][rung] = {"ok": False, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+                result["error"] = f"{rung}: {e}"
+                return result
+
+            result["rungs"][rung] = {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+        result["available"] = True
+        return result
+
+    async def _probe_connect(self):
+        # A proxy may be required to reach the host, so a direct dial proves nothing
+        if self.trust_env:
+            return
+
+        url = urlparse(self.base_url or DEFAULT_BASE_URL)
+        secure = url.scheme == "https"
+        port = url.port or (443 if secure else 80)
+
+        ssl_context = None
+        if secure:
+            ssl_context = ssl.create_default_context()
+            if not self.verify_ssl:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, port, ssl=ssl_context),
+            timeout=self.probe_timeouts["connect"],
+        )
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except Exception:
+            pass
+
+    async def _probe_models(self) -> List[str]:
+        client = self.client.with_options(timeout=self.probe_timeouts["models"], max_retries=0)
+        try:
+            models = await client.models.list()
+        except Exception as e:
+            # Some compatible endpoints do not implement /models but are otherwise healthy
+            if _route_missing(e):
+                return []
+            raise
+        return [model.id for model in models.data]
+
+    async def _probe_completion(self, test_model: Optional[str]):
+        if not test_model:
+            raise ValueError("no model available to test a completion with")
+
+        client = self.client.with_options(timeout=self.probe_timeouts["completion"], max_retries=0)
+        await client.chat.completions.create(
+            model=test_model,
+            messages=[{"role": "user", "content": "hi"}],
+            max_tokens=1,
+            stream=False,
+        )
+
+    def is_available(self, test_model: Optional[str] = None, completion: bool = False) -> bool:
+        """Check if the endpoint answers /models; only run a completion when asked to"""
+        if not self.sync_client:
+            return False
+
+        client = self.sync_client.with_options(timeout=self.probe_timeouts["models"], max_retries=0)
+        try:
+            client.models.list()
+        except Exception as e:
+            if not _route_missing(e):
+                print(f"OpenAI service not reachable: {e}")
                 return False
-            
+
+        if not completion:
+            return True
+
+        if not test_model:
+            return False
+
         try:
-            # Test connection with the actual model that will be used
-            response = self.sync_client.chat.completions.create(
+            client = self.sync_client.with_options(timeout=self.probe_timeouts["completion"], max_retries=0)
+            client.chat.completions.create(
                 model=test_model,
                 messages=[{"role": "user", "content": "hi"}],
                 max_tokens=1,
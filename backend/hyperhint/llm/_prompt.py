@@ -0,0 +1,152 @@
+# Fit the user message, attachments and memory files into a model's context window
+# Token counts are estimated from UTF-8 length, no tokenizer needed
+# Oversized parts keep their beginning and end and drop the middle
+
+import math
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+SEPARATOR = "=" * 50
+RULE = "-" * 40
+
+
+@lru_cache(maxsize=None)
+def bytes_per_token() -> float:
+    """PROMPT_BYTES_PER_TOKEN, read on first use so that a .env loaded after import applies"""
+    return float(os.getenv("PROMPT_BYTES_PER_TOKEN", "4"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about 4 bytes of UTF-8 per token"""
+    if not text:
+        return 0
+    return math.ceil(len(text.encode("utf-8")) / bytes_per_token())
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut the middle out of `text` so that it fits in roughly `max_tokens`"""
+    total = estimate_tokens(text)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    # Work in characters, scaled by how dense this text is
+    keep_chars = max(int(len(text) * max_tokens / total) - 40, 0)
+    head_chars = keep_chars * 2 // 3
+    tail_chars = keep_chars - head_chars
+
+    head = text[:head_chars]
+    tail = text[len(text) - tail_chars:] if tail_chars else ""
+    # Prefer to cut at line breaks so code and tables stay readable
+    if "\n" in head[head_chars // 2:]:
+        head = head[:head.rindex("\n")]
+    if "\n" in tail[:tail_chars // 2]:
+        tail = tail[tail.index("\n") + 1:]
+
+    omitted = total - estimate_tokens(head) - estimate_tokens(tail)
+    return f"{head}\n[... about {omitted} tokens omitted ...]\n{tail}"
+
+
+def first_answer_line(text: str) -> str:
+    """First non-empty line of a model's answer, after any <think>...</think> reasoning
+
+    An unterminated reasoning block means the model ran out of tokens
+    before answering, so nothing is returned.
+    """
+    answer = re.sub(r"<think(?:ing)?>.*?(?:</think(?:ing)?>|$)", "", text or "", flags=re.DOTALL)
+    for line in answer.splitlines():
+        if line.strip():
+            return line.strip()
+    return ""
+
+
+class PromptSection:
+    """A block of context attached to the user message"""
+
+    def __init__(self, title: str, content: Optional[str] = None):
+        self.title = title
+        self.content = content or ""
+        self.tokens = estimate_tokens(self.content)
+
+
+class PromptBuilder:
+    """Allocate a model's context window across the message and its sections"""
+
+    def __init__(self, context_length: int, reserve_tokens: Optional[int] = None, message_share: Optional[float] = None):
+        self.context_length = context_length
+        reserve = int(os.getenv("PROMPT_RESERVE_TOKENS", "1024")) if reserve_tokens is None else reserve_tokens
+        # Leave room for the answer, but never more than a quarter of a small window
+        self.reserve_tokens = min(reserve, context_length // 4)
+        self.message_share = (
+            float(os.getenv("PROMPT_MESSAGE_SHARE", "0.5")) if message_share is None else message_share
+        )
+
+    @property
+    def budget(self) -> int:
+        return max(self.context_length - self.reserve_tokens, 0)
+
+    def build(self, message: str, sections: List[PromptSection], heading: str = "Uploaded Files") -> Tuple[str, Dict[str, Any]]:
+        """Return the final user message content and a report of what was trimmed"""
+        framing = estimate_tokens(f"\n\n{heading}:\n{SEPARATOR}\n\n{SEPARATOR}") if sections else 0
+        overhead = sum(estimate_tokens(f"{section.title}\n{RULE}\n\n{RULE}\n\n") for section in sections)
+        available = max(self.budget - framing - overhead, 0)
+
+        # The message comes first, but may not crowd out every attachment
+        message_tokens = estimate_tokens(message)
+        sections_wanted = sum(section.tokens for section in sections)
+        message_budget = min(message_tokens, max(available - sections_wanted, int(available * self.message_share)))
+        if not sections:
+            message_budget = min(message_tokens, available)
+
+        allocations = self._allocate([section.tokens for section in sections], available - message_budget)
+
+        content = trim_to_tokens(message, message_budget)
+        blocks = []
+        trimmed = []
+        for section, allocation in zip(sections, allocations):
+            if not section.content:
+                blocks.append(section.title)
+                continue
+            if allocation < section.tokens:
+                trimmed.append({"title": section.title, "tokens": section.tokens, "kept": allocation})
+            body = trim_to_tokens(section.content, allocation)
+            if body:
+                blocks.append(f"{section.title}\n{RULE}\n{body}\n{RULE}")
+            else:
+                blocks.append(f"{section.title} (omitted, does not fit in the context window)")
+
+        if blocks:
+            content += f"\n\n{heading}:\n{SEPARATOR}\n" + "\n\n".join(blocks) + f"\n{SEPARATOR}"
+
+        report = {
+            "context_length": self.context_length,
+            "budget": self.budget,
+            "estimated_tokens": estimate_tokens(content),
+            "message_trimmed": message_budget < message_tokens,
+            "trimmed_sections": trimmed,
+        }
+        return content, report
+
+    @staticmethod
+    def _allocate(wanted: List[int], budget: int) -> List[int]:
+        """Max-min fair split: small sections fit whole, large ones share the rest evenly"""
+        allocations = [0] * len(wanted)
+        remaining = max(budget, 0)
+        pending = sorted(range(len(wanted)), key=lambda index: wanted[index])
+
+        while pending:
+            share = remaining // len(pending)
+            index = pending[0]
+            if wanted[index] <= share:
+                allocations[index] = wanted[index]
+                remaining -= wanted[index]
+                pending.pop(0)
+                continue
+            for index in pending:
+                allocations[index] = share
+            break
+
+        return allocations
@@ -0,0 +1,97 @@
+# Coalesce identical concurrent LLM requests into one upstream stream
+# The first caller starts the upstream generation, later callers attach to it
+# Every subscriber replays the chunks from the beginning, then follows live
+
+import asyncio
+from datetime import datetime
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Dict, List
+
+
+class _Flight:
+    """One in-flight upstream stream and its buffered chunks"""
+
+    def __init__(self):
+        self.chunks: List[Dict[str, Any]] = []
+        self.done = False
+        self.subscribers = 0
+        self.changed = asyncio.Condition()
+        self.task: asyncio.Task = None
+
+
+class SingleFlight:
+    """Fan one upstream stream out to every identical concurrent request"""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def stream(
+        self, key: str, factory: Callable[[], AsyncIterator[Dict[str, Any]]]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Yield the chunks of the flight for `key`, starting it if needed"""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory))
+            self.started += 1
+        else:
+            self.coalesced += 1
+
+        flight.subscribers += 1
+        index = 0
+        try:
+            while True:
+                async with flight.changed:
+                    while index >= len(flight.chunks) and not flight.done:
+                        await flight.changed.wait()
+                    pending = flight.chunks[index:]
+                    index = len(flight.chunks)
+                    finished = flight.done
+
+                for chunk in pending:
+                    yield chunk
+
+                if finished and index >= len(flight.chunks):
+                    return
+        finally:
+            flight.subscribers -= 1
+            # Only the last subscriber leaving stops the upstream generation
+            if flight.subscribers == 0 and not flight.done:
+                flight.task.cancel()
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    async def _run(self, key: str, flight: _Flight, factory: Callable[[], AsyncIterator[Dict[str, Any]]]):
+        try:
+            async for chunk in factory():
+                async with flight.changed:
+                    flight.chunks.append(chunk)
+                    flight.changed.notify_all()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            async with flight.changed:
+                flight.chunks.append({
+                    "type": "error",
+                    "message": f"LLM error: {str(e)}",
+                    "timestamp": datetime.now().isoformat()
+                })
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.done = True
+            try:
+                async with flight.changed:
+                    flight.changed.notify_all()
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values()),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,145 @@
+# Share httpx connection pools between all LLM service clients
+# Transports are keyed by (origin, TLS settings) and reference counted
+# The last service to let go of a transport closes it
+
+import asyncio
+import os
+from typing import Any, Dict, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+TransportKey = Tuple[str, str, bool, bool, bool]
+
+
+class _Entry:
+    def __init__(self, transport: Any):
+        self.transport = transport
+        self.refs = 0
+        self.acquisitions = 0
+
+
+class TransportRegistry:
+    """Process-wide registry of pooled sync and async httpx transports"""
+
+    def __init__(self):
+        self._settings: Optional[Tuple[bool, httpx.Limits, httpx.Timeout]] = None
+        self._entries: Dict[TransportKey, _Entry] = {}
+        self._closing: Set[asyncio.Task] = set()
+        self.closed = 0
+
+    def _configure(self) -> Tuple[bool, httpx.Limits, httpx.Timeout]:
+        """Read the pool settings on first use, after .env has been loaded"""
+        if self._settings is None:
+            http2 = os.getenv("LLM_HTTP2", "False").lower() == "true" and HTTP2_AVAILABLE
+            limits = httpx.Limits(
+                max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", "30")),
+            )
+            # Connect fails fast; read is only a backstop, the manager enforces first-token and idle gaps
+            connect_timeout = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+            timeout = httpx.Timeout(
+                connect=connect_timeout,
+                read=float(os.getenv("LLM_READ_TIMEOUT", "300")),
+                write=float(os.getenv("LLM_WRITE_TIMEOUT", "30")),
+                pool=connect_timeout,
+            )
+            self._settings = (http2, limits, timeout)
+        return self._settings
+
+    @property
+    def http2(self) -> bool:
+        return self._configure()[0]
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return self._configure()[1]
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return self._configure()[2]
+
+    @staticmethod
+    def _origin(base_url: Optional[str]) -> str:
+        url = urlparse(base_url or "")
+        return f"{url.scheme}://{url.netloc}" if url.netloc else (base_url or "")
+
+    def key(self, kind: str, base_url: Optional[str], verify: bool, trust_env: bool) -> TransportKey:
+        return (kind, self._origin(base_url), verify, trust_env, self.http2)
+
+    def acquire(self, key: TransportKey) -> Any:
+        """Return the shared transport for a key, creating it on first use"""
+        entry = self._entries.get(key)
+        if entry is None:
+            kind, _, verify, trust_env, http2 = key
+            transport_class = httpx.AsyncHTTPTransport if kind == "async" else httpx.HTTPTransport
+            entry = _Entry(
+                transport_class(verify=verify, trust_env=trust_env, http2=http2, limits=self.limits)
+            )
+            self._entries[key] = entry
+
+        entry.refs += 1
+        entry.acquisitions += 1
+        return entry.transport
+
+    def release(self, key: TransportKey):
+        """Drop one reference; close the transport when nobody uses it any more"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+
+        del self._entries[key]
+        self.closed += 1
+        if key[0] == "sync":
+            entry.transport.close()
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # No loop, so the async pool never opened a connection
+        task = loop.create_task(entry.transport.aclose())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def stats(self) -> Dict[str, Any]:
+        """Report pool reuse and open connection counts per transport"""
+        transports = []
+        for (kind, origin, verify, trust_env, http2), entry in self._entries.items():
+            pool = getattr(entry.transport, "_pool", None)
+            connections = list(getattr(pool, "connections", []) or [])
+            transports.append({
+                "kind": kind,
+                "origin": origin,
+                "verify": verify,
+                "trust_env": trust_env,
+                "http2": http2,
+                "refs": entry.refs,
+                "reuses": entry.acquisitions - 1,
+                "open_connections": len(connections),
+                "idle_connections": sum(1 for connection in connections if connection.is_idle()),
+            })
+        return {
+            "http2": self.http2,
+            "limits": {
+                "max_connections": self.limits.max_connections,
+                "max_keepalive_connections": self.limits.max_keepalive_connections,
+                "keepalive_expiry": self.limits.keepalive_expiry,
+            },
+            "transports": transports,
+            "closed": self.closed,
+        }
+
+
+transport_registry = TransportRegistry()
@@ -0,0 +1,292 @@
+# Keep Ollama models loaded so the first chat after idle does not pay for a model load
+# Preload configured models at startup or when a service is added, pin them with keep_alive
+# Optionally re-warm on a schedule and track warm/cold state for the models API
+
+import asyncio
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+KeepAlive = Union[str, int, float]
+
+_DURATION = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*(ms|s|m|h)?\s*$")
+_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, None: 1}
+
+
+def keep_alive_seconds(keep_alive: Optional[KeepAlive]) -> Optional[float]:
+    """Seconds a keep_alive value pins a model for; None means forever or unknown"""
+    if keep_alive is None:
+        return None
+    match = _DURATION.match(str(keep_alive))
+    if not match:
+        return None
+    seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    return None if seconds < 0 else seconds
+
+
+class WarmState:
+    """Load state of one model on one service"""
+
+    def __init__(self, service_id: str, model: str):
+        self.service_id = service_id
+        self.model = model
+        self.state = "cold"  # cold, warming, warm or failed
+        self.loaded_at: Optional[float] = None
+        self.expires_at: Optional[float] = None  # None while warm means pinned indefinitely
+        self.load_ms: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def mark_warm(self, keep_alive: Optional[KeepAlive], expires_at: Optional[float] = None):
+        now = time.time()
+        self.state = "warm"
+        self.loaded_at = self.loaded_at if self.loaded_at else now
+        self.error = None
+        if expires_at is None:
+            seconds = keep_alive_seconds(keep_alive)
+            expires_at = now + seconds if seconds is not None else None
+        self.expires_at = expires_at
+
+    def refresh(self):
+        """Expire the warm state once the keep-alive has run out"""
+        if self.state == "warm" and self.expires_at is not None and time.time() >= self.expires_at:
+            self.state = "cold"
+            self.loaded_at = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        self.refresh()
+        return {
+            "state": self.state,
+            "loaded_at": self.loaded_at,
+            "expires_at": self.expires_at,
+            "load_ms": self.load_ms,
+            "error": self.error,
+        }
+
+
+class _ServiceWarmup:
+    def __init__(
+        self,
+        service: Any,
+        models: List[str],
+        preload: List[str],
+        keep_alive: Any,
+        default_keep_alive: KeepAlive,
+        rewarm_interval: float,
+    ):
+        self.service = service
+        self.models = models
+        self.preload = preload
+        self.keep_alive = keep_alive  # a single value or a dict keyed by model
+        self.default_keep_alive = default_keep_alive
+        self.rewarm_interval = rewarm_interval
+        self.last_rewarm = 0.0
+
+    def resolve(self, model: str) -> str:
+        """Map a requested name such as llama3.2 to the configured llama3.2:latest"""
+        if model in self.models:
+            return model
+        return next((name for name in self.models if name.split(":")[0] == model), model)
+
+    def keep_alive_for(self, model: str) -> Optional[KeepAlive]:
+        if isinstance(self.keep_alive, dict):
+            return self.keep_alive.get(model, self.keep_alive.get(model.split(":")[0], self.default_keep_alive))
+        return self.default_keep_alive if self.keep_alive is None else self.keep_alive
+
+
+class WarmupManager:
+    """Preload, keep-alive and re-warm scheduling for Ollama services"""
+
+    def __init__(self):
+        self.default_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.default_preload = os.getenv("OLLAMA_PRELOAD", "default").lower()  # default, all or none
+        self.default_rewarm_interval = float(os.getenv("OLLAMA_REWARM_INTERVAL", "0"))
+        self.tick = float(os.getenv("OLLAMA_WARMUP_TICK", "15"))
+
+        self._services: Dict[str, _ServiceWarmup] = {}
+        self._states: Dict[Tuple[str, str], WarmState] = {}
+        self._warming: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+        self._running = False
+
+    def configure(self, service_id: str, service: Any, config: Dict[str, Any], default_model: Optional[str] = None):
+        """Register or update an Ollama service; preloads right away when already running"""
+        models = list(config.get("models", []))
+        preload = config.get("preload", self.default_preload)
+        if preload is True or preload == "all":
+            preload_models = models
+        elif isinstance(preload, list):
+            preload_models = [model for model in preload if model in models]
+        elif preload == "default":
+            preload_models = [
+                model for model in models
+                if default_model and (model == default_model or model.split(":")[0] == default_model)
+            ]
+        else:
+            preload_models = []
+
+        previous = self._services.get(service_id)
+        self._services[service_id] = _ServiceWarmup(
+            service,
+            models,
+            preload_models,
+            config.get("keep_alive"),
+            self.default_keep_alive,
+            float(config.get("rewarm_interval", self.default_rewarm_interval) or 0),
+        )
+
+        for key in list(self._states):
+            if key[0] == service_id and key[1] not in models:
+                del self._states[key]
+        if previous is not None and previous.service is not service:
+            # A new client may point at a different server; nothing is known to be loaded there
+            for key, state in self._states.items():
+                if key[0] == service_id:
+                    state.state, state.loaded_at, state.expires_at = "cold", None, None
+        for model in models:
+            self._states.setdefault((service_id, model), WarmState(service_id, model))
+
+        if self._running:
+            self.preload(service_id)
+
+    def remove(self, service_id: str):
+        self._services.pop(service_id, None)
+        for key in list(self._states):
+            if key[0] == service_id:
+                del self._states[key]
+        for key in list(self._warming):
+            if key[0] == service_id:
+                self._warming.pop(key).cancel()
+
+    def keep_alive_for(self, service_id: str, model: str) -> Optional[KeepAlive]:
+        """keep_alive to send with a request, or None for services not managed here"""
+        settings = self._services.get(service_id)
+        return settings.keep_alive_for(model) if settings else None
+
+    def touch(self, service_id: str, model: str):
+        """A request just ran on the model, so it is loaded with a fresh keep-alive"""
+        settings = self._services.get(service_id)
+        if settings is None:
+            return
+        model = settings.resolve(model)
+        state = self._states.setdefault((service_id, model), WarmState(service_id, model))
+        state.mark_warm(settings.keep_alive_for(model))
+
+    def is_warm(self, service_id: str, model: str) -> bool:
+        state = self._states.get((service_id, model))
+        if state is None:
+            return False
+        state.refresh()
+        return state.state == "warm"
+
+    def preload(self, service_id: str, models: Optional[List[str]] = None):
+        """Start loading models in the background; models already loading are skipped"""
+        settings = self._services.get(service_id)
+        if settings is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Picked up by start() once the loop is running
+
+        for model in models if models is not None else settings.preload:
+            key = (service_id, model)
+            if key in self._warming:
+                continue
+            task = loop.create_task(self.warm(service_id, model))
+            self._warming[key] = task
+            task.add_done_callback(lambda _, key=key: self._warming.pop(key, None))
+
+    async def warm(self, service_id: str, model: str) -> Dict[str, Any]:
+        """Load a model now and pin it with its keep_alive"""
+        settings = self._services.get(service_id)
+        if settings is None:
+            return {"success": False, "error": f"Service '{service_id}' is not an Ollama service"}
+
+        state = self._states.setdefault((service_id, model), WarmState(service_id, model))
+        keep_alive = settings.keep_alive_for(model)
+        state.state = "warming"
+        started = time.perf_counter()
+        try:
+            await settings.service.warm(model, keep_alive)
+        except asyncio.CancelledError:
+            state.state = "cold"
+            raise
+        except Exception as e:
+            state.state = "failed"
+            state.error = str(e)
+            print(f"Error warming model {model} on service {service_id}: {e}")
+            return {"success": False, "error": str(e)}
+
+        state.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        state.loaded_at = None  # Count from this load
+        state.mark_warm(keep_alive)
+        return {"success": True, "load_ms": state.load_ms}
+
+    async def sync(self, service_id: str):
+        """Update warm/cold state from the models the server reports as loaded"""
+        settings = self._services.get(service_id)
+        if settings is None:
+            return
+        try:
+            loaded = await settings.service.loaded_models()
+        except Exception as e:
+            print(f"Error listing loaded models on service {service_id}: {e}")
+            return
+
+        for model in settings.models:
+            state = self._states.setdefault((service_id, model), WarmState(service_id, model))
+            if state.state == "warming":
+                continue
+            name = model if ":" in model else f"{model}:latest"
+            loaded_name = model if model in loaded else name
+            if loaded_name not in loaded:
+                state.state, state.loaded_at, state.expires_at = "cold", None, None
+            else:
+                state.mark_warm(settings.keep_alive_for(model), expires_at=loaded[loaded_name])
+
+    def snapshot(self, service_id: str) -> Dict[str, Dict[str, Any]]:
+        """Warm state of every configured model on a service"""
+        return {
+            model: state.to_dict()
+            for (state_service, model), state in self._states.items()
+            if state_service == service_id
+        }
+
+    async def start(self):
+        """Preload every service and start the re-warm loop"""
+        if self._running:
+            return
+        self._running = True
+        for service_id in self._services:
+            self.preload(service_id)
+        self._loop_task = asyncio.get_running_loop().create_task(self._rewarm_loop())
+
+    async def stop(self):
+        self._running = False
+        tasks = list(self._warming.values())
+        if self._loop_task is not None:
+            tasks.append(self._loop_task)
+            self._loop_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _rewarm_loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            for service_id, settings in list(self._services.items()):
+                if settings.rewarm_interval <= 0 or now - settings.last_rewarm < settings.rewarm_interval:
+                    continue
+                settings.last_rewarm = now
+                await self.sync(service_id)
+                # Reload models that were unloaded or will be before the next round
+                horizon = time.time() + settings.rewarm_interval + self.tick
+                stale = [
+                    model for model in settings.preload
+                    if not self.is_warm(service_id, model)
+                    or (self._states[(service_id, model)].expires_at or horizon) < horizon
+                ]
+                if stale:
+                    self.preload(service_id, stale)
@@ -4,12 +4,17 @@ HyperHint Backend Server
 A FastAPI-based server providing real-time file and action suggestions
 """
 
-import uvicorn
+from hyperhint._startup import startup_timer
 
-from hyperhint.server import create_app
+with startup_timer.phase("import uvicorn", "import"):
+    import uvicorn
+
+with startup_timer.phase("import hyperhint.server", "import"):
+    from hyperhint.server import create_app
 
 # Create the FastAPI app
-app = create_app()
+with startup_timer.phase("create_app"):
+    app = create_app()
 
 @app.get("/")
 async def root():
@@ -25,7 +30,8 @@ async def root():
             "websocket_suggestions": "/ws/suggestions",
             "chat_stream": "/api/chat/stream",
             "chat_stop": "/api/chat/stop",
-            "chat_status": "/api/chat/status"
+            "chat_status": "/api/chat/status",
+            "startup": "/api/startup"
         }
     }
 
@@ -1,10 +1,12 @@
+from hyperhint._startup import Lazy
+
 from ._actions import ActionHandler
 from ._knowledge_files import KnowledgeFileHandler
 from ._types import Action, Memory, Suggestion
 
-# Create global instances
-knowledge_file_handler = KnowledgeFileHandler()
-action_handler = ActionHandler()
+# Global instances, built by the app lifespan or on first use
+knowledge_file_handler: KnowledgeFileHandler = Lazy("knowledge_file_handler", KnowledgeFileHandler)
+action_handler: ActionHandler = Lazy("action_handler", ActionHandler)
 
 __all__ = [
     "Memory",
@@ -52,7 +52,7 @@ class ActionHandler:
 
         return suggestions[:10]  # Limit to 10 suggestions
 
-    def execute_action(self, action_id: str, user_input: str = "", **kwargs) -> dict:
+    async def execute_action(self, action_id: str, user_input: str = "", **kwargs) -> dict:
         """Execute an action and return result"""
         action = self.get_action(action_id)
         if not action:
@@ -60,13 +60,13 @@ class ActionHandler:
 
         try:
             if action_id == "add_knowledge":
-                import asyncio
                 import re
                 from hyperhint.memory import knowledge_file_handler
-                from hyperhint.llm import llm_manager
+                from hyperhint.llm import first_answer_line, llm_manager
 
                 attachments = kwargs.get("attachments", [])
                 knowledge_filename = kwargs.get("knowledge_filename")
+                deadline = kwargs.get("deadline")  # shared by every LLM call below
 
                 # Check if we have actual file attachments with content
                 file_attachments = (
@@ -121,16 +121,21 @@ Requirements:
 
 Return ONLY the filename, nothing else."""
 
-                    # Get filename from LLM
+                    # Get filename from LLM - a few tokens, bounded by a deadline
                     messages = [{"role": "user", "content": filename_prompt}]
-                    filename_content = ""
-
-                    async for chunk in llm_manager.stream_chat(messages):
-                        if chunk.get("type") == "content":
-                            filename_content += chunk.get("content", "")
+                    result = await llm_manager.complete(
+                        messages,
+                        max_tokens=llm_manager.filename_max_tokens,
+                        timeout=llm_manager.filename_timeout,
+                        cache=True,
+                        priority="filename",
+                        task="filename",
+                        deadline=deadline,
+                    )
+                    filename_content = result.get("content", "") if result.get("success") else ""
 
                     # Clean and validate the generated filename
-                    filename = filename_content.strip().lower()
+                    filename = first_answer_line(filename_content).lower().replace(" ", "_")
                     # Remove any invalid characters and ensure it's a valid filename
                     filename = re.sub(r"[^a-z0-9_]", "", filename)
 
@@ -161,7 +166,7 @@ Return ONLY the filename, nothing else."""
                 else:
                     # Run async filename generation if no filename is provided
                     try:
-                        filename_base = asyncio.run(generate_filename())
+                        filename_base = await generate_filename()
                         filename = f"{filename_base}.txt"
                     except Exception as e:
                         print(f"Error generating filename with LLM: {e}")
@@ -204,11 +209,27 @@ Return ONLY the filename, nothing else."""
                             "status": "error",
                         }
 
+                    def unanalyzed(i, att):
+                        """Entry for a file saved without an LLM analysis"""
+                        return {
+                            "name": att.get("name", f"file_{i + 1}"),
+                            "size_kb": len(att.get("content", "").encode("utf-8"))
+                            / 1024,
+                            "analysis": f"File: {att.get('name', 'unknown')}",
+                            "content": att.get("content", ""),
+                        }
+
                     # Process each file individually with LLM analysis
                     async def analyze_files():
                         file_analyses = []
 
                         for i, att in enumerate(file_attachments):
+                            if deadline is not None and deadline.expired:
+                                print(
+                                    f"{deadline.message()}, saving {len(file_analyses)} of "
+                                    f"{len(file_attachments)} files with an analysis"
+                                )
+                                break
                             file_name = att.get("name", f"file_{i + 1}")
                             file_content = att.get("content", "")
                             file_size_kb = len(file_content.encode("utf-8")) / 1024
@@ -238,7 +259,9 @@ Format your response in clean markdown. Be thorough but concise."""
                             messages = [{"role": "user", "content": analysis_prompt}]
                             analysis_result = ""
 
-                            async for chunk in llm_manager.stream_chat(messages):
+                            async for chunk in llm_manager.stream_chat(
+                                messages, cache=True, priority="background", task="analysis", deadline=deadline
+                            ):
                                 if chunk.get("type") == "content":
                                     analysis_result += chunk.get("content", "")
 
@@ -253,23 +276,19 @@ Format your response in clean markdown. Be thorough but concise."""
                                 }
                             )
 
+                        # Files the deadline cut off are saved without an analysis
+                        for i in range(len(file_analyses), len(file_attachments)):
+                            file_analyses.append(unanalyzed(i, file_attachments[i]))
                         return file_analyses
 
                     # Run async file analysis
                     try:
-                        file_analyses = asyncio.run(analyze_files())
+                        file_analyses = await analyze_files()
                     except Exception as e:
                         print(f"Error analyzing files with LLM: {e}")
                         # Fallback to simple processing
                         file_analyses = [
-                            {
-                                "name": att.get("name", f"file_{i + 1}"),
-                                "size_kb": len(att.get("content", "").encode("utf-8"))
-                                / 1024,
-                                "analysis": f"File: {att.get('name', 'unknown')}",
-                                "content": att.get("content", ""),
-                            }
-                            for i, att in enumerate(file_attachments)
+                            unanalyzed(i, att) for i, att in enumerate(file_attachments)
                         ]
 
                     # Combine everything into structured content
@@ -337,7 +356,9 @@ Format the output in markdown for better readability. Keep it comprehensive but
                             messages = [{"role": "user", "content": summary_prompt}]
                             summarized_content = ""
 
-                            async for chunk in llm_manager.stream_chat(messages):
+                            async for chunk in llm_manager.stream_chat(
+                                messages, priority="background", task="summary", deadline=deadline
+                            ):
                                 if chunk.get("type") == "content":
                                     summarized_content += chunk.get("content", "")
 
@@ -350,7 +371,7 @@ Format the output in markdown for better readability. Keep it comprehensive but
 
                     # Run async summarization
                     try:
-                        content_to_save = asyncio.run(summarize_content())
+                        content_to_save = await summarize_content()
                     except Exception as e:
                         print(f"Error summarizing content with LLM: {e}")
                         content_to_save = original_text
@@ -0,0 +1,71 @@
+# Persist the knowledge catalog so a restart or a new worker does not rebuild it from scratch
+# The snapshot holds the Memory items, the name index and the full-text index, pickled into one file
+# It is only trusted for the same directory and format, and is brought up to date with a stat pass
+
+import os
+import pickle
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+SNAPSHOT_VERSION = 2
+DEFAULT_CATALOG_PATH = Path(__file__).parent.parent.parent / "data" / "cache" / "knowledge_catalog.pickle"
+
+
+class CatalogSnapshot:
+    """Binary snapshot of a KnowledgeFileHandler's items and indexes"""
+
+    def __init__(self, data_path: Path, max_depth: int, path: Optional[str] = None):
+        self.enabled = os.getenv("KNOWLEDGE_CATALOG_ENABLED", "True").lower() == "true"
+        self.path = Path(path or os.getenv("KNOWLEDGE_CATALOG_PATH", "") or DEFAULT_CATALOG_PATH)
+        self.data_path = str(data_path)
+        self.max_depth = max_depth
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """The saved state, or None when there is none that matches this catalog"""
+        if not self.enabled or not self.path.exists():
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"Ignoring knowledge catalog snapshot {self.path}: {e}")
+            return None
+
+        if (
+            not isinstance(state, dict)
+            or state.get("version") != SNAPSHOT_VERSION
+            or state.get("data_path") != self.data_path
+            or state.get("max_depth") != self.max_depth
+        ):
+            return None
+        return state
+
+    def save(self, memory: List[Any], index: Any, content_index: Any) -> bool:
+        """Write the snapshot to a temp file and rename it into place"""
+        if not self.enabled:
+            return False
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "data_path": self.data_path,
+            "max_depth": self.max_depth,
+            "memory": memory,
+            "index": index,
+            "content_index": content_index,
+        }
+        tmp_path = None
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            return True
+        except Exception as e:
+            print(f"Error saving knowledge catalog snapshot: {e}")
+            if tmp_path is not None:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            return False
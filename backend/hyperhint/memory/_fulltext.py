@@ -0,0 +1,241 @@
+# Full-text search over the contents of text knowledge files
+# An inverted index maps each term to the documents it occurs in and how often, ranked with BM25
+# A background task (re)indexes files as the catalog changes; snippets are cut at query time
+
+import asyncio
+import heapq
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN = re.compile(r"[^\W_]+")
+MAX_TERM_LENGTH = 64
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased words; underscores split words so identifiers in code are searchable"""
+    return [term for term in TOKEN.findall(text.lower()) if len(term) <= MAX_TERM_LENGTH]
+
+
+def snippet(text: str, terms: Set[str], width: int = 200) -> Tuple[str, List[Dict[str, int]]]:
+    """Excerpt around the densest cluster of query terms, with highlight offsets into it"""
+    hits = []
+    for match in TOKEN.finditer(text):
+        if match.group().lower() in terms:
+            hits.append((match.start(), match.end(), match.group().lower()))
+            if len(hits) >= 1000:
+                break
+    if not hits:
+        return " ".join(text[:width].split()), []
+
+    # Start at the hit with the most distinct terms within `width` characters after it
+    best, best_terms = 0, 0
+    end = 0
+    for first, (start, _, _) in enumerate(hits):
+        end = max(end, first)
+        while end + 1 < len(hits) and hits[end + 1][1] <= start + width:
+            end += 1
+        distinct = len({term for _, _, term in hits[first:end + 1]})
+        if distinct > best_terms:
+            best, best_terms = first, distinct
+
+    window_start = max(hits[best][0] - width // 5, 0)
+    space = text.rfind(" ", 0, window_start + 1)
+    if window_start and space > window_start - 20:
+        window_start = space + 1
+    window_end = min(window_start + width, len(text))
+
+    prefix = "…" if window_start > 0 else ""
+    suffix = "…" if window_end < len(text) else ""
+    # Same-length whitespace replacement keeps the offsets valid
+    body = re.sub(r"\s", " ", text[window_start:window_end])
+    highlights = [
+        {"start": start - window_start + len(prefix), "end": stop - window_start + len(prefix)}
+        for start, stop, _ in hits
+        if start >= window_start and stop <= window_end
+    ]
+    return prefix + body + suffix, highlights
+
+
+class FullTextIndex:
+    """Inverted index with BM25 scoring, keyed by document path"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {document: term frequency}
+        self._docs: Dict[str, Tuple[int, Optional[int], Tuple[str, ...]]] = {}  # document -> (length, mtime_ns, terms)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def keys(self) -> List[str]:
+        return list(self._docs)
+
+    def version(self, key: str) -> Optional[int]:
+        """mtime_ns of the indexed copy of a document, or None when it is not indexed"""
+        doc = self._docs.get(key)
+        return doc[1] if doc else None
+
+    def add(self, key: str, counts: Dict[str, int], length: int, mtime_ns: Optional[int]):
+        self.remove(key)
+        self._docs[key] = (length, mtime_ns, tuple(counts))
+        self._total_length += length
+        for term, frequency in counts.items():
+            self._postings.setdefault(term, {})[key] = frequency
+
+    def remove(self, key: str):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        self._total_length -= doc[0]
+        for term in doc[2]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[str, float]]:
+        """Top `limit` (document, score) pairs for the query terms"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        count = len(self._docs)
+        if not terms or not count:
+            return []
+        average_length = self._total_length / count or 1.0
+
+        scores: Dict[str, float] = {}
+        docs = self._docs
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for key, frequency in postings.items():
+                norm = K1 * (1 - B + B * docs[key][0] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (K1 + 1) / (frequency + norm)
+
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+
+class ContentIndexer:
+    """Keep a FullTextIndex in step with the text files of a KnowledgeFileHandler"""
+
+    def __init__(self, handler: Any, index: Optional[FullTextIndex] = None):
+        self.handler = handler
+        self.index = index or FullTextIndex()
+        self.enabled = os.getenv("KNOWLEDGE_FULLTEXT_ENABLED", "True").lower() == "true"
+        self.max_bytes = int(os.getenv("KNOWLEDGE_FULLTEXT_MAX_FILE_BYTES", str(1024 * 1024)))
+        self.snippet_chars = int(os.getenv("KNOWLEDGE_FULLTEXT_SNIPPET_CHARS", "200"))
+        self.batch_size = 32
+        self._pending: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def mark(self, item: Any):
+        """Queue a cataloged file for (re)indexing"""
+        if not self.enabled or not self.handler.is_text_file(item):
+            return
+        self._pending.add(item.metadata["absolute_path"])
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def forget(self, item: Any):
+        path = item.metadata.get("absolute_path")
+        if path:
+            self._pending.discard(path)
+            self.index.remove(path)
+
+    async def start(self):
+        """Index whatever changed since the snapshot, then follow the catalog"""
+        if not self.enabled or self._task is not None:
+            return
+        for key in self.index.keys():
+            if self.handler.find_by_path(key) is None:
+                self.index.remove(key)
+        for item in self.handler.memory:
+            if self.handler.is_text_file(item) and self.index.version(item.metadata["absolute_path"]) != item.metadata.get("mtime_ns"):
+                self._pending.add(item.metadata["absolute_path"])
+
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wakeup = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                batch = [self._pending.pop() for _ in range(min(self.batch_size, len(self._pending)))]
+                try:
+                    documents = await asyncio.to_thread(self._read_batch, batch)
+                except Exception as e:
+                    print(f"Error indexing knowledge file contents: {e}")
+                    continue
+                # Apply on the loop, where searches read the index
+                for path, document in documents.items():
+                    if document is None or self.handler.find_by_path(path) is None:
+                        self.index.remove(path)
+                    else:
+                        self.index.add(path, *document)
+                self.handler.mark_catalog_dirty()
+
+    def _read(self, path: str) -> Optional[str]:
+        # Cap in bytes, not decoded characters; a character cut at the limit decodes as U+FFFD
+        try:
+            with open(path, "rb") as f:
+                return f.read(self.max_bytes).decode("utf-8", errors="replace")
+        except OSError:
+            return None
+
+    def _read_batch(self, paths: Iterable[str]) -> Dict[str, Optional[Tuple[Dict[str, int], int, int]]]:
+        documents: Dict[str, Optional[Tuple[Dict[str, int], int, int]]] = {}
+        for path in paths:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                documents[path] = None
+                continue
+            text = self._read(path)
+            if text is None:
+                documents[path] = None
+                continue
+            terms = tokenize(text)
+            documents[path] = (dict(Counter(terms)), len(terms), mtime_ns)
+        return documents
+
+    async def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Ranked matches with a snippet and highlight offsets for each"""
+        ranked = self.index.search(query, limit)
+        terms = set(tokenize(query))
+        snippets = await asyncio.to_thread(
+            lambda: [snippet(self._read(path) or "", terms, self.snippet_chars) for path, _ in ranked]
+        )
+
+        results = []
+        for (path, score), (text, highlights) in zip(ranked, snippets):
+            item = self.handler.find_by_path(path)
+            if item is None:
+                continue
+            results.append({
+                "name": item.name,
+                "path": item.file_path,
+                "score": round(score, 4),
+                "snippet": text,
+                "highlights": highlights,
+            })
+        return results
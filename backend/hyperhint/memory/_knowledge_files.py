@@ -1,18 +1,156 @@
+import bisect
+import os
+from datetime import datetime
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
+from hyperhint.memory._catalog import CatalogSnapshot
+from hyperhint.memory._fulltext import ContentIndexer
+from hyperhint.memory._search_index import NameIndex
+from hyperhint.memory._semantic import SemanticIndexer
 from hyperhint.memory._types import Memory, Suggestion
+from hyperhint.memory._watcher import KnowledgeWatcher, PathState
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".svg"}
+# Files read as text (avoid reading binary files)
+TEXT_EXTENSIONS = {
+    ".txt",
+    ".md",
+    ".py",
+    ".js",
+    ".ts",
+    ".json",
+    ".yaml",
+    ".yml",
+    ".xml",
+    ".html",
+    ".css",
+    ".sql",
+    ".sh",
+    ".bat",
+    ".cfg",
+    ".ini",
+    ".log",
+    ".csv",
+    ".tsv",
+    ".rst",
+    ".tex",
+}
 
 
 class KnowledgeFileHandler:
     """Knowledge files that can be used by the agent"""
 
+    max_depth = 2  # Levels below data_path that are cataloged
+
     def __init__(self):
         self.memory: List[Memory] = []
+        self.index = NameIndex()
+        # Lookup tables kept in step with self.memory
+        self._by_path: Dict[str, Memory] = {}
+        self._by_absolute_path: Dict[str, Memory] = {}
+        self._by_name: Dict[str, List[Memory]] = {}  # sorted by _name_rank, first one wins
         self.data_path = (
             Path(__file__).parent.parent.parent / "data" / "memory" / "knowledge_files"
         )
-        self._load_from_directory()
+        # Started by the app lifespan; applies directory changes without rescanning
+        self.watcher = KnowledgeWatcher(self)
+        self.catalog = CatalogSnapshot(self.data_path, self.max_depth)
+        self._catalog_dirty = False
+        # Full-text index over text files, filled in the background once the app runs
+        self.content = ContentIndexer(self)
+        # Chunk embeddings for retrieval, filled in the background once an embedding model is set
+        self.semantic = SemanticIndexer(self)
+
+        if not self._load_snapshot():
+            self._load_from_directory()
+            self._index_memory()
+            if self.data_path.exists():
+                self.save_catalog()
+
+    def _load_snapshot(self) -> bool:
+        """Restore the catalog from the last snapshot and catch up with a stat pass"""
+        if not self.data_path.is_dir():
+            return False
+        state = self.catalog.load()
+        if state is None:
+            return False
+
+        self.memory, self.index = state["memory"], state["index"]
+        self.content.index = state["content_index"]
+        self._rebuild_tables()
+        counts = self.watcher.reconcile()
+        print(
+            f"Loaded {len(self.memory)} items from the knowledge catalog snapshot "
+            f"({counts['added']} added, {counts['updated']} updated, {counts['removed']} removed since)"
+        )
+        if self._catalog_dirty:
+            self.save_catalog()
+        return True
+
+    def save_catalog(self):
+        """Snapshot the catalog so the next start can skip the full scan"""
+        if self.catalog.save(self.memory, self.index, self.content.index):
+            self._catalog_dirty = False
+
+    def mark_catalog_dirty(self):
+        """Have the next save_catalog_if_changed() write the snapshot, e.g. after the content index changed"""
+        self._catalog_dirty = True
+
+    def save_catalog_if_changed(self):
+        if self._catalog_dirty and self.data_path.is_dir():
+            self.save_catalog()
+
+    def _index_memory(self):
+        """Bring the search index and lookup tables in line with self.memory in one batch"""
+        self.index.add_many((self._key(item), item.name, item) for item in self.memory)
+        self._rebuild_tables()
+        self._catalog_dirty = True
+
+    def _rebuild_tables(self):
+        self._by_path, self._by_absolute_path, self._by_name = {}, {}, {}
+        for item in self.memory:
+            self._by_path[self._key(item)] = item
+            if item.metadata.get("absolute_path"):
+                self._by_absolute_path[item.metadata["absolute_path"]] = item
+            self._by_name.setdefault(item.name, []).append(item)
+        for items in self._by_name.values():
+            items.sort(key=self._name_rank)
+
+    @staticmethod
+    def _name_rank(item: Memory) -> Tuple[bool, int, str]:
+        """Order for items sharing a name: files before folders, then shallowest, then by path"""
+        path = item.file_path or item.folder_path
+        return item.type == "folder", path.count("/"), path
+
+    def _link(self, item: Memory):
+        self._catalog_dirty = True
+        self._by_path[self._key(item)] = item
+        if item.metadata.get("absolute_path"):
+            self._by_absolute_path[item.metadata["absolute_path"]] = item
+        bisect.insort(self._by_name.setdefault(item.name, []), item, key=self._name_rank)
+        self.index.add(self._key(item), item.name, item)
+        self.content.mark(item)
+        self.semantic.mark(item)
+
+    def _unlink(self, item: Memory):
+        self._catalog_dirty = True
+        key = self._key(item)
+        if self._by_path.get(key) is item:
+            del self._by_path[key]
+            self.index.remove(key)
+        absolute_path = item.metadata.get("absolute_path")
+        if absolute_path and self._by_absolute_path.get(absolute_path) is item:
+            del self._by_absolute_path[absolute_path]
+            self.content.forget(item)
+            self.semantic.forget(item)
+        same_name = self._by_name.get(item.name, [])
+        for position, other in enumerate(same_name):
+            if other is item:
+                del same_name[position]
+                break
+        if not same_name:
+            self._by_name.pop(item.name, None)
 
     def _load_from_directory(self):
         """Load files from the knowledge_files directory"""
@@ -35,63 +173,108 @@ class KnowledgeFileHandler:
             return
 
         try:
-            for item in path.iterdir():
-                if item.name.startswith("."):
-                    continue
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+
+                    if entry.is_file():
+                        stat = entry.stat()
+                        self.memory.append(
+                            self._make_item(Path(entry.path), False, stat.st_size, stat.st_mtime_ns)
+                        )
 
-                if item.is_file():
-                    # Determine file type
-                    file_type = (
-                        "image"
-                        if item.suffix.lower()
-                        in [".png", ".jpg", ".jpeg", ".gif", ".bmp", ".svg"]
-                        else "file"
-                    )
-
-                    memory_item = Memory(
-                        type=file_type,
-                        name=item.name,
-                        file_path=str(
-                            item.relative_to(self.data_path.parent.parent.parent)
-                        ),
-                        size=item.stat().st_size if item.exists() else None,
-                        metadata={
-                            "extension": item.suffix,
-                            "parent_dir": str(
-                                item.parent.relative_to(
-                                    self.data_path.parent.parent.parent
-                                )
-                            ),
-                            "is_hidden": item.name.startswith("."),
-                            "absolute_path": str(item),
-                        },
-                    )
-                    self.memory.append(memory_item)
-
-                elif item.is_dir():
-                    memory_item = Memory(
-                        type="folder",
-                        name=item.name,
-                        folder_path=str(
-                            item.relative_to(self.data_path.parent.parent.parent)
-                        ),
-                        metadata={
-                            "parent_dir": str(
-                                item.parent.relative_to(
-                                    self.data_path.parent.parent.parent
-                                )
-                            ),
-                            "is_hidden": item.name.startswith("."),
-                            "absolute_path": str(item),
-                        },
-                    )
-                    self.memory.append(memory_item)
-                    # Recursively scan subdirectories
-                    self._scan_directory(item, max_depth, current_depth + 1)
+                    elif entry.is_dir():
+                        self.memory.append(self._make_item(Path(entry.path), True))
+                        # Recursively scan subdirectories
+                        self._scan_directory(Path(entry.path), max_depth, current_depth + 1)
 
         except PermissionError:
             pass  # Skip directories we can't access
 
+    def _make_item(
+        self, path: Path, is_dir: bool, size: Optional[int] = None, mtime_ns: Optional[int] = None
+    ) -> Memory:
+        """Catalog entry for a file or folder below data_path"""
+        root = self.data_path.parent.parent.parent
+        metadata = {
+            "parent_dir": str(path.parent.relative_to(root)),
+            "is_hidden": path.name.startswith("."),
+            "absolute_path": str(path),
+        }
+        if is_dir:
+            return Memory(type="folder", name=path.name, folder_path=str(path.relative_to(root)), metadata=metadata)
+
+        return Memory(
+            type="image" if path.suffix.lower() in IMAGE_EXTENSIONS else "file",
+            name=path.name,
+            file_path=str(path.relative_to(root)),
+            size=size,
+            metadata={"extension": path.suffix, **metadata, "mtime_ns": mtime_ns},
+        )
+
+    def in_catalog(self, path: Path) -> bool:
+        """Whether a path below data_path is one the scan would pick up"""
+        try:
+            parts = path.relative_to(self.data_path).parts
+        except ValueError:
+            return False
+        return 0 < len(parts) <= self.max_depth and not any(part.startswith(".") for part in parts)
+
+    def catalog_state(self) -> Dict[str, PathState]:
+        """(is_dir, size, mtime_ns) of every cataloged path, keyed by absolute path"""
+        return {
+            path: (item.type == "folder", item.size, item.metadata.get("mtime_ns"))
+            for path, item in self._by_absolute_path.items()
+        }
+
+    def apply_changes(self, changes: Dict[str, Optional[PathState]]) -> Dict[str, int]:
+        """Apply the current state of changed paths; None means the path is gone"""
+        counts = {"added": 0, "updated": 0, "removed": 0}
+        removed = set()
+
+        def drop(item: Memory):
+            self._unlink(item)
+            removed.add(id(item))
+            counts["removed"] += 1
+
+        for path in sorted(changes):  # Parents before their children
+            state = changes[path]
+            existing = self._by_absolute_path.get(path)
+            if state is None or not self.in_catalog(Path(path)):
+                if existing is None:
+                    continue
+                if existing.type == "folder":
+                    prefix = path + os.sep
+                    for key, item in list(self._by_absolute_path.items()):
+                        if key.startswith(prefix):
+                            drop(item)
+                drop(existing)
+                continue
+
+            is_dir, size, mtime_ns = state
+            if existing is not None and (existing.type == "folder") == is_dir:
+                if not is_dir and (existing.size, existing.metadata.get("mtime_ns")) != (size, mtime_ns):
+                    existing.size = size
+                    existing.metadata["mtime_ns"] = mtime_ns
+                    existing.updated_at = datetime.now()
+                    self._catalog_dirty = True
+                    self.content.mark(existing)
+                    self.semantic.mark(existing)
+                    counts["updated"] += 1
+                continue
+
+            if existing is not None:
+                drop(existing)  # A file became a folder or the other way around
+            item = self._make_item(Path(path), is_dir, size, mtime_ns)
+            self.memory.append(item)
+            self._link(item)
+            counts["added"] += 1
+
+        if removed:
+            self.memory = [item for item in self.memory if id(item) not in removed]
+        return counts
+
     def _load_fallback_data(self):
         """Load fallback mock data if directory scanning fails"""
         mock_items = [
@@ -141,25 +324,8 @@ class KnowledgeFileHandler:
                 f.write(content)
 
             # Add to memory
-            memory_item = Memory(
-                type="file",
-                name=filename,
-                file_path=str(
-                    file_path.relative_to(self.data_path.parent.parent.parent)
-                ),
-                size=len(content.encode("utf-8")),
-                metadata={
-                    "extension": file_path.suffix,
-                    "parent_dir": str(
-                        file_path.parent.relative_to(
-                            self.data_path.parent.parent.parent
-                        )
-                    ),
-                    "is_hidden": filename.startswith("."),
-                    "absolute_path": str(file_path),
-                },
-            )
-            self.memory.append(memory_item)
+            stat = file_path.stat()
+            self.add(self._make_item(file_path, False, stat.st_size, stat.st_mtime_ns))
 
             print(f"Added knowledge file: {filename}")
             return filename
@@ -168,43 +334,71 @@ class KnowledgeFileHandler:
             print(f"Error adding knowledge file {filename}: {e}")
             return ""
 
-    def search(self, query: str) -> List[Suggestion]:
-        """Search for files/folders matching the query"""
-        query_lower = query.lower()
+    def search(self, query: str, limit: int = 10) -> List[Suggestion]:
+        """Search for files/folders by name, best matches first"""
         suggestions = []
 
-        for item in self.memory:
-            if query_lower in item.name.lower():
-                suggestion = Suggestion(
-                    id=f"file_{len(suggestions)}",
-                    label=item.name,
-                    description=f"{item.type.title()}: {item.file_path or item.folder_path}",
-                    type="file",
-                    metadata={
-                        "type": item.type,
-                        "path": item.file_path or item.folder_path,
-                        "size": item.size,
-                    },
-                )
-                suggestions.append(suggestion)
+        for _, item in self.index.search(query, limit):
+            suggestion = Suggestion(
+                id=f"file_{len(suggestions)}",
+                label=item.name,
+                description=f"{item.type.title()}: {item.file_path or item.folder_path}",
+                type="file",
+                metadata={
+                    "type": item.type,
+                    "path": item.file_path or item.folder_path,
+                    "size": item.size,
+                },
+            )
+            suggestions.append(suggestion)
 
-        return suggestions[:10]  # Limit to 10 suggestions
+        return suggestions
+
+    @staticmethod
+    def is_text_file(item: Memory) -> bool:
+        """A text file on disk; the fallback items have no absolute_path and nothing to index"""
+        return (
+            item.type == "file"
+            and bool(item.metadata.get("absolute_path"))
+            and item.metadata.get("extension", "").lower() in TEXT_EXTENSIONS
+        )
+
+    @staticmethod
+    def _key(item: Memory) -> str:
+        return item.file_path or item.folder_path or item.name
 
     def add(self, item: Memory):
+        """Add an item; one already stored under the same path is replaced"""
+        existing = self._by_path.get(self._key(item))
+        if existing is not None:
+            self.remove(existing)
         self.memory.append(item)
+        self._link(item)
+
+    def remove(self, item: Memory):
+        """Drop an item from memory and every index"""
+        for position, other in enumerate(self.memory):
+            if other is item:
+                del self.memory[position]
+                break
+        self._unlink(item)
 
     def get(self, index: int) -> Memory:
         return self.memory[index]
 
     def find_by_name(self, name: str) -> Optional[Memory]:
-        """Find memory item by name"""
-        for item in self.memory:
-            if item.name == name:
-                return item
-        return None
-
-    def read_file_content(self, file_path: str) -> Optional[str]:
-        """Read content of a file from memory"""
+        """Find memory item by name; with several matches files win over folders, then the shallowest path"""
+        items = self._by_name.get(name)
+        return items[0] if items else None
+
+    def find_by_path(self, path: str) -> Optional[Memory]:
+        """Find memory item by its relative or absolute path"""
+        if path.startswith("./"):
+            path = path[2:]
+        return self._by_path.get(path) or self._by_absolute_path.get(path)
+
+    def read_file_content(self, file_path: str, max_size: Optional[int] = 10000) -> Optional[str]:
+        """Read content of a file from memory; pass max_size=None to read it whole"""
         try:
             # Convert relative path to absolute path
             if file_path.startswith("./"):
@@ -216,39 +410,14 @@ class KnowledgeFileHandler:
                 return None
 
             # Check if it's a text file (avoid reading binary files)
-            text_extensions = {
-                ".txt",
-                ".md",
-                ".py",
-                ".js",
-                ".ts",
-                ".json",
-                ".yaml",
-                ".yml",
-                ".xml",
-                ".html",
-                ".css",
-                ".sql",
-                ".sh",
-                ".bat",
-                ".cfg",
-                ".ini",
-                ".log",
-                ".csv",
-                ".tsv",
-                ".rst",
-                ".tex",
-            }
-
-            if full_path.suffix.lower() not in text_extensions:
+            if full_path.suffix.lower() not in TEXT_EXTENSIONS:
                 return f"[Binary file: {full_path.name}]"
 
             with open(full_path, "r", encoding="utf-8") as f:
                 content = f.read()
 
             # Limit content size to avoid overwhelming the context
-            max_size = 10000  # 10KB limit
-            if len(content) > max_size:
+            if max_size is not None and len(content) > max_size:
                 content = content[:max_size] + "\n[... content truncated ...]"
 
             return content
@@ -276,10 +445,14 @@ class KnowledgeFileHandler:
                 f.write(content)
 
             # Update the memory item's size (optional, but good for consistency)
-            for item in self.memory:
-                if item.file_path == file_path:
-                    item.size = len(content.encode("utf-8"))
-                    break
+            item = self._by_path.get(file_path)
+            if item is not None:
+                stat = full_path.stat()
+                item.size = stat.st_size
+                item.metadata["mtime_ns"] = stat.st_mtime_ns
+                self._catalog_dirty = True
+                self.content.mark(item)
+                self.semantic.mark(item)
 
             print(f"Successfully wrote content to {file_path}")
             return True
@@ -290,11 +463,17 @@ class KnowledgeFileHandler:
     def clear(self):
         """Clear all memory items"""
         self.memory = []
+        self.index.clear()
+        self._by_path, self._by_absolute_path, self._by_name = {}, {}, {}
 
-    def refresh(self):
-        """Refresh the directory scan"""
-        self.clear()
-        self._load_from_directory()
+    def refresh(self) -> Dict[str, int]:
+        """Catch up with the directory in one stat pass; only what changed is re-indexed"""
+        if self.data_path.is_dir() and any(not item.metadata.get("absolute_path") for item in self.memory):
+            # The directory appeared after the fallback data was loaded
+            for item in self.memory:
+                self._unlink(item)
+            self.memory = []
+        return self.watcher.reconcile()
 
     def __str__(self):
         return str(self.memory)
@@ -309,9 +488,12 @@ class KnowledgeFileHandler:
         return self.memory[index]
 
     def __setitem__(self, index: int, value: Memory):
+        self._unlink(self.memory[index])
         self.memory[index] = value
+        self._link(value)
 
     def __delitem__(self, index: int):
+        self._unlink(self.memory[index])
         del self.memory[index]
 
     def __iter__(self):
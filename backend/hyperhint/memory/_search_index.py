@@ -0,0 +1,215 @@
+# Ranked fuzzy name search for autocomplete over large catalogs
+# Sorted lists of names and of name suffixes starting at word boundaries answer prefix queries with bisect
+# Trigram and character postings narrow substring and subsequence candidates before they are verified
+
+import bisect
+import heapq
+import itertools
+import os
+import re
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Match tiers, best first
+EXACT, PREFIX, WORD, SUBSTRING, SUBSEQUENCE = range(5)
+
+
+# A letter or digit after a separator, an upper-case letter after a lower-case one, digits after letters
+_WORD_START = re.compile(r"(?<![^\W_])[^\W_]|(?<=[a-z])[A-Z]|(?<=[^\W\d_])\d")
+
+
+def word_starts(name: str) -> List[int]:
+    """Positions where a word starts: after a separator, at a camelCase hump or where digits begin"""
+    return [match.start() for match in _WORD_START.finditer(name)]
+
+
+def trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def subsequence_pattern(query: str) -> "re.Pattern[str]":
+    """Regex matching `query` as a subsequence with as little in between as possible"""
+    return re.compile("".join(
+        re.escape(char) if position == 0 else f"[^{re.escape(char)}]*{re.escape(char)}"
+        for position, char in enumerate(query)
+    ))
+
+
+class NameIndex:
+    """In-memory name index with incremental add/remove and ranked top-k search"""
+
+    def __init__(self, verify_limit: Optional[int] = None):
+        # Upper bound on candidates checked per fuzzy tier, keeps worst-case latency flat
+        self.verify_limit = verify_limit or int(os.getenv("KNOWLEDGE_SEARCH_VERIFY_LIMIT", "5000"))
+        self._next_id = 0  # a plain int so the index can be pickled into the catalog snapshot
+        self._by_key: Dict[str, int] = {}
+        self._entries: Dict[int, Tuple[str, str, Any]] = {}  # id -> (key, lowered name, value)
+        self._names: List[Tuple[str, int]] = []  # (lowered name, id), sorted
+        self._words: List[Tuple[str, int]] = []  # (lowered name from a later word start, id), sorted
+        self._trigrams: Dict[str, Set[int]] = defaultdict(set)
+        self._chars: Dict[str, Set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._by_key
+
+    def add(self, key: str, name: str, value: Any):
+        """Insert or update an entry; an unchanged name only swaps the value"""
+        lowered = name.lower()
+        entry_id = self._by_key.get(key)
+        if entry_id is not None:
+            if self._entries[entry_id][1] == lowered:
+                self._entries[entry_id] = (key, lowered, value)
+                return
+            self.remove(key)
+
+        entry_id = self._new_id()
+        self._by_key[key] = entry_id
+        self._entries[entry_id] = (key, lowered, value)
+        bisect.insort(self._names, (lowered, entry_id))
+        for start in set(word_starts(name)) - {0}:
+            bisect.insort(self._words, (lowered[start:], entry_id))
+        self._post(lowered, entry_id)
+
+    def add_many(self, entries: Iterable[Tuple[str, str, Any]]):
+        """Add or update (key, name, value) entries; new ones are sorted in with one pass"""
+        added = False
+        for key, name, value in entries:
+            lowered = name.lower()
+            entry_id = self._by_key.get(key)
+            if entry_id is not None:
+                if self._entries[entry_id][1] == lowered:
+                    self._entries[entry_id] = (key, lowered, value)
+                    continue
+                self.remove(key)
+
+            entry_id = self._new_id()
+            self._by_key[key] = entry_id
+            self._entries[entry_id] = (key, lowered, value)
+            self._names.append((lowered, entry_id))
+            self._words.extend((lowered[start:], entry_id) for start in set(word_starts(name)) - {0})
+            self._post(lowered, entry_id)
+            added = True
+
+        if added:
+            self._names.sort()
+            self._words.sort()
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _post(self, lowered: str, entry_id: int):
+        postings = self._trigrams
+        for gram in trigrams(lowered):
+            postings[gram].add(entry_id)
+        postings = self._chars
+        for char in set(lowered):
+            postings[char].add(entry_id)
+
+    def remove(self, key: str):
+        entry_id = self._by_key.pop(key, None)
+        if entry_id is None:
+            return
+        _, lowered, _ = self._entries.pop(entry_id)
+        self._discard_sorted(self._names, (lowered, entry_id))
+        for start in range(1, len(lowered)):
+            self._discard_sorted(self._words, (lowered[start:], entry_id))
+        for gram in trigrams(lowered):
+            self._discard_posting(self._trigrams, gram, entry_id)
+        for char in set(lowered):
+            self._discard_posting(self._chars, char, entry_id)
+
+    def clear(self):
+        self._by_key.clear()
+        self._entries.clear()
+        self._names.clear()
+        self._words.clear()
+        self._trigrams.clear()
+        self._chars.clear()
+
+    @staticmethod
+    def _discard_sorted(items: List[Tuple[str, int]], item: Tuple[str, int]):
+        position = bisect.bisect_left(items, item)
+        if position < len(items) and items[position] == item:
+            del items[position]
+
+    @staticmethod
+    def _discard_posting(postings: Dict[str, Set[int]], token: str, entry_id: int):
+        ids = postings.get(token)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del postings[token]
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[int, Any]]:
+        """Top `limit` (tier, value) pairs: prefix, then word start, substring and subsequence"""
+        query = query.lower()
+        if limit <= 0:
+            return []
+        if not query:
+            return [(PREFIX, entry[2]) for entry in itertools.islice(self._entries.values(), limit)]
+
+        results: List[Tuple[int, Any]] = []
+        seen: Set[int] = set()
+
+        def take(tier: int, entry_ids: Iterable[int]) -> bool:
+            for entry_id in entry_ids:
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    results.append((tier, self._entries[entry_id][2]))
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        # Sorted order puts the exact name first, then longer names alphabetically
+        exact = itertools.takewhile(lambda item: item[0] == query, self._prefix_range(self._names, query))
+        if take(EXACT, (entry_id for _, entry_id in exact)):
+            return results
+        if take(PREFIX, (entry_id for _, entry_id in self._prefix_range(self._names, query))):
+            return results
+        if take(WORD, (entry_id for _, entry_id in self._prefix_range(self._words, query))):
+            return results
+
+        if len(query) >= 3:
+            candidates = self._intersect(self._trigrams, trigrams(query))
+            matches = []
+            for entry_id in itertools.islice(candidates, self.verify_limit):
+                if entry_id in seen:
+                    continue
+                lowered = self._entries[entry_id][1]
+                position = lowered.find(query)
+                if position >= 0:
+                    matches.append((position, len(lowered), lowered, entry_id))
+            if take(SUBSTRING, (match[3] for match in heapq.nsmallest(limit - len(results), matches))):
+                return results
+
+        candidates = self._intersect(self._chars, set(query))
+        pattern = subsequence_pattern(query)
+        spans = []
+        for entry_id in itertools.islice(candidates, self.verify_limit):
+            if entry_id in seen:
+                continue
+            lowered = self._entries[entry_id][1]
+            match = pattern.search(lowered)
+            if match:
+                spans.append((match.end() - match.start(), len(lowered), lowered, entry_id))
+        take(SUBSEQUENCE, (match[3] for match in heapq.nsmallest(limit - len(results), spans)))
+        return results
+
+    @staticmethod
+    def _prefix_range(items: List[Tuple[str, int]], prefix: str) -> Iterable[Tuple[str, int]]:
+        position = bisect.bisect_left(items, (prefix,))
+        while position < len(items) and items[position][0].startswith(prefix):
+            yield items[position]
+            position += 1
+
+    @staticmethod
+    def _intersect(postings: Dict[str, Set[int]], tokens: Set[str]) -> Set[int]:
+        """Ids present in every token's posting set, smallest sets first"""
+        sets = sorted((postings.get(token, set()) for token in tokens), key=len)
+        if not sets or not sets[0]:
+            return set()
+        return sets[0].intersection(*sets[1:])
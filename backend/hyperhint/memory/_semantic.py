@@ -0,0 +1,589 @@
+# Semantic retrieval over knowledge files: text files are split into chunks and embedded by the configured model
+# Unit-length float32 vectors live in a memory-mapped file; a query scans it block by block for the top-k by cosine
+# A background task embeds new and changed files in batches, the same way the full-text index follows the catalog
+
+import asyncio
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from hyperhint.llm import llm_manager
+from hyperhint.llm._prompt import bytes_per_token, estimate_tokens, trim_to_tokens
+
+STORE_VERSION = 1
+DEFAULT_STORE_PATH = Path(__file__).parent.parent.parent / "data" / "cache" / "embeddings"
+
+Span = Tuple[int, int]  # (start, end) character offsets of a chunk in its file
+Hit = Tuple[str, int, int, float]  # (document, start, end, score)
+
+
+def chunk_spans(text: str, max_chars: int, overlap_chars: int = 0) -> List[Span]:
+    """Split text into chunks of at most `max_chars`, cut at a paragraph, line or word break when possible"""
+    spans: List[Span] = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + max_chars, length)
+        if end < length:
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, start + max_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        if text[start:end].strip():
+            spans.append((start, end))
+        if end >= length:
+            break
+        # The next chunk repeats the tail of this one, starting at a word
+        overlap_start = max(end - overlap_chars, start + 1)
+        if overlap_start < end and not text[overlap_start - 1].isspace():
+            space = text.find(" ", overlap_start, end)
+            overlap_start = space + 1 if space != -1 else end
+        start = overlap_start
+    return spans
+
+
+class VectorStore:
+    """Unit-length float32 vectors in a memory-mapped file, with exact top-k search by cosine similarity
+
+    Each row holds one chunk of a document. Rows of removed documents are
+    reused, so the file only grows with the number of live chunks. The
+    row table is pickled next to the vectors by save().
+
+    Only one process writes the files at a time: the first to load() holds
+    a lock file until close(), and any other process (e.g. another server
+    worker) keeps its vectors in a temporary directory of its own instead.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.base = Path(path or os.getenv("EMBEDDING_STORE_PATH", "") or DEFAULT_STORE_PATH)
+        self._set_base(self.base)
+        self._lock_file = None
+        self._private_dir: Optional[str] = None
+        self.block_rows = 65536
+        self.model: Optional[str] = None
+        self.dim = 0
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _set_base(self, base: Path):
+        self.vectors_path = base.with_suffix(".f32")
+        self.meta_path = base.with_suffix(".pickle")
+        self.lock_path = base.with_suffix(".lock")
+
+    def _claim(self):
+        """Lock the store for this process, or switch to a private copy when another process has it"""
+        if self._lock_file is not None or self._private_dir is not None or fcntl is None:
+            return
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            self._private_dir = tempfile.mkdtemp(prefix="hyperhint-embeddings-")
+            print(f"Embedding store {self.meta_path} is in use by another process, keeping this one's in {self._private_dir}")
+            self._set_base(Path(self._private_dir) / self.base.name)
+            return
+        self._lock_file = lock_file
+
+    def close(self):
+        """Forget the loaded vectors and release the lock file, or delete this process's private copy"""
+        with self._lock:
+            self._clear()
+            self.model, self.dim, self.dirty = None, 0, False
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            if self._private_dir is not None:
+                shutil.rmtree(self._private_dir, ignore_errors=True)
+                self._private_dir = None
+                self._set_base(self.base)
+
+    def _clear(self):
+        self._matrix = None  # memmap of shape (capacity, dim)
+        self._live = np.zeros(0, dtype=bool) if np is not None else None
+        self._rows: List[Optional[Tuple[str, int, int]]] = []  # row -> (document, start, end), None when free
+        self._docs: Dict[str, Tuple[Optional[int], List[int]]] = {}  # document -> (mtime_ns, rows)
+        self._free: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._rows) - len(self._free)
+
+    @property
+    def documents(self) -> int:
+        return len(self._docs)
+
+    def keys(self) -> List[str]:
+        return list(self._docs)
+
+    def version(self, key: str) -> Optional[int]:
+        """mtime_ns of the embedded copy of a document, or None when it is not embedded"""
+        doc = self._docs.get(key)
+        return doc[0] if doc else None
+
+    def load(self) -> bool:
+        """Open the saved store; on any mismatch start empty"""
+        with self._lock:
+            self._claim()
+            try:
+                with open(self.meta_path, "rb") as f:
+                    state = pickle.load(f)
+                if not isinstance(state, dict) or state.get("version") != STORE_VERSION:
+                    return False
+                rows, dim = state["rows"], state["dim"]
+                matrix = None
+                if dim:
+                    capacity = self.vectors_path.stat().st_size // (4 * dim)
+                    if capacity < len(rows):
+                        return False
+                    matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, dim))
+            except FileNotFoundError:
+                return False
+            except Exception as e:
+                print(f"Ignoring embedding store {self.meta_path}: {e}")
+                return False
+
+            self.model, self.dim = state["model"], dim
+            self._matrix = matrix
+            self._rows, self._docs = rows, state["docs"]
+            self._free = [row for row, entry in enumerate(rows) if entry is None]
+            self._live = np.zeros(0 if matrix is None else matrix.shape[0], dtype=bool)
+            self._live[[row for row, entry in enumerate(rows) if entry is not None]] = True
+            self.dirty = False
+            return True
+
+    def reset(self, model: Optional[str]):
+        """Drop every vector, e.g. because the embedding model changed"""
+        with self._lock:
+            self._matrix = None
+            self._clear()
+            self.model, self.dim = model, 0
+            try:
+                os.unlink(self.vectors_path)
+            except OSError:
+                pass
+            self.dirty = True
+
+    def _grow(self, needed: int):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 1024)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        self.vectors_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(capacity * self.dim * 4)
+        self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+        self._live = np.concatenate([self._live, np.zeros(capacity - len(self._live), dtype=bool)])
+
+    def add(self, key: str, mtime_ns: Optional[int], spans: List[Span], vectors: List[List[float]]):
+        """Replace a document's chunks; the first vector added fixes the store's dimension"""
+        matrix = None
+        if spans:
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(spans), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+
+        with self._lock:
+            if matrix is not None and not self.dim:
+                self.dim = matrix.shape[1]
+            if matrix is not None and matrix.shape[1] != self.dim:
+                raise ValueError(f"expected {self.dim}-dimensional vectors, got {matrix.shape[1]}")
+            self.remove(key)
+
+            rows = []
+            for _ in spans:
+                if self._free:
+                    rows.append(self._free.pop())
+                else:
+                    rows.append(len(self._rows))
+                    self._rows.append(None)
+            if rows:
+                self._grow(len(self._rows))
+                self._matrix[rows] = matrix
+                self._live[rows] = True
+            for row, (start, end) in zip(rows, spans):
+                self._rows[row] = (key, start, end)
+            self._docs[key] = (mtime_ns, rows)
+            self.dirty = True
+
+    def remove(self, key: str):
+        with self._lock:
+            doc = self._docs.pop(key, None)
+            if doc is None:
+                return
+            for row in doc[1]:
+                self._rows[row] = None
+                self._live[row] = False
+                self._free.append(row)
+            self.dirty = True
+
+    def search(
+        self,
+        vector: List[float],
+        limit: int = 10,
+        documents: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Hit]:
+        """Best `limit` chunks by cosine similarity of at least `min_score`, optionally only within or outside some documents"""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        with self._lock:
+            if self._matrix is None or not len(self) or norm == 0 or query.shape[0] != self.dim or limit <= 0:
+                return []
+            query = query / norm
+
+            if documents is not None:
+                rows = np.array([row for key in documents for row in self._docs.get(key, (None, []))[1]], dtype=np.int64)
+                if not len(rows):
+                    return []
+                scores = self._matrix[rows] @ query
+                best = np.argsort(-scores)[:limit]
+                candidates = list(zip(scores[best].tolist(), rows[best].tolist()))
+            else:
+                allowed = self._live
+                if exclude:
+                    allowed = allowed.copy()
+                    allowed[[row for key in exclude for row in self._docs.get(key, (None, []))[1]]] = False
+                candidates = []
+                # Score a block of rows at a time so a large store is never read into memory at once
+                for start in range(0, len(self._rows), self.block_rows):
+                    stop = min(start + self.block_rows, len(self._rows))
+                    scores = self._matrix[start:stop] @ query
+                    scores[~allowed[start:stop]] = -np.inf
+                    if stop - start > limit:
+                        best = np.argpartition(-scores, limit)[:limit]
+                    else:
+                        best = np.arange(stop - start)
+                    candidates.extend(
+                        (score, start + row) for score, row in zip(scores[best].tolist(), best.tolist()) if score > -np.inf
+                    )
+                candidates = sorted(candidates, reverse=True)[:limit]
+
+            if min_score is not None:
+                candidates = [(score, row) for score, row in candidates if score >= min_score]
+            return [(*self._rows[row], score) for score, row in candidates]
+
+    def save(self) -> bool:
+        """Flush the vectors and write the row table to a temp file renamed into place"""
+        with self._lock:
+            if self._matrix is not None:
+                self._matrix.flush()
+            state = {
+                "version": STORE_VERSION,
+                "model": self.model,
+                "dim": self.dim,
+                "rows": self._rows,
+                "docs": self._docs,
+            }
+            tmp_path = None
+            try:
+                self.meta_path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.meta_path.parent, prefix=f".{self.meta_path.name}.", suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, self.meta_path)
+                self.dirty = False
+                return True
+            except Exception as e:
+                print(f"Error saving embedding store: {e}")
+                if tmp_path is not None:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                return False
+
+
+class SemanticIndexer:
+    """Keep a VectorStore of chunk embeddings in step with the text files of a KnowledgeFileHandler"""
+
+    def __init__(self, handler: Any, store: Optional[VectorStore] = None):
+        self.handler = handler
+        self.enabled = os.getenv("EMBEDDING_INDEX_ENABLED", "True").lower() == "true" and np is not None
+        self.store = store or (VectorStore() if np is not None else None)
+        self.chunk_tokens = int(os.getenv("EMBEDDING_CHUNK_TOKENS", "256"))
+        self.overlap_tokens = int(os.getenv("EMBEDDING_CHUNK_OVERLAP_TOKENS", "32"))
+        self.max_bytes = int(os.getenv("EMBEDDING_MAX_FILE_BYTES", str(1024 * 1024)))
+        self.retry_interval = float(os.getenv("EMBEDDING_RETRY_INTERVAL", "30"))
+        self.query_timeout = float(os.getenv("EMBEDDING_QUERY_TIMEOUT", "5"))
+        self.min_score = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.3"))
+        self.chunks_per_call = max(int(os.getenv("EMBEDDING_CHUNKS_PER_CALL", "64")), 1)
+        self.files_per_batch = 16
+        self.error: Optional[str] = None
+        self._pending: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def ready(self) -> bool:
+        """Whether there are vectors from the model currently configured"""
+        return (
+            self.enabled
+            and len(self.store) > 0
+            and self.store.model is not None
+            and self.store.model == llm_manager.get_embedding_model()
+        )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "model": self.store.model if self.store else None,
+            "documents": self.store.documents if self.store else 0,
+            "chunks": len(self.store) if self.store else 0,
+            "pending_documents": self.pending,
+            "error": self.error,
+        }
+
+    def mark(self, item: Any):
+        """Queue a cataloged file for (re)embedding"""
+        if not self.enabled or not self.handler.is_text_file(item):
+            return
+        self._pending.add(item.metadata["absolute_path"])
+        self.wake()
+
+    def forget(self, item: Any):
+        path = item.metadata.get("absolute_path")
+        if path and self.enabled:
+            self._pending.discard(path)
+            self.store.remove(path)
+
+    def wake(self):
+        """Look for work now, e.g. after the embedding model was configured"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _queue_stale(self):
+        for item in self.handler.memory:
+            if self.handler.is_text_file(item) and self.store.version(item.metadata["absolute_path"]) != item.metadata.get("mtime_ns"):
+                self._pending.add(item.metadata["absolute_path"])
+
+    async def start(self):
+        """Open the saved store, queue whatever changed since, then follow the catalog"""
+        if not self.enabled or self._task is not None:
+            return
+        await asyncio.to_thread(self.store.load)
+        for key in self.store.keys():
+            if self.handler.find_by_path(key) is None:
+                self.store.remove(key)
+        self._queue_stale()
+
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._wakeup = None
+        if self.enabled:
+            if self.store.dirty:
+                await asyncio.to_thread(self.store.save)
+            self.store.close()
+
+    async def _run(self):
+        while True:
+            # Also wake up now and then to retry after a failed batch
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.retry_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            model = llm_manager.get_embedding_model()
+            if not model:
+                continue
+            if self.store.model != model:
+                if self.store.model is not None:
+                    print(f"Embedding model changed to '{model}', re-embedding knowledge files")
+                await asyncio.to_thread(self.store.reset, model)
+                self._queue_stale()
+
+            while self._pending:
+                batch = [self._pending.pop() for _ in range(min(self.files_per_batch, len(self._pending)))]
+                stored: Set[str] = set()
+                try:
+                    await self._embed_batch(batch, model, stored)
+                    self.error = None
+                except Exception as e:
+                    self._pending.update(
+                        path for path in batch if path not in stored and self.handler.find_by_path(path) is not None
+                    )
+                    if self.error != str(e):
+                        print(f"Error embedding knowledge files, retrying in {self.retry_interval:g}s: {e}")
+                    self.error = str(e)
+                    break
+
+            if not self._pending and self.store.dirty:
+                await asyncio.to_thread(self.store.save)
+
+    def _read(self, path: str) -> Optional[str]:
+        try:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read(self.max_bytes)
+        except OSError:
+            return None
+
+    def _read_batch(self, paths: Iterable[str]) -> Dict[str, Optional[Tuple[int, List[Span], List[str]]]]:
+        """Chunk each file; the texts sent for embedding start with the file name for context"""
+        max_chars = max(int(self.chunk_tokens * bytes_per_token()), 64)
+        overlap_chars = min(int(self.overlap_tokens * bytes_per_token()), max_chars // 2)
+        documents: Dict[str, Optional[Tuple[int, List[Span], List[str]]]] = {}
+        for path in paths:
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                documents[path] = None
+                continue
+            text = self._read(path)
+            if text is None:
+                documents[path] = None
+                continue
+            spans = chunk_spans(text, max_chars, overlap_chars)
+            name = os.path.basename(path)
+            documents[path] = (mtime_ns, spans, [f"{name}\n{text[start:end]}" for start, end in spans])
+        return documents
+
+    async def _embed_batch(self, paths: List[str], model: str, stored: Set[str]):
+        """Embed at most chunks_per_call chunks per request and store each file once all of its vectors are in"""
+        documents = await asyncio.to_thread(self._read_batch, paths)
+        chunks: List[Tuple[str, str]] = []
+        vectors: Dict[str, List[List[float]]] = {}
+        for path, document in documents.items():
+            if document is not None:
+                vectors[path] = []
+                chunks.extend((path, text) for text in document[2])
+
+        async def store_finished():
+            finished = [
+                path for path in documents
+                if path not in stored and (documents[path] is None or len(vectors[path]) == len(documents[path][1]))
+            ]
+            if finished:
+                await asyncio.to_thread(self._store_documents, {path: documents[path] for path in finished}, vectors)
+                stored.update(finished)
+
+        await store_finished()
+        for start in range(0, len(chunks), self.chunks_per_call):
+            call = chunks[start:start + self.chunks_per_call]
+            result = await llm_manager.embed([text for _, text in call], model)
+            if not result.get("success"):
+                raise RuntimeError(result.get("error"))
+            for (path, _), vector in zip(call, result["embeddings"]):
+                vectors[path].append(vector)
+            await store_finished()
+
+    def _store_documents(
+        self, documents: Dict[str, Optional[Tuple[int, List[Span], List[str]]]], vectors: Dict[str, List[List[float]]]
+    ):
+        for path, document in documents.items():
+            if document is None or self.handler.find_by_path(path) is None:
+                self.store.remove(path)
+            else:
+                self.store.add(path, document[0], document[1], vectors[path])
+
+    async def retrieve(
+        self,
+        query: str,
+        max_tokens: int,
+        paths: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        timeout: Optional[float] = None,
+        min_score: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """Most relevant chunks for the query that fit in `max_tokens`, best first
+
+        `paths` limits the search to some documents and `exclude` leaves some
+        out. Chunks scoring below `min_score` (RETRIEVAL_MIN_SCORE by default)
+        are dropped, so an unrelated question retrieves nothing. Returns [] when
+        nothing is embedded or the query cannot be embedded in time, so callers
+        can go on without it.
+        """
+        if not self.ready or not query.strip() or max_tokens <= 0:
+            return []
+        result = await llm_manager.embed(
+            [query], self.store.model, priority="interactive",
+            timeout=self.query_timeout if timeout is None else min(timeout, self.query_timeout),
+        )
+        if not result.get("success"):
+            print(f"Skipping knowledge retrieval: {result.get('error')}")
+            return []
+
+        limit = max(max_tokens // max(self.chunk_tokens, 1) * 2, 8)
+        hits = await asyncio.to_thread(
+            self.store.search, result["embeddings"][0], limit, paths, exclude,
+            self.min_score if min_score is None else min_score,
+        )
+        # Chunks of files changed since they were embedded may point at the wrong text
+        current = {}
+        for key in {hit[0] for hit in hits}:
+            item = self.handler.find_by_path(key)
+            if item is not None and item.metadata.get("mtime_ns") == self.store.version(key):
+                current[key] = item
+        hits = [hit for hit in hits if hit[0] in current]
+        excerpts = await asyncio.to_thread(self._excerpts, hits, max_tokens)
+
+        return [
+            {
+                "name": current[key].name,
+                "path": current[key].file_path,
+                "start": start,
+                "end": end,
+                "score": round(score, 4),
+                "tokens": tokens,
+                "text": text,
+            }
+            for key, start, end, score, text, tokens in excerpts
+        ]
+
+    def _excerpts(self, hits: List[Hit], max_tokens: int) -> List[Tuple[str, int, int, float, str, int]]:
+        """Take hits in score order while they fit, skipping overlaps with chunks already taken"""
+        texts: Dict[str, str] = {}
+        taken: Dict[str, List[Span]] = {}
+        excerpts = []
+        used = 0
+        for key, start, end, score in hits:
+            if key not in texts:
+                texts[key] = self._read(key) or ""
+            if any(start < other_end and other_start < end for other_start, other_end in taken.get(key, [])):
+                continue
+            text = texts[key][start:end].strip()
+            tokens = estimate_tokens(text)
+            if not text:
+                continue
+            if used + tokens > max_tokens:
+                if excerpts:
+                    continue
+                # A budget smaller than one chunk still gets the best one, shortened
+                text = trim_to_tokens(text, max_tokens)
+                tokens = estimate_tokens(text)
+            excerpts.append((key, start, end, score, text, tokens))
+            taken.setdefault(key, []).append((start, end))
+            used += tokens
+        return excerpts
@@ -0,0 +1,174 @@
+# Keep the knowledge file catalog in step with the directory without full rescans
+# Uses watchfiles (inotify/FSEvents/kqueue) when it is installed, otherwise polls a stat snapshot
+# Event storms are coalesced; each touched path is stat-ed once and applied as its current state
+
+import asyncio
+import os
+from stat import S_ISDIR
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+PathState = Tuple[bool, Optional[int], Optional[int]]  # (is_dir, size, mtime_ns)
+
+
+def _state(stat: os.stat_result, is_dir: bool) -> PathState:
+    return (True, None, None) if is_dir else (False, stat.st_size, stat.st_mtime_ns)
+
+
+class KnowledgeWatcher:
+    """Apply create, modify, delete and move events to a KnowledgeFileHandler"""
+
+    def __init__(self, handler: Any, mode: Optional[str] = None):
+        self.handler = handler
+        self.mode = (mode or os.getenv("KNOWLEDGE_WATCH_MODE", "auto")).lower()  # auto, native, poll or off
+        self.debounce_ms = int(os.getenv("KNOWLEDGE_WATCH_DEBOUNCE_MS", "200"))
+        self.poll_interval = float(os.getenv("KNOWLEDGE_WATCH_POLL_INTERVAL", "1"))
+        self.active_mode: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        if self.running or self.mode == "off":
+            return
+        if not self.handler.data_path.is_dir():
+            print(f"Not watching knowledge files, directory not found: {self.handler.data_path}")
+            return
+
+        if self.mode == "poll" or watchfiles is None:
+            if self.mode == "native":
+                print("watchfiles is not installed, polling knowledge files instead")
+            self.active_mode = "poll"
+            self._task = asyncio.get_running_loop().create_task(self._watch_poll())
+        else:
+            self.active_mode = "native"
+            self._stop_event = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._watch_native())
+
+    async def stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.active_mode = None
+
+    async def sync(self) -> Dict[str, PathState]:
+        """Reconcile the catalog with one stat pass over the tree; returns the snapshot"""
+        snapshot = await asyncio.to_thread(self._snapshot)
+        self._apply(self._diff(snapshot))
+        return snapshot
+
+    def reconcile(self) -> Dict[str, int]:
+        """Blocking version of sync() for use before the event loop serves requests"""
+        return self.handler.apply_changes(self._diff(self._snapshot()))
+
+    def _diff(self, snapshot: Dict[str, PathState]) -> Dict[str, Optional[PathState]]:
+        known = self.handler.catalog_state()
+        return {
+            path: snapshot.get(path)
+            for path in snapshot.keys() | known.keys()
+            if snapshot.get(path) != known.get(path)
+        }
+
+    async def apply_paths(self, paths: Iterable[str]):
+        """Stat the given paths off the event loop and apply their current state"""
+        changes = await asyncio.to_thread(self._stat_paths, set(paths))
+        self._apply(changes)
+
+    def _apply(self, changes: Dict[str, Optional[PathState]]):
+        if not changes:
+            return
+        counts = self.handler.apply_changes(changes)
+        if any(counts.values()):
+            print(
+                f"Knowledge files updated: {counts['added']} added, "
+                f"{counts['updated']} updated, {counts['removed']} removed"
+            )
+
+    async def _watch_native(self):
+        await self.sync()  # Catch up on anything that changed since the initial scan
+        try:
+            async for events in watchfiles.awatch(
+                self.handler.data_path,
+                debounce=self.debounce_ms,
+                step=50,
+                stop_event=self._stop_event,
+                recursive=True,
+            ):
+                try:
+                    await self.apply_paths(path for _, path in events)
+                except Exception as e:
+                    print(f"Error applying knowledge file changes: {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Native file watching failed ({e}), polling knowledge files instead")
+            self.active_mode = "poll"
+            await self._watch_poll()
+
+    async def _watch_poll(self):
+        snapshot = await self.sync()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                current = await asyncio.to_thread(self._snapshot)
+                changes = {
+                    path: current.get(path)
+                    for path in current.keys() | snapshot.keys()
+                    if current.get(path) != snapshot.get(path)
+                }
+                snapshot = current
+                self._apply(changes)
+            except Exception as e:
+                print(f"Error polling knowledge files: {e}")
+
+    def _snapshot(self) -> Dict[str, PathState]:
+        """State of every path the catalog covers"""
+        snapshot: Dict[str, PathState] = {}
+        self._walk(str(self.handler.data_path), 0, snapshot)
+        return snapshot
+
+    def _walk(self, path: str, depth: int, snapshot: Dict[str, PathState]):
+        if depth >= self.handler.max_depth:
+            return
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    try:
+                        if entry.is_file():
+                            snapshot[entry.path] = _state(entry.stat(), False)
+                        elif entry.is_dir():
+                            snapshot[entry.path] = (True, None, None)
+                            self._walk(entry.path, depth + 1, snapshot)
+                    except OSError:
+                        continue  # Removed while we were looking
+        except OSError:
+            pass  # Unreadable or already gone
+
+    def _stat_paths(self, paths: Iterable[str]) -> Dict[str, Optional[PathState]]:
+        """Current state of each path; directories that are new to the catalog bring their contents"""
+        changes: Dict[str, Optional[PathState]] = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                changes[path] = None
+                continue
+            is_dir = S_ISDIR(stat.st_mode)
+            changes[path] = _state(stat, is_dir)
+            # A directory moved in arrives as a single event for the directory itself
+            if is_dir and self.handler.find_by_path(path) is None:
+                depth = len(os.path.relpath(path, self.handler.data_path).split(os.sep))
+                self._walk(path, depth, changes)
+        return changes
@@ -1,17 +1,58 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from hyperhint._startup import startup_timer
+from hyperhint.llm import llm_manager
+from hyperhint.memory import action_handler, knowledge_file_handler
 from hyperhint.server.routes import router
 from hyperhint.server.sse import sse_router
 from hyperhint.server.websocket import websocket_router
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the singletons and start background workers on startup, stop them on shutdown"""
+    # Reading the LLM config and scanning the knowledge files are independent blocking work
+    await asyncio.gather(
+        asyncio.to_thread(llm_manager.get),
+        asyncio.to_thread(knowledge_file_handler.get),
+        asyncio.to_thread(action_handler.get),
+    )
+    with startup_timer.phase("config.start"):
+        await llm_manager.service_config.start()
+    with startup_timer.phase("knowledge_watcher.start"):
+        await knowledge_file_handler.watcher.start()
+    with startup_timer.phase("knowledge_content.start"):
+        await knowledge_file_handler.content.start()
+    with startup_timer.phase("knowledge_semantic.start"):
+        await knowledge_file_handler.semantic.start()
+    with startup_timer.phase("health.start"):
+        await llm_manager.health.start()
+    with startup_timer.phase("warmup.start"):
+        await llm_manager.warmup.start()
+    startup_timer.ready()
+    try:
+        yield
+    finally:
+        await llm_manager.warmup.stop()
+        await llm_manager.health.stop()
+        await llm_manager.service_config.stop()
+        await knowledge_file_handler.watcher.stop()
+        await knowledge_file_handler.content.stop()
+        await knowledge_file_handler.semantic.stop()
+        await asyncio.to_thread(knowledge_file_handler.save_catalog_if_changed)
+
+
 def create_app() -> FastAPI:
     """Create and configure the FastAPI application"""
     app = FastAPI(
         title="HyperHint API",
         description="Real-time file and action suggestion API with SSE streaming",
-        version="0.1.0"
+        version="0.1.0",
+        lifespan=lifespan
     )
     
     # Add CORS middleware
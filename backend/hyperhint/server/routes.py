@@ -1,8 +1,13 @@
+import asyncio
+from datetime import datetime
+
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
-from hyperhint.llm import llm_manager
+from hyperhint._startup import startup_timer
+from hyperhint.llm import TASK_TYPES, Deadline, first_answer_line, llm_manager, transport_registry
 from hyperhint.memory import action_handler, knowledge_file_handler
 
 router = APIRouter()
@@ -27,6 +32,15 @@ class SetDefaultModelRequest(BaseModel):
     model: str
 
 
+class SetEmbeddingModelRequest(BaseModel):
+    model: Optional[str] = None  # None clears it
+
+
+class TaskRouteRequest(BaseModel):
+    task: str  # one of TASK_TYPES
+    models: List[str]  # in order of preference; empty removes the route
+
+
 class UpdateFileContentRequest(BaseModel):
     path: str
     content: str
@@ -44,19 +58,26 @@ Previews:
 """
     messages = [{"role": "user", "content": prompt}]
 
-    filename_content = ""
-    async for chunk in llm_manager.stream_chat(messages):
-        if chunk.get("type") == "content":
-            filename_content += chunk.get("content", "")
+    result = await llm_manager.complete(
+        messages,
+        max_tokens=llm_manager.filename_max_tokens,
+        timeout=llm_manager.filename_timeout,
+        cache=True,
+        priority="filename",
+        task="filename",
+    )
+    filename_content = result.get("content", "") if result.get("success") else ""
 
     import re
 
-    filename = filename_content.strip().lower().replace(" ", "_")
+    filename = first_answer_line(filename_content).lower().replace(" ", "_")
     filename = re.sub(r"[^a-z0-9_]", "", filename)
     filename = re.sub(r"__+", "_", filename)
 
     if not filename:
-        filename = "knowledge_file"
+        # Same heuristic as the knowledge action: the first words of the previews
+        words = re.findall(r"\b[a-zA-Z]{3,}\b", request.previews.lower())
+        filename = "_".join(words[:2]) if words else "knowledge_file"
 
     return {"filename": filename}
 
@@ -71,6 +92,37 @@ async def get_file_suggestions(q: str = Query("", description="Search query")):
         raise HTTPException(status_code=500, detail=f"Error searching files: {str(e)}")
 
 
+@router.get("/files/search")
+async def search_file_contents(
+    q: str = Query(..., description="Words to look for inside files"),
+    limit: int = Query(10, ge=1, le=100, description="Maximum number of results"),
+):
+    """Full-text search inside text knowledge files, ranked with BM25"""
+    try:
+        results = await knowledge_file_handler.content.search(q, limit)
+        return {
+            "query": q,
+            "results": results,
+            "indexed_documents": len(knowledge_file_handler.content.index),
+            "pending_documents": knowledge_file_handler.content.pending,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching file contents: {str(e)}")
+
+
+@router.get("/files/related")
+async def get_related_chunks(
+    q: str = Query(..., description="Text to find related knowledge for"),
+    max_tokens: int = Query(1024, ge=1, le=32768, description="Token budget for the returned chunks"),
+):
+    """Knowledge file chunks closest to the query by embedding similarity"""
+    try:
+        results = await knowledge_file_handler.semantic.retrieve(q, max_tokens)
+        return {"query": q, "results": results, "index": knowledge_file_handler.semantic.status()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error retrieving related knowledge: {str(e)}")
+
+
 @router.get("/files/content")
 async def get_file_content(path: str = Query(..., description="File path")):
     """Get file content by path"""
@@ -117,7 +169,7 @@ async def get_stats():
             "images": len([item for item in knowledge_file_handler.memory if item.type == "image"]),
         }
         
-        # Get LLM stats using available methods
+        # Get LLM stats from the cached health table
         models_info = llm_manager.get_available_models()
         
         llm_stats = {
@@ -125,18 +177,21 @@ async def get_stats():
             "all_models": models_info.get("all_models", []),
             "services": {
                 service_id: {
-                    "available": service_id in llm_manager.services and llm_manager.services[service_id].is_available(),
-                    "status": "Available" if service_id in llm_manager.services and llm_manager.services[service_id].is_available() else "Offline",
-                    "models": service_config.get("config", {}).get("models", [])
+                    "available": service_info["available"],
+                    "status": "Available" if service_info["available"] else "Offline",
+                    "models": service_info["models"]
                 }
-                for service_id, service_config in llm_manager.service_config.get_services().items()
+                for service_id, service_info in models_info["services"].items()
             }
         }
         
         return {
             "short_term_memory": memory_stats,
             "long_term_memory": {"total_actions": len(action_handler)},
-            "llm_services": llm_stats
+            "llm_services": llm_stats,
+            # A SQLite query; the cache lock may be held by a writer
+            "llm_cache": await asyncio.to_thread(llm_manager.cache.stats),
+            "llm_single_flight": llm_manager.single_flight.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
@@ -146,7 +201,11 @@ async def get_stats():
 async def refresh_memory():
     """Refresh memory systems"""
     try:
-        knowledge_file_handler.refresh()
+        if knowledge_file_handler.watcher.running:
+            # Changes are already applied as they happen; only reconcile what might have been missed
+            await knowledge_file_handler.watcher.sync()
+        else:
+            knowledge_file_handler.refresh()
         return {
             "message": "Memory refreshed successfully",
             "stats": {
@@ -229,8 +288,9 @@ async def execute_action(request_data: dict):
                     + f"\n{'=' * 50}"
                 )
 
-        # Execute the action
-        result = action_handler.execute_action(action_id, full_input)
+        # Execute the action; one deadline covers all of its LLM calls
+        deadline = Deadline.from_env("ACTION_DEADLINE", "120", request_data.get("timeout"))
+        result = await action_handler.execute_action(action_id, full_input, deadline=deadline)
         return result
 
     except Exception as e:
@@ -244,10 +304,10 @@ async def health_check():
         models_info = llm_manager.get_available_models()
         return {
             "status": "healthy",
-            "timestamp": "now",
+            "timestamp": datetime.now().isoformat(),
             "services": {
-                "ollama": models_info["services"]["ollama"]["status"],
-                "openai": models_info["services"]["openai"]["status"],
+                service_id: service_info["status"]
+                for service_id, service_info in models_info["services"].items()
             },
             "default_model": models_info["default_model"],
             "total_models": len(models_info["all_models"]),
@@ -261,7 +321,7 @@ async def health_check():
 async def add_service(request: ServiceConfigRequest):
     """Add a new LLM service configuration"""
     try:
-        result = llm_manager.add_service(
+        result = await llm_manager.add_service(
             request.service_id, 
             request.service_type, 
             request.config
@@ -285,7 +345,7 @@ async def remove_service(service_id: str):
 async def test_service(request: TestServiceRequest):
     """Test a service configuration without saving it"""
     try:
-        result = llm_manager.test_service(request.service_type, request.config)
+        result = await llm_manager.test_service(request.service_type, request.config)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error testing service: {str(e)}")
@@ -301,6 +361,65 @@ async def get_services():
         raise HTTPException(status_code=500, detail=f"Error getting services: {str(e)}")
 
 
+@router.get("/services/load")
+async def get_service_load():
+    """Get per-backend load, latency, circuit and queue state, and the service pool behind each model"""
+    try:
+        return {
+            "backends": llm_manager.balancer.snapshot(),
+            "breakers": {
+                service_id: breaker.to_dict()
+                for service_id, breaker in llm_manager.breakers.items()
+            },
+            "admission": llm_manager.admission.snapshot(),
+            "transports": transport_registry.stats(),
+            "draining_services": llm_manager.get_draining_count(),
+            "model_pools": llm_manager.model_mapping,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting service load: {str(e)}")
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Get per-model latency and throughput metrics in Prometheus text format"""
+    try:
+        return PlainTextResponse(llm_manager.metrics.render(), media_type="text/plain; version=0.0.4")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error rendering metrics: {str(e)}")
+
+
+@router.get("/startup")
+async def get_startup_report():
+    """Get how long this worker spent on imports, singleton construction and startup hooks"""
+    return startup_timer.report()
+
+
+@router.get("/models/routes")
+async def get_task_routes():
+    """Get the task routing table and the model each task resolves to right now"""
+    try:
+        return {
+            "tasks": list(TASK_TYPES),
+            "routes": llm_manager.service_config.get_task_routes(),
+            "resolved": {task: llm_manager.route_task(task) for task in TASK_TYPES},
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting task routes: {str(e)}")
+
+
+@router.post("/models/routes")
+async def set_task_route(request: TaskRouteRequest):
+    """Route a task type to models, in order of preference"""
+    if request.task not in TASK_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown task type: {request.task}")
+    try:
+        llm_manager.service_config.set_task_route(request.task, request.models)
+        return {"success": True, "task": request.task, "models": request.models}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error setting task route: {str(e)}")
+
+
 @router.post("/models/default")
 async def set_default_model(request: SetDefaultModelRequest):
     """Set the default model"""
@@ -309,3 +428,15 @@ async def set_default_model(request: SetDefaultModelRequest):
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error setting default model: {str(e)}")
+
+
+@router.post("/models/embedding")
+async def set_embedding_model(request: SetEmbeddingModelRequest):
+    """Set the model used to embed knowledge files for retrieval"""
+    try:
+        result = llm_manager.set_embedding_model(request.model)
+        if result.get("success"):
+            knowledge_file_handler.semantic.wake()
+        return result
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error setting embedding model: {str(e)}")
@@ -1,13 +1,15 @@
 import asyncio
 import json
+import os
+import time
 from datetime import datetime
-from typing import AsyncGenerator, Dict
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
 
 from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
 
 # Import the LLM manager and memory
-from hyperhint.llm import llm_manager
+from hyperhint.llm import Deadline, PromptSection, estimate_tokens, llm_manager
 from hyperhint.memory import knowledge_file_handler
 
 sse_router = APIRouter()
@@ -16,16 +18,131 @@ sse_router = APIRouter()
 active_streams: Dict[str, bool] = {}
 
 
+class FlushPolicy:
+    """When coalesced content chunks are flushed to the client
+
+    Content is flushed once `flush_ms` have passed since the first buffered
+    chunk or `flush_bytes` have accumulated, whichever comes first. A value
+    of 0 for both sends every chunk as its own frame.
+    """
+
+    def __init__(self, flush_ms: float = 30, flush_bytes: int = 256):
+        self.flush_ms = max(float(flush_ms), 0.0)
+        self.flush_bytes = max(int(flush_bytes), 0)
+
+    @classmethod
+    def from_env(cls, endpoint: str) -> "FlushPolicy":
+        """Read SSE_<ENDPOINT>_FLUSH_MS/_BYTES, falling back to SSE_FLUSH_MS/_BYTES"""
+        prefix = f"SSE_{endpoint.upper()}_"
+        return cls(
+            flush_ms=os.getenv(prefix + "FLUSH_MS", os.getenv("SSE_FLUSH_MS", "30")),
+            flush_bytes=os.getenv(prefix + "FLUSH_BYTES", os.getenv("SSE_FLUSH_BYTES", "256")),
+        )
+
+    def override(self, flush_ms: Optional[float] = None, flush_bytes: Optional[int] = None) -> "FlushPolicy":
+        return FlushPolicy(
+            self.flush_ms if flush_ms is None else flush_ms,
+            self.flush_bytes if flush_bytes is None else flush_bytes,
+        )
+
+
+chat_flush_policy = FlushPolicy.from_env("chat")
+
+# Knowledge pulled into chat by embedding similarity; needs an embedding model
+RETRIEVAL_CHAT_ENABLED = os.getenv("RETRIEVAL_CHAT_ENABLED", "False").lower() == "true"
+RETRIEVAL_MAX_TOKENS = int(os.getenv("RETRIEVAL_MAX_TOKENS", "1024"))
+RETRIEVAL_CONTEXT_SHARE = float(os.getenv("RETRIEVAL_CONTEXT_SHARE", "0.25"))
+
+
+def sse_event(data: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(data)}\n\n"
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[Dict[str, Any]], policy: FlushPolicy
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Merge consecutive content chunks according to the flush policy"""
+    if policy.flush_ms == 0 and policy.flush_bytes == 0:
+        async for chunk in chunks:
+            yield chunk
+        return
+
+    iterator = chunks.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    first_buffered_at = 0.0
+    sent_content = False
+    pending: Optional[asyncio.Future] = None
+
+    def take() -> Dict[str, Any]:
+        nonlocal buffer, buffered_bytes
+        merged = {"type": "content", "content": "".join(buffer)}
+        buffer, buffered_bytes = [], 0
+        return merged
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            if buffer and policy.flush_ms:
+                remaining = policy.flush_ms / 1000 - (time.perf_counter() - first_buffered_at)
+                done, _ = await asyncio.wait({pending}, timeout=max(remaining, 0))
+                if not done:
+                    # Deadline passed while the model is still thinking; send what we have
+                    yield take()
+                    continue
+
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                if pending.done():
+                    pending = None
+
+            content = chunk.get("content", "") if chunk.get("type") == "content" else None
+            # The frontend detects <think> tags per frame, so they never share one
+            if content is None or "<think>" in content or "</think>" in content or not sent_content:
+                if buffer:
+                    yield take()
+                yield chunk
+                sent_content = sent_content or content is not None
+                continue
+
+            if not buffer:
+                first_buffered_at = time.perf_counter()
+            buffer.append(content)
+            buffered_bytes += len(content)
+            if buffered_bytes >= policy.flush_bytes > 0:
+                yield take()
+
+        if buffer:
+            yield take()
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.wait({pending})
+        # Close the source right away so the upstream request is released
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
 async def generate_chat_stream(
     message: str, 
     attachments: list = None, 
     model: str = None,
     stream_id: str = None,
     selected_action: str = None,
-    knowledge_filename: str = None
+    knowledge_filename: str = None,
+    flush_policy: FlushPolicy = None,
+    deadline: Deadline = None
 ) -> AsyncGenerator[str, None]:
     """Generate streaming chat response using real LLM services"""
     
+    flush_policy = flush_policy or chat_flush_policy
+    deadline = deadline or Deadline.from_env("SSE_CHAT_DEADLINE", "300")
+    
     try:
         # Check if an action should be executed first
         if selected_action:
@@ -52,11 +169,12 @@ async def generate_chat_stream(
                     full_input += f"\n\nAttached Files:\n{'=' * 50}\n" + "\n\n".join(attachment_contents) + f"\n{'=' * 50}"
             
             # Execute the action with processed input (consistent with routes.py)
-            action_result = action_handler.execute_action(
+            action_result = await action_handler.execute_action(
                 selected_action, 
                 full_input, 
                 attachments=attachments,
-                knowledge_filename=knowledge_filename
+                knowledge_filename=knowledge_filename,
+                deadline=deadline
             )
             
             # Send action completion event
@@ -74,13 +192,15 @@ async def generate_chat_stream(
                         summary_prompt = f"""The user just saved a text note as '{filename}'. Briefly confirm that the note has been saved and analyzed. Mention it can be referenced with @{filename}. Keep the response to 1-2 sentences."""
                     
                     messages = [{"role": "user", "content": summary_prompt}]
-                    async for chunk in llm_manager.stream_chat(messages, model, stream_id):
+                    confirmation = llm_manager.stream_chat(
+                        messages, model, stream_id, task="confirmation", deadline=deadline
+                    )
+                    async for chunk in coalesce_chunks(confirmation, flush_policy):
                         if stream_id and not active_streams.get(stream_id, True):
                             yield f"data: {json.dumps({'type': 'cancelled', 'message': 'Generation stopped by user.'})}\n\n"
                             break
                         
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                        await asyncio.sleep(0.01)
+                        yield sse_event(chunk)
                     
                     return
                 else:
@@ -92,12 +212,14 @@ async def generate_chat_stream(
             messages = [{"role": "user", "content": summary_prompt}]
         
         else:
-            # Normal chat flow - prepare messages for LLM
-            messages = [{"role": "user", "content": message}]
-            
-            # Add attachment information and content to context if present
+            # Normal chat flow - fit the message and its files into the model's context window
+            builder = await llm_manager.prompt_builder(model)
+            retrieval_budget = min(RETRIEVAL_MAX_TOKENS, int(builder.budget * RETRIEVAL_CONTEXT_SHARE))
+            semantic = knowledge_file_handler.semantic
+            sections = []
+            whole_files = []  # knowledge files included in full
+            large_files = {}  # referenced knowledge files over the budget -> (name, path, full content as a fallback)
             if attachments:
-                attachment_contents = []
                 for att in attachments:
                     att_name = att.get('name', 'unknown')
                     att_type = att.get('type', 'file')
@@ -108,37 +230,68 @@ async def generate_chat_stream(
                         if att_content:
                             # Use uploaded file content directly
                             size_info = f" ({att_size} bytes)" if att_size else ""
-                            attachment_contents.append(f"File: {att_name}{size_info}\n{'-' * 40}\n{att_content}\n{'-' * 40}")
+                            sections.append(PromptSection(f"File: {att_name}{size_info}", att_content))
                         else:
-                            # Try to read file content from memory as fallback
+                            # Try to read file content from memory as fallback; the builder trims it
                             memory_item = knowledge_file_handler.find_by_name(att_name)
+                            file_content = None
+                            absolute_path = None
                             if memory_item and memory_item.file_path:
-                                file_content = knowledge_file_handler.read_file_content(memory_item.file_path)
-                                if file_content:
-                                    attachment_contents.append(f"File: {att_name} (from memory)\n{'-' * 40}\n{file_content}\n{'-' * 40}")
-                                else:
-                                    attachment_contents.append(f"File: {att_name} (content not available)")
+                                file_content = knowledge_file_handler.read_file_content(memory_item.file_path, max_size=None)
+                                # Not set for the fallback items used when the knowledge directory is missing
+                                absolute_path = memory_item.metadata.get("absolute_path")
+                            narrow = semantic.ready and absolute_path
+                            if file_content and narrow and estimate_tokens(file_content) > retrieval_budget:
+                                # Only the parts that matter to the message are sent, see below
+                                large_files[absolute_path] = (att_name, memory_item.file_path, file_content)
+                            elif file_content:
+                                if absolute_path:
+                                    whole_files.append(absolute_path)
+                                sections.append(PromptSection(f"File: {att_name} (from memory)", file_content))
                             else:
-                                attachment_contents.append(f"File: {att_name} (content not available)")
+                                sections.append(PromptSection(f"File: {att_name} (content not available)"))
                     else:
-                        attachment_contents.append(f"Attachment: {att_name} ({att_type})")
-                
-                if attachment_contents:
-                    attachment_info = f"\n\nUploaded Files:\n{'=' * 50}\n" + "\n\n".join(attachment_contents) + f"\n{'=' * 50}"
-                    messages[0]["content"] += attachment_info
+                        sections.append(PromptSection(f"Attachment: {att_name} ({att_type})"))
+            
+            # Referenced files that are too large are narrowed to their most relevant chunks;
+            # without such files, related chunks from the whole knowledge base are added
+            excerpts = []
+            if large_files or (RETRIEVAL_CHAT_ENABLED and semantic.ready):
+                excerpts = await semantic.retrieve(
+                    message,
+                    retrieval_budget,
+                    paths=list(large_files) or None,
+                    exclude=whole_files or None,
+                    timeout=deadline.remaining(),
+                    # Any part of a file the user referenced beats cutting it off at the budget
+                    min_score=-1.0 if large_files else None,
+                )
+            grouped = {}
+            for excerpt in excerpts:
+                grouped.setdefault((excerpt["name"], excerpt["path"]), []).append(excerpt)
+            for (name, _), file_excerpts in grouped.items():
+                title = f"File: {name} (relevant excerpts from memory)" if large_files else f"Knowledge: {name} (related excerpts)"
+                body = "\n[...]\n".join(excerpt["text"] for excerpt in sorted(file_excerpts, key=lambda excerpt: excerpt["start"]))
+                sections.append(PromptSection(title, body))
+            for name, file_path, file_content in large_files.values():
+                if not any(path == file_path for _, path in grouped):
+                    sections.append(PromptSection(f"File: {name} (from memory)", file_content))
+
+            content, report = builder.build(message, sections)
+            if report["message_trimmed"] or report["trimmed_sections"]:
+                print(f"Trimmed prompt to fit {report['budget']} tokens: {report['trimmed_sections']}")
+            messages = [{"role": "user", "content": content}]
         
-        # Stream from LLM manager
-        async for chunk in llm_manager.stream_chat(messages, model, stream_id):
+        # Stream from LLM manager; action summaries are confirmations, everything else is chat
+        task = "confirmation" if selected_action else "chat"
+        async for chunk in coalesce_chunks(llm_manager.stream_chat(messages, model, stream_id, task=task, deadline=deadline), flush_policy):
             # Check if stream should be cancelled
             if stream_id and not active_streams.get(stream_id, True):
                 yield f"data: {json.dumps({'type': 'cancelled', 'message': 'Generation stopped by user.'})}\n\n"
                 break
             
-            # Forward the chunk from LLM manager
-            yield f"data: {json.dumps(chunk)}\n\n"
-            
-            # Small delay for better UX
-            await asyncio.sleep(0.01)
+            # Forward the (possibly coalesced) chunk from LLM manager
+            yield sse_event(chunk)
             
     except Exception as e:
         # Send error event
@@ -167,13 +320,18 @@ async def stream_chat(request: Request):
         stream_id = body.get("stream_id", f"stream_{datetime.now().timestamp()}")
         selected_action = body.get("selected_action")
         knowledge_filename = body.get("knowledge_filename")
+        flush_policy = chat_flush_policy.override(body.get("flush_ms"), body.get("flush_bytes"))
+        # The deadline starts now, so time spent queueing for the response counts too
+        deadline = Deadline.from_env("SSE_CHAT_DEADLINE", "300", body.get("timeout"))
         
         # Track this stream
         active_streams[stream_id] = True
         
         # Return streaming response
         return StreamingResponse(
-            generate_chat_stream(message, attachments, model, stream_id, selected_action, knowledge_filename),
+            generate_chat_stream(
+                message, attachments, model, stream_id, selected_action, knowledge_filename, flush_policy, deadline
+            ),
             media_type="text/event-stream",
             headers={
                 "Cache-Control": "no-cache",
@@ -216,7 +374,6 @@ async def get_stream_status():
         "stream_ids": list(active_streams.keys()),
         "llm_status": {
             "available_models": llm_manager.get_available_models(),
-            "ollama_available": llm_manager.ollama.is_available(),
-            "openai_available": llm_manager.openai.is_available()
+            "services": llm_manager.health.snapshot()
         }
     } 
\ No newline at end of file
@@ -3,15 +3,10 @@ from typing import List
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from hyperhint.memory._actions import ActionHandler
-from hyperhint.memory._knowledge_files import KnowledgeFileHandler
+from hyperhint.memory import action_handler, knowledge_file_handler
 
 websocket_router = APIRouter()
 
-# Initialize memory instances
-knowledge_file_handler = KnowledgeFileHandler()
-action_handler = ActionHandler()
-
 # Store active WebSocket connections
 active_connections: List[WebSocket] = []
 